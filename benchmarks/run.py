@@ -0,0 +1,283 @@
+"""Benchmarks for every stage of the report and export pipeline, on fixed synthetic fixture data.
+
+Run from the repository root:
+
+    python -m benchmarks.run                          # all stages, batches of 1, 100 and 1000 tickers
+    python -m benchmarks.run --sizes 1 100 --repeat 3
+    python -m benchmarks.run --compare benchmarks/results/<earlier run>.json
+
+Results are written as JSON to benchmarks/results/ (or --output), so runs from different commits
+can be compared with --compare.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import main
+import modules.analyzer as an
+import modules.charts as charts
+import modules.getstatements as gs
+import modules.outputcache as outputcache
+import modules.providers as providers
+import modules.report as report
+from modules.logs import configure_logging
+
+
+FIXTURE_SEED = 0
+FIXTURE_AS_OF = '2025-03-31'
+RESULTS_DIR = 'benchmarks/results'
+
+
+class MemoryProvider(providers.DataProvider):
+    """Serves fixtures that were read into memory up front, so the stages are timed without file IO."""
+
+    name = 'memory'
+    cacheable = False
+
+    def __init__(self, source: providers.DataProvider, tickers):
+        self.data = {
+            ticker: {request: source.fetch(ticker, *request) for request in providers.STATEMENTS}
+            for ticker in tickers
+        }
+
+    def fetch(self, ticker, statement, frequency='annual'):
+        value = self.data[ticker.upper()][(statement, frequency)]
+        return value.copy()
+
+    def tickers(self) -> list:
+        return list(self.data)
+
+
+def measure(func, repeat):
+    """Times `func` `repeat` times, then runs it once more under tracemalloc for the peak memory."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+        'peak_memory_bytes': peak,
+        'repeat': repeat,
+    }
+
+
+def loaded_analyzer(ticker):
+    analyzer = an.FinancialAnalyzer(ticker)
+    datapoints = an.load_datapoints()
+    analyzer.load_data(datapoints['balance_sheet'], datapoints['income_statement'], datapoints['cash_flow'])
+    return analyzer
+
+
+def single_ticker_stages(ticker, workdir, repeat):
+    """Latency of every stage for one ticker."""
+    results = {}
+    analyzer = loaded_analyzer(ticker)
+    analyzer.analyze()
+    analyzer.difference()
+    company_ratios = analyzer.df_ratios
+    growth_rates = analyzer.growth_rates()
+    transposed_data = analyzer.data.set_index('Year').T / 1_000_000
+
+    statements = gs.GetStatements(ticker).fetch_all()
+
+    def ratio_chart():
+        charts.draw_ratio_chart(company_ratios, analyzer.sector, ticker).close()
+
+    def growth_chart():
+        charts.draw_growth_chart(growth_rates).close()
+
+    # A document with the same kind of content as the report: the three tables and both (already rendered) charts
+    ratio_bytes = charts.draw_ratio_chart(company_ratios, analyzer.sector, ticker).getvalue()
+    growth_bytes = charts.draw_growth_chart(growth_rates).getvalue()
+
+    def doc_build():
+        styles = report.getSampleStyleSheet()
+        elements = [report.Paragraph('Benchmark Report', styles['Title'])]
+        for table in (transposed_data, company_ratios.set_index('year').T.round(3), growth_rates.set_index('ratio').round(2)):
+            elements.append(report.create_table_from_dataframe(table))
+            elements.append(report.PageBreak())
+        elements.append(charts.flowable(io.BytesIO(ratio_bytes), 3*72, 6*72))
+        elements.append(charts.flowable(io.BytesIO(growth_bytes), 8*72, 4*72))
+        report.SimpleDocTemplate(os.path.join(workdir, 'benchmark.pdf'), pagesize=report.letter).build(elements)
+
+    stages = {
+        'load_data': lambda: loaded_analyzer(ticker),
+        'analyze': analyzer.analyze,
+        'difference': analyzer.difference,
+        'growth_rates': analyzer.growth_rates,
+        'create_table_from_dataframe': lambda: report.create_table_from_dataframe(transposed_data),
+        'ratio_chart': ratio_chart,
+        'growth_chart': growth_chart,
+        'doc_build': doc_build,
+        'export_excel': lambda: gs.export_excel(ticker, statements['annual'], statements['quarterly']),
+        'export_csv': lambda: gs.export_csv(ticker, statements['annual'], statements['quarterly']),
+        'generate_pdf_report': lambda: report.generate_pdf_report(os.path.join(workdir, 'report.pdf'), ticker),
+        'retrieve_and_export_statements': lambda: gs.retrieve_and_export_statements(ticker, excel=True, csv=True),
+    }
+
+    for name, func in stages.items():
+        results[name] = measure(func, repeat)
+        print(f"  {name:<32}{results[name]['median_s'] * 1000:>10.2f} ms  {results[name]['peak_memory_bytes'] / 1024:>10.0f} KiB")
+
+    return results
+
+
+def analysis_pipeline(ticker):
+    analyzer = loaded_analyzer(ticker)
+    analyzer.analyze()
+    analyzer.difference()
+    analyzer.growth_rates()
+
+
+def csv_export(ticker):
+    gs.retrieve_and_export_statements(ticker, excel=False, csv=True)
+
+
+def init_worker(output_dir, settings):
+    # Spawned workers import every module again, so the export directory and the fixtures are set in them too
+    gs.OUTPUT_DIR = output_dir
+    main.init_worker(settings=settings)
+
+
+def batch_throughput(tickers, sizes, workers, output_dir, settings):
+    """Tickers per second of the analysis pipeline and the CSV export, serially and on a process pool."""
+    results = {}
+
+    for size in sizes:
+        batch = tickers[:size]
+        results[str(size)] = {}
+
+        for name, func in [('analysis', analysis_pipeline), ('csv_export', csv_export)]:
+            start = time.perf_counter()
+            for ticker in batch:
+                func(ticker)
+            serial = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(output_dir, settings)) as executor:
+                list(executor.map(func, batch, chunksize=max(1, size // (workers * 4))))
+            parallel = time.perf_counter() - start
+
+            results[str(size)][name] = {
+                'serial_s': serial,
+                'serial_tickers_per_s': size / serial,
+                'parallel_s': parallel,
+                'parallel_tickers_per_s': size / parallel,
+                'workers': workers,
+            }
+            print(f"  {size:>5} tickers {name:<12} serial {size / serial:>9.1f}/s   {workers} workers {size / parallel:>9.1f}/s")
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(baseline_path, current):
+    """Prints the change of every stage's median time against an earlier result file."""
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+
+    print(f"\nCompared to {baseline_path} ({baseline.get('commit')}):")
+    for name, result in current['single_ticker'].items():
+        before = baseline.get('single_ticker', {}).get(name)
+        if before:
+            change = (result['median_s'] - before['median_s']) / before['median_s'] * 100
+            print(f"  {name:<32}{before['median_s'] * 1000:>10.2f} ms -> {result['median_s'] * 1000:>10.2f} ms  ({change:+.1f}%)")
+
+    for size, stages in current['batch'].items():
+        for name, result in stages.items():
+            before = baseline.get('batch', {}).get(size, {}).get(name)
+            if before:
+                change = (result['parallel_tickers_per_s'] - before['parallel_tickers_per_s']) / before['parallel_tickers_per_s'] * 100
+                print(f"  {size:>5} tickers {name:<12}{before['parallel_tickers_per_s']:>9.1f}/s -> {result['parallel_tickers_per_s']:>9.1f}/s  ({change:+.1f}%)")
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the pipeline on synthetic fixture data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 1000], help='Batch sizes (default: 1 100 1000).')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per single-ticker stage (default: 5).')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='Workers for the batch runs.')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<date>_<commit>.json).')
+    parser.add_argument('--compare', help='Earlier result file to compare against.')
+    args = parser.parse_args()
+    configure_logging()
+
+    workdir = tempfile.mkdtemp(prefix='fa_benchmark_')
+    try:
+        n_tickers = max(args.sizes)
+        print(f"Generating {n_tickers} fixture tickers...")
+        tickers = providers.generate_synthetic(
+            os.path.join(workdir, 'fixtures'), n_tickers, seed=FIXTURE_SEED, as_of=FIXTURE_AS_OF
+        )
+        providers.configure(MemoryProvider(providers.LocalProvider(os.path.join(workdir, 'fixtures')), tickers))
+
+        # Exports go to the temporary directory instead of data_output/ (in the workers too, which read the
+        # fixtures from disk instead of memory)
+        output_dir = os.path.join(workdir, 'output')
+        settings = {'data_dir': os.path.join(workdir, 'fixtures')}
+        gs.OUTPUT_DIR = output_dir
+        # Every repeat has to do the work instead of reusing the output of the one before (the environment
+        # variable is for workers that import the modules again)
+        os.environ['FA_OUTPUT_CACHE'] = '0'
+        outputcache.configure(enabled=False)
+        main.init_worker()
+
+        print("Single ticker latency (median) and peak memory:")
+        single = single_ticker_stages(tickers[0], workdir, args.repeat)
+
+        print("Batch throughput:")
+        batch = batch_throughput(tickers, args.sizes, args.workers, output_dir, settings)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pd.__version__,
+        'fixtures': {'seed': FIXTURE_SEED, 'as_of': FIXTURE_AS_OF, 'tickers': n_tickers},
+        'single_ticker': single,
+        'batch': batch,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}_{results['commit']}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main_benchmark()
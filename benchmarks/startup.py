@@ -0,0 +1,110 @@
+"""Startup time of the command line, using `python -X importtime`.
+
+Run from the repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --top 15 --output startup.json
+
+Every command runs against synthetic fixtures, so what is measured is interpreter startup and imports
+plus the (small) amount of local work, never the network.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import modules.outputcache as outputcache
+import modules.providers as providers
+
+
+def commands(fixtures):
+    return {
+        'python': ['-c', 'pass'],
+        'help': ['main.py', '--help'],
+        'statements_csv': ['main.py', 'SYN00000', '-s', 'csv', '--data-dir', fixtures],
+        'report': ['main.py', 'SYN00000', '-r', '--data-dir', fixtures],
+    }
+
+
+def parse_importtime(stderr):
+    """Returns [(module, self_us, cumulative_us, depth)] from the -X importtime output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def run_command(arguments, repeat, env):
+    wall = []
+    imports = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', *arguments], capture_output=True, text=True, env=env)
+        wall.append(time.perf_counter() - start)
+        imports = parse_importtime(result.stderr)
+
+    top_level = [entry for entry in imports if entry[3] == 0]
+    return {
+        'wall_median_s': statistics.median(wall),
+        'wall_min_s': min(wall),
+        'import_total_s': sum(cumulative for _, _, cumulative, _ in top_level) / 1e6,
+        'modules_imported': len(imports),
+        'top_imports': [
+            {'module': name, 'cumulative_s': cumulative / 1e6}
+            for name, _, cumulative, _ in sorted(top_level, key=lambda entry: entry[2], reverse=True)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup and import time of the command line.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per command (default: 5).')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest top-level imports to show (default: 10).')
+    parser.add_argument('--output', help='Optional JSON file for the results.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fa_startup_')
+    results = {}
+    try:
+        fixtures = os.path.join(workdir, 'fixtures')
+        providers.generate_synthetic(fixtures, 1, seed=0, as_of='2025-03-31')
+
+        # Exported statements go to the temporary directory, the cache is not used with --data-dir, and every run
+        # generates its outputs instead of reusing the ones of the run before
+        env = dict(os.environ, MPLBACKEND='Agg', FA_OUTPUT_DIR=os.path.join(workdir, 'output'), FA_OUTPUT_CACHE='0')
+        for name, arguments in commands(fixtures).items():
+            results[name] = run_command(arguments, args.repeat, env)
+            result = results[name]
+            print(f"{name:<16} wall {result['wall_median_s'] * 1000:>8.1f} ms   imports {result['import_total_s'] * 1000:>8.1f} ms ({result['modules_imported']} modules)")
+            for entry in result['top_imports'][:args.top]:
+                print(f"    {entry['module']:<40}{entry['cumulative_s'] * 1000:>8.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        for name in os.listdir('report'):
+            if name.startswith('financial_report_SYN00000_'):
+                os.remove(os.path.join('report', name))
+        manifest = outputcache.manifest_path('report', 'report', 'SYN00000')
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        try:
+            os.rmdir(os.path.dirname(manifest))  # Only when no other report recorded its inputs there
+        except OSError:
+            pass
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,330 +1,178 @@
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import PageBreak
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-import pandas as pd
-import yfinance as yf
-import modules.analyzer as an
-import matplotlib.pyplot as plt
-import numpy as np
+# Only the standard library (and the small logs/profiling modules) is imported here, the modules each command needs are imported when it runs
 import argparse
-import modules.getstatements as gs
-from datetime import datetime
 import os
+import time
+import modules.profiling as profiling
+from modules.logs import configure_logging
 
-today_date = datetime.today().strftime('%y-%m-%d')
 
-# Function to create a table from a dataframe
-def create_table_from_dataframe(df):
-    """Converts a pandas dataframe into a table for ReportLab with headers and index included."""
-    # Combine the index as the first column
-    df_with_index = df.copy()
-    df_with_index.insert(0, 'Index', df_with_index.index)
+def read_watchlist(path):
+    """Reads tickers from a watchlist file, separated by newlines, commas or whitespace. Lines starting with # are ignored."""
+    tickers = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split('#', 1)[0]
+            tickers.extend(ticker for ticker in line.replace(',', ' ').split())
+    return tickers
 
-    # Convert DataFrame to list of lists
-    data = [df_with_index.columns.tolist()] + df_with_index.values.tolist()
 
-    # Create the table
-    table = Table(data)
+def apply_settings(data_dir=None, panel=None, refresh=False):
+    """Configures the modules from the command line options. Runs in the main process and again in every
+    worker, spawned workers (the default on Windows and macOS) start with the defaults of every module."""
+    if data_dir:
+        import modules.providers as providers
 
-    # Style the table
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),  # Header background
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),  # Header text color
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),  # Center alignment
-        ('ALIGN', (0, 1), (0, -1), 'LEFT'), # Index Column alligned to the left
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),  # Header font
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),  # Header padding
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),  # Body background
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)  # Grid lines
-    ]))
+        providers.configure(providers.LocalProvider(data_dir))
 
-    return table
+    if panel is not None:
+        import modules.panelstore as panelstore
+        import modules.providers as providers
 
+        # Every worker maps the same files, so the statements are in memory once however many workers there are
+        providers.configure(panelstore.PanelProvider(panel or panelstore.PANEL_DIR))
 
-def get_info(ticker_symbol):
-    try:
-        ticker = yf.Ticker(ticker_symbol)
-        company_name = ticker.info.get("longName", "Unknown Company Name")
-        sector = ticker.info.get("sector", "Unknown Sector")
-        industry = ticker.info.get("industry", "Unknown Industry")
-        website = ticker.info.get("website", "N/A")
-
-        return {
-            "company_name": company_name,
-            "sector": sector,
-            "industry": industry,
-            "website": website
-        }
-        
-    except:
-        print("Unable to fetch company data.")
-        return {
-            "company_name": "Unknown Company Name",
-            "sector": "Unknown Sector",
-            "industry": "Unknown Industry",
-            "website": "N/A"
-            }
-    
-def plots(ticker, sector):
-    averages = pd.read_csv('data/averages.csv', header=0)
-    sector_avg = averages[sector]
+    if refresh:
+        import modules.cache as cache
+        import modules.outputcache as outputcache
 
+        cache.configure(ttl=0)
+        outputcache.configure(enabled=False)
 
-# Function to generate the PDF
-def generate_pdf_report(file_name, symbol_request='MSFT'):
-    
-    info = get_info(symbol_request)
-    if info.get('company_name') == "Unknown Company Name":
-        print('Unable to find company.')
-        return
 
-    
-    doc = SimpleDocTemplate(file_name, pagesize=letter)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    # Title Page
-    elements.append(Paragraph("Financial Performance Report", styles['Title']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("This report is meant to be used for educational purposes only and is not meant as financial advice. For more information, see documentation.", styles['Normal']))
-    elements.append(Spacer(1, 24))
-    elements.append(Paragraph(info.get("company_name"), styles['Heading2']))
-    elements.append(Paragraph(info.get("sector"), styles['Normal']))
-    elements.append(Paragraph(info.get("industry"), styles['Normal']))
-    elements.append(Paragraph(info.get("website"), styles['Normal']))
-    elements.append(Spacer(1, 48))
-
-    elements.append(Paragraph("Prepared using data from the last four years, using the 'yFinance' python library.", styles['Italic']))
-    elements.append(Paragraph(f"Report was made (yy/mm/dd): {today_date}"))
-    elements.append(Spacer(1, 48))
-    
-    elements.append(PageBreak())
-    
-    # Notable Datapoints Page
-    
-    elements.append(Paragraph("Notable Datapoints over the Last 4 Years", styles['Heading1']))
-    elements.append(Spacer(1, 24))
-    # Placeholder for Table
-
-    datapoints = pd.read_csv('data/datapoints.csv')
-    analysis = an.FinancialAnalyzer(symbol_request)
-    company_data = pd.DataFrame()
-    company_data = analysis.load_data(
-        datapoints['balance_sheet'].tolist(),
-        datapoints['income_statement'].dropna().tolist(),
-        datapoints['cash_flow'].dropna().tolist()
-    )
+def init_worker(report=False, workers=1, settings=None):
+    # Workers only ever save figures to files, never show them (set before matplotlib is imported)
+    os.environ.setdefault('MPLBACKEND', 'Agg')
 
-    company_data['Year'] = company_data['Year'].astype(int)
-    transposed_data = company_data.set_index('Year').T
-    eps = transposed_data.loc['Basic EPS']
-    transposed_data = transposed_data / 1_000_000
-    transposed_data.loc['Basic EPS'] = eps
-    # Replace this with actual DataFrame content
-    elements.append(create_table_from_dataframe(transposed_data))
-    elements.append(Paragraph("Numbers are displayed in millions (USD), where applicable, except for EPS."))
-    elements.append(Spacer(1, 24))
-    
-    elements.append(PageBreak())
-    
-    # Ratios Page
-    elements.append(Paragraph(f"Ratios for {symbol_request}", styles['Heading1']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph(f"Here are the calculated ratios for {symbol_request} over the last 4 years.", styles['Normal']))
-    elements.append(Spacer(1, 24))
-
-    # Placeholder for Ratios Table
-    company_ratios = analysis.analyze()
-    company_ratios['year'] = company_ratios['year'].astype(int)
-    transposed_ratios = company_ratios.set_index('year').T
-    transposed_ratios = transposed_ratios.round(3)
-
-    index_name_mapping = {
-        'current_ratio': 'Current Ratio',
-        'quick_ratio': 'Quick Ratio',
-        'gross_profit': 'Gross Profit',
-        'net_profit': 'Net Profit',
-        'roa': 'Return on Assets',
-        'roe': 'Return on Equity',
-        'asset_turnover': 'Asset Turnover',
-        'debt_to_equity': 'Debt to Equity',
-        'interest_cover': 'Interest Cover',
-    }
-    transposed_ratios.rename(index=index_name_mapping, inplace=True)
-
-
-    elements.append(create_table_from_dataframe(transposed_ratios))
-    elements.append(Spacer(1, 24))
-    
-    # Comparison to Sector Averages Page
-    elements.append(Paragraph(f"{symbol_request} Compared to Sector Averages", styles['Heading1']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("Microsoft's financial ratios compared to its sector averages are presented below. Positive value means that the given datapoint was above the sector average.", styles['Normal']))
-    elements.append(Paragraph("Sector averages are gathered by averaging out around 50 companies in the given sector, may not be accurate.", styles['Italic']))
-    elements.append(Spacer(1, 24))
-    # Placeholder for Sector Comparison Table
-
-    difference = analysis.difference()
-    difference = difference.set_index('ratio')
-    difference = difference.round(3)
-    difference.rename(index=index_name_mapping, inplace=True)
-
-    elements.append(create_table_from_dataframe(difference))
-    elements.append(Spacer(1, 24))
-    
-    elements.append(PageBreak())
-
-    # Growth Rates Page
-    elements.append(Paragraph(f"Growth Rates for {symbol_request}", styles['Heading1']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("The growth rates for key financial metrics are summarized below. Number are displayed in percentages.", styles['Normal']))
-    elements.append(Spacer(1, 24))
-    # Placeholder for Growth Rates Table
-
-    growth_rates = analysis.growth_rates()
-    growth_rates = growth_rates.set_index('ratio')
-    growth_rates = growth_rates.round(2)
-    growth_rates.rename(index=index_name_mapping, inplace=True)
-    elements.append(create_table_from_dataframe(growth_rates))
-    elements.append(Spacer(1, 24))
-
-    elements.append(PageBreak())
-
-    # Plots Page
-    elements.append(Paragraph("Visual Analysis of Key Metrics", styles['Heading1']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("The following graphs represent the trends and patterns of important financial metrics.", styles['Normal']))
-    # Placeholder for Plot Images
-    # images = ['path_to_plot1.png', 'path_to_plot2.png']  # Replace with actual paths
-    # for img_path in images:
-    #     elements.append(Image(img_path, width=400, height=300))
-    #     elements.append(Spacer(1, 24))
-
-    sector = info['sector'].lower()
-    averages = pd.read_csv('data/averages.csv')
-
-    ratio_index_map = {
-        'current_ratio': 0,
-        'quick_ratio': 1,
-        'gross_profit': 2,
-        'net_profit': 3,
-        'roa': 4,
-        'roe': 5,
-        'asset_turnover': 6,
-        'debt_to_equity': 7,
-        'interest_cover': 8
-    }
-    
-    columns_to_plot = ['year', 'current_ratio', 'quick_ratio', 'debt_to_equity']
-    plot_df = company_ratios[columns_to_plot]
-
-    # Step 3: Create subplots
-
-    # Subplot configuration
-    ratios_to_plot = [
-        ('current_ratio', 'Current Ratio', 'skyblue', 'Sector Avg - Current Ratio', 'blue'),
-        ('quick_ratio', 'Quick Ratio', 'lightgreen', 'Sector Avg - Quick Ratio', 'green'),
-        ('debt_to_equity', 'Debt to Equity', 'salmon', 'Sector Avg - Debt to Equity', 'red')
-    ]
-
-    x = np.arange(len(plot_df.index))  # Positions for bars
-    width = 0.25  # Narrower bars to look more compact
-
-    # Step 3: Create the subplots with a vertical orientation
-    fig, axs = plt.subplots(3, 1, figsize=(6, 12))  # More vertical layout with increased height and reduced width
-
-    for i, (column, title, color, avg_label, avg_color) in enumerate(ratios_to_plot):
-        ax = axs[i]  # Select subplot
-        
-        # Plot bars for each ratio
-        ax.bar(x, plot_df[column], width, label=f'{title} {symbol_request}', color=color)
-        
-        # Add horizontal line for the sector average
-        avg_value = averages[sector].iloc[ratio_index_map[column]]
-        for xpos in x:
-            ax.hlines(
-                y=avg_value,
-                xmin=xpos - width / 2,  # Align horizontal line with narrower bars
-                xmax=xpos + width / 2,
-                color=avg_color,
-                linestyle='--',
-                label=avg_label if xpos == 0 else None
-            )
-        
-        # Set labels and titles for each subplot
-        ax.set_xlabel('Year')
-        ax.set_ylabel('Value')
-        ax.set_title(f'{title} vs {sector} Sector Average')
-        
-        # Set the x-axis tick labels as integers (removing the decimal point)
-        ax.set_xticks(x)
-        ax.set_xticklabels(plot_df['year'].map(int))  # Use map(int) to remove the .0
-        
-        ax.legend(loc='upper right')
-
-    # Fine-tune the layout for a more compact, vertical appearance
-    plt.tight_layout()  # Automatically adjusts spacing between plots
-    plt.subplots_adjust(hspace=0.5)  # Optional: fine-tune the vertical space between subplots
-
-    # Save or show the plot
-    plt.savefig(f'data_output/{symbol_request}_ratios.png', dpi=300)
-
-    elements.append(Image(f'data_output/{symbol_request}_ratios.png', width=3*72, height=6*72))
-
-    growth_rates = analysis.growth_rates()
-    years = ['2022', '2023', '2024']
-    ratios_to_plot = growth_rates['ratio'].values  # Ratio names
-    ratios_growth = growth_rates.drop('ratio', axis=1).values  # Growth rate values for each ratio
-
-    # Plot all the growth rates on the same chart
-    plt.figure(figsize=(10, 6))
-
-    # Use matplotlib.colormaps to get a distinct colormap
-    colormap = plt.colormaps['tab10']  # Access the 'tab10' colormap
-    colors = [colormap(i / len(ratios_to_plot)) for i in range(len(ratios_to_plot))]  # Generate distinct colors
-
-    # Plot each ratio with a unique color
-    try:
-        for i, (ratio, growth) in enumerate(zip(ratios_to_plot, ratios_growth)):
-            plt.plot(years, growth, label=ratio, marker='o', color=colors[i])
-    except:
-        print("Was not able to graph data.")
+    if settings:
+        apply_settings(**settings)
 
+    if workers > 1:
+        # Every process has its own fetch scheduler, together they stay within the configured limits
+        import modules.scheduler as scheduler
 
-    # Set labels and title
-    plt.xlabel('Year')
-    plt.ylabel('Growth Rate (%)')
-    plt.title('Growth Rates of Financial Ratios Over Time')
+        scheduler.configure(
+            rate=scheduler.FETCH_RATE / workers,
+            concurrency=max(1, scheduler.FETCH_CONCURRENCY // workers),
+            burst=max(1, scheduler.FETCH_BURST // workers)
+        )
 
-    # Add a legend to identify each ratio
-    plt.legend(loc='best')
+    if report:
+        # Styles, static paragraphs and chart templates are built once per worker, not once per report
+        from modules.report import warm_up
 
-    # Add grid for better readability
-    plt.grid(True)
+        warm_up()
 
-    # Save the plot as a PNG (optional)
-    plt.savefig(f'data_output/{symbol_request}_rate_all.png', dpi=300)
-    elements.append(Image(f'data_output/{symbol_request}_rate_all.png', width=8*72, height=4*72))
-    
-    elements.append(PageBreak())
-
-    # Appendix Page
-    elements.append(Paragraph("Appendix", styles['Heading1']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("Additional Disclaimers and Notes:", styles['Heading2']))
-    elements.append(Paragraph("This report is based on data obtained from reliable sources but is for educational purposes only.", styles['Normal']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("For full financial statements and further analysis, please refer to the official filings of the company. Full financial statements can be exported into .xlsx. See Documentation.", styles['Normal']))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("Data Source: https://finance.yahoo.com/", styles['Normal']))
-    
-    # Build the document with all the elements
-    doc.build(elements)
-    os.remove(f'data_output/{symbol_request}_ratios.png')
-    os.remove(f'data_output/{symbol_request}_rate_all.png')
 
+def process_ticker(ticker_request, report, excel, csv, parquet=False, incremental=False, profile=None, cprofile=False):
+    """Runs the requested report and statement exports for one ticker, returns (ticker, error, seconds).
+    With `profile` set to a directory, the stage timings and counters of the ticker are written there as
+    <ticker>.json (and the cProfile stats as <ticker>.prof with `cprofile`)."""
+    if profile:
+        profiling.enable()
+        if cprofile:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+    start = time.perf_counter()
+    errors = []
+    stages = None
+    try:
+        if report:
+            try:
+                import modules.pipeline as pipeline
+                from modules.report import generate_pdf_report, report_path
+
+                # The report and the exports share one pipeline, so the statements are fetched once for both
+                stages = pipeline.ticker_pipeline(ticker_request, incremental=incremental)
+
+                with profiling.span('report'):
+                    if generate_pdf_report(report_path(ticker_request), ticker_request, incremental=incremental, stages=stages) is False:
+                        raise LookupError('Unable to find company.')
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+
+        # A failed report does not stop the exports, only failing to get the statements does (and then that
+        # is the exports' error too)
+        if excel or csv or parquet:
+            try:
+                import modules.getstatements as gs
+
+                with profiling.span('statements'):
+                    gs.retrieve_and_export_statements(
+                        ticker_request=ticker_request,
+                        excel=excel,
+                        csv=csv,
+                        parquet=parquet,
+                        incremental=incremental,
+                        # The incremental exports read what is already exported and only fetch when it is out of date
+                        fetched=stages.get('statements') if stages is not None and not incremental else None
+                    )
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                if error not in errors:
+                    errors.append(error)
+    finally:
+        if stages is not None:
+            stages.close()
+    error = '; '.join(errors) or None
+    elapsed = time.perf_counter() - start
+
+    if profile:
+        if cprofile:
+            profiler.disable()
+            os.makedirs(profile, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile, f'{ticker_request}.prof'))
+        profiling.write_trace(os.path.join(profile, f'{ticker_request}.json'), ticker=ticker_request, seconds=elapsed, error=error)
+        profiling.disable()
+
+    return ticker_request, error, elapsed
+
+
+def run_batch(tickers, report, excel, csv, parquet=False, workers=1, incremental=False, profile=None, cprofile=False, settings=None):
+    """Processes every ticker, one failing ticker does not stop the others. Returns {ticker: error or None}.
+    `settings` are the apply_settings options the workers are configured with."""
+    results = {}
+
+    if not report and not incremental and not profile and workers <= 1 and len(tickers) > 1:
+        # Exports only: fetching, normalizing and writing overlap, and only a few tickers are in memory at a time
+        import modules.getstatements as gs
+
+        init_worker(report)
+        for ticker, error, elapsed in gs.stream_exports(tickers, excel, csv, parquet):
+            results[ticker] = error
+            print(f"{ticker}: {'done' if error is None else 'FAILED - ' + error} ({elapsed:.1f}s)")
+        return results
+
+    if workers <= 1 or len(tickers) == 1:
+        init_worker(report)
+        for ticker in tickers:
+            ticker, error, elapsed = process_ticker(ticker, report, excel, csv, parquet, incremental, profile, cprofile)
+            results[ticker] = error
+            print(f"{ticker}: {'done' if error is None else 'FAILED - ' + error} ({elapsed:.1f}s)")
+        return results
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    workers = min(workers, len(tickers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(report, workers, settings)) as executor:
+        futures = [executor.submit(process_ticker, ticker, report, excel, csv, parquet, incremental, profile, cprofile) for ticker in tickers]
+
+        for future in as_completed(futures):
+            ticker, error, elapsed = future.result()
+            results[ticker] = error
+            print(f"{ticker}: {'done' if error is None else 'FAILED - ' + error} ({elapsed:.1f}s)")
+
+    return results
+
+
+def print_summary(results):
+    failed = {ticker: error for ticker, error in results.items() if error is not None}
+
+    print(f"\nProcessed {len(results)} tickers: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    for ticker, error in failed.items():
+        print(f"  {ticker}: {error}")
 
 
 # Call the function to generate the PDF
@@ -332,8 +180,10 @@ def main():
     
     parser = argparse.ArgumentParser(
         description='Python based program that can calculate financial ratios, growth rates, export financial statements and a report.',
-        usage="""%(prog)s <ticker_request> [-r] [-s {excel,csv} [{excel,csv} ...]]\n
+        usage="""%(prog)s <ticker_request> [<ticker_request> ...] [-w WATCHLIST] [-j WORKERS] [-r] [-s {excel,csv,parquet} [{excel,csv,parquet} ...]] [--screen QUERY [-o OUTPUT]] [--serve [PORT]]\n
                 Example: python main.py msft -r -s excel \n
+                Example: python main.py msft aapl googl -j 4 -s csv \n
+                Example: python main.py --screen "roe > 0.15 and debt_to_equity < 1, top 50 by interest_cover" \n
                 Libraries Required (run this command): pip install -r requirements.txt\n
                 Make sure pip is installed by running: pip --version"""
         )
@@ -341,7 +191,92 @@ def main():
     parser.add_argument(
         'ticker_request',  # Name of the argument
         type=str,
-        help='The ticker symbol of the company (e.g., MSFT, AAPL, etc.). Accepts all combinations of upper and lower case letters.'
+        nargs='*',
+        help='The ticker symbol(s) of the company (e.g., MSFT, AAPL, etc.). Accepts all combinations of upper and lower case letters.'
+    )
+
+    parser.add_argument(
+        '-w', '--watchlist',
+        help='File with ticker symbols to process (one per line, or separated by commas/whitespace).'
+    )
+
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Number of worker processes used when more than one ticker is given (default: number of cores).'
+    )
+
+    parser.add_argument(
+        '--data-dir',
+        help='Read statements from a directory of local fixture files instead of yFinance (see modules/providers.py).'
+    )
+
+    parser.add_argument(
+        '--panel',
+        nargs='?',
+        const='',
+        metavar='DIR',
+        help='Read statements from the memory-mapped panel store (built with python -m modules.panelstore) instead of yFinance.'
+    )
+
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Ignore cached data and fetch everything again (the cache lives in .cache/, see README), and generate every report and export again.'
+    )
+
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only fetch statements when a period newer than the exported ones can exist, and add it to the existing exports.'
+    )
+
+    parser.add_argument(
+        '--screen',
+        metavar='QUERY',
+        help='Screen every cached ticker (or the given ones) by their ratios, e.g. "roe > 0.15 and debt_to_equity < 1, top 50 by interest_cover".'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        help='File the screen results are written to (.csv, .xlsx or .parquet).'
+    )
+
+    parser.add_argument(
+        '--workbook',
+        metavar='FILE',
+        help='Also write the statements of every ticker into one consolidated .xlsx workbook.'
+    )
+
+    parser.add_argument(
+        '--workbook-layout',
+        choices=['sheets', 'long'],
+        default='sheets',
+        help='sheets: a sheet per ticker and statement, long: one sheet with a row per ticker, statement, period and line item (default: sheets).'
+    )
+
+    parser.add_argument(
+        '--serve',
+        nargs='?',
+        type=int,
+        const=8000,
+        metavar='PORT',
+        help='Serve statements, ratios, differences, growth rates and reports over a local HTTP API, keeping them in memory between requests (default PORT: 8000).'
+    )
+
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='profiles',
+        metavar='DIR',
+        help='Write the time spent in each stage and counters (network calls, cache hits, rows) of every ticker to DIR/<ticker>.json (default DIR: profiles).'
+    )
+
+    parser.add_argument(
+        '--cprofile',
+        action='store_true',
+        help='With --profile, also write the full cProfile stats of every ticker to DIR/<ticker>.prof.'
     )
 
     parser.add_argument(
@@ -353,33 +288,69 @@ def main():
     parser.add_argument(
         '-s', '--statements',
         nargs='+',  # Accept one or more formats
-        choices=['excel', 'csv'],  # Limit options to 'excel' and 'csv'
-        help='Export financial statements in specified formats (choose: excel, csv, or both).'   
+        choices=['excel', 'csv', 'parquet'],  # Limit options to 'excel', 'csv' and 'parquet'
+        help='Export financial statements in specified formats (choose: excel, csv, parquet, or several).'   
     )
 
     args = parser.parse_args()
-    args.ticker_request = args.ticker_request.upper()
 
+    tickers = list(args.ticker_request)
+    if args.watchlist:
+        tickers.extend(read_watchlist(args.watchlist))
 
-    if args.report:
-        generate_pdf_report(f"report/financial_report_{args.ticker_request}_{today_date}.pdf", args.ticker_request)
-    
-    if args.statements:
+    # Uppercase and drop duplicates (keeping the order) so no two workers write the same files
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+
+    if args.serve is None and not args.screen and (not tickers or (not args.report and not args.statements and not args.workbook)):
+        parser.print_help()
+        return
+
+    configure_logging()
 
-        export_excel = 'excel' in args.statements
-        export_csv = 'csv' in args.statements
+    settings = {'data_dir': args.data_dir, 'panel': args.panel, 'refresh': args.refresh}
+    apply_settings(**settings)
 
-        gs.retrieve_and_export_statements(
-            ticker_request = args.ticker_request,
-            excel=export_excel,
-            csv=export_csv
+    if args.serve is not None:
+        from modules.server import serve
+
+        serve(port=args.serve)
+        return
 
+    if args.screen:
+        from modules.screen import run_screen
+
+        run_screen(args.screen, tickers=tickers or None, output=args.output, rebuild=args.refresh)
+        return
+
+    statements = args.statements or []
+    results = {}
+    if args.report or statements:
+        results = run_batch(
+            tickers,
+            report=args.report,
+            excel='excel' in statements,
+            csv='csv' in statements,
+            parquet='parquet' in statements,
+            workers=args.workers,
+            incremental=args.incremental,
+            profile=args.profile or ('profiles' if args.cprofile else None),
+            cprofile=args.cprofile,
+            settings=settings
         )
 
+    if args.workbook:
+        from modules.workbook import export_watchlist
 
+        # Statements fetched by the batch above come from the cache, a ticker that failed there fails here too
+        start = time.perf_counter()
+        consolidated = export_watchlist(tickers, args.workbook, args.workbook_layout)
+        written = sum(error is None for error in consolidated.values())
+        print(f"{written} of {len(tickers)} tickers written to {args.workbook} ({time.perf_counter() - start:.1f}s)")
+        for ticker, error in consolidated.items():
+            results[ticker] = results.get(ticker) or error
 
-    if not args.report and not args.statements:
-        parser.print_help()
+    if len(tickers) > 1:
+        print_summary(results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
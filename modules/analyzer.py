@@ -1,194 +1,280 @@
-import yfinance as yf
 import pandas as pd
 import json
+from functools import lru_cache
 from typing import Final
 import logging
+import modules.cache as cache
+import modules.profiling as profiling
+import modules.ratios as ratios
+import modules.sectors as sectors
+import modules.statements as st
+from modules.logs import configure_logging
 
 
-logging.basicConfig(
-    filename='.logs/main.log',
-    filemode='w',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-)
-
-
+DATAPOINTS_FILE: Final[str] = 'data/datapoints.csv'
 MAX_YEARS_REQUEST: Final[int] = 4
-CURRENT_YEAR: Final[int] = 2024
 RATIOS = ['current_ratio', 'quick_ratio', 'gross_profit', 'net_profit', 'roa', 'roe', 'asset_turnover', 'debt_to_equity', 'interest_cover']
 METHODS = {
     1: "csv",
-    2: "xlsx"
+    2: "xlsx",
+    3: "parquet"
 }
 
-# Loading necessary datapoints from external file
-df = pd.read_csv('data/datapoints.csv')
-balance_sheet_datapoints = df['balance_sheet'].tolist()
-income_statement_datapoints = df['income_statement'].dropna().tolist()
-cash_flow_datapoints = df['cash_flow'].dropna().tolist()
+
+@lru_cache(maxsize=None)
+def load_datapoints(path: str = DATAPOINTS_FILE) -> dict:
+    """Loads the datapoints to analyze from the external file (once, on first use) as {statement: [line items]}."""
+    df = pd.read_csv(path)
+    return {
+        'balance_sheet': df['balance_sheet'].dropna().tolist(),
+        'income_statement': df['income_statement'].dropna().tolist(),
+        'cash_flow': df['cash_flow'].dropna().tolist(),
+    }
+
+
+STATEMENT_TITLES = {'balance_sheet': 'Balance Sheet', 'income_statement': 'Income Statement', 'cash_flow': 'Cash Flow'}
+
+
+def build_data(annual: dict, datapoints: dict, years=None) -> pd.DataFrame:
+    """Selects the datapoints from the annual statements ({statement: StatementFrame or DataFrame}, may be None).
+
+    All line items of a statement are selected from its value matrix at once (missing line items become NaN).
+    Rows are the fiscal period ends, newest first and at most `years` of them, with a 'Year' column in front of
+    the datapoints.
+    """
+    frames = []
+    for statement, title in STATEMENT_TITLES.items():
+        frame = st.compact(annual.get(statement))
+        selected = frame.select(datapoints[statement])
+
+        present = set(frame.index)
+        missing = [datapoint for datapoint in datapoints[statement] if datapoint not in present]
+        if missing:
+            logging.info(f'{title}: {", ".join(missing)} Datapoint Missing')
+
+        frames.append(pd.DataFrame(selected, index=datapoints[statement], columns=frame.columns))
+
+    data = pd.concat(frames).T.astype('float64')
+    data.index = pd.to_datetime(data.index)
+    data = data.sort_index(ascending=False).iloc[:years]
+    data.insert(0, 'Year', data.index.year)
+    return data
+
+
+def _on_quarters(frame):
+    # Reindexed on every calendar quarter between the first and the last one, oldest first, so rolling windows and
+    # shifts count quarters and a quarter that was not reported is a gap (NaN) instead of being skipped. Of two period
+    # ends in the same quarter (a changed fiscal year end) only the later one is kept, also in `frame`, so no row
+    # is given the values of another.
+    ends = frame.index.sort_values()
+    latest = ends[~ends.to_period('Q').duplicated(keep='last')]
+    frame = frame[frame.index.isin(latest) & ~frame.index.duplicated(keep='last')]
+    quarters = frame.index.to_period('Q')
+    full = frame.set_axis(quarters).sort_index()
+    return frame, quarters, full.reindex(pd.period_range(full.index.min(), full.index.max(), freq='Q'))
+
+
+def trailing_twelve_months(quarterly: pd.DataFrame, flow_columns) -> pd.DataFrame:
+    """TTM datapoints for every quarter end that closes four reported quarters in a row. `quarterly` is indexed
+    by the quarter ends, flow columns are summed over the window, the others are taken as of the quarter end."""
+    if quarterly.empty:
+        return quarterly
+
+    quarterly, quarters, full = _on_quarters(quarterly)
+    flow_columns = [column for column in flow_columns if column in full.columns]
+
+    ttm = full.copy()
+    ttm[flow_columns] = full[flow_columns].rolling(4, min_periods=4).sum()
+    reported = full.notna().any(axis=1).astype(int).rolling(4).sum() == 4
+
+    ttm = ttm.reindex(quarters).set_axis(quarterly.index)
+    return ttm[reported.reindex(quarters).to_numpy()]
+
+
+def growth_table(period_ratios: pd.DataFrame, lag) -> pd.DataFrame:
+    """Growth (%) of every ratio against `lag` quarters earlier, from ratios with a 'period' column (quarter ends).
+    A row per ratio, a column per quarter end that has a value `lag` quarters earlier."""
+    if period_ratios.empty:
+        return pd.DataFrame(columns=['ratio'])
+
+    values = period_ratios.set_index('period')[RATIOS]
+    values, quarters, full = _on_quarters(values)
+    previous = full.shift(lag)
+    growth = ((full - previous) / previous * 100).reindex(quarters).set_axis(values.index)
+    growth = growth[previous.reindex(quarters).notna().any(axis=1).to_numpy()]
+
+    growth = growth.T
+    growth.columns = growth.columns.strftime('%Y-%m-%d').rename(None)
+    return growth.rename_axis('ratio').reset_index()
+
+
+def _with_periods(frame):
+    frame.insert(0, 'period', frame.index)
+    return frame.reset_index(drop=True)
 
 
 class FinancialAnalyzer:
     def __init__(self, ticker, years=4):
-        self.ticker = yf.Ticker(ticker)
+        self.ticker = cache.CachedTicker(ticker)
         self.ticker_text = ticker
         self.years = list(range(years))
         self.data = pd.DataFrame()
-        self.sector = self.ticker.info.get('sector', 'n/a').lower()
+        self.info = None
+
+    @property
+    def sector(self):
+        # The info is fetched together with the statements in load_data, otherwise on first use
+        if self.info is None:
+            self.info = self.ticker.info
+        return self.info.get('sector', 'n/a').lower()
+
+    @profiling.timed('load')
+    def load_data(self, bs_datapoints, is_datapoints, cf_datapoints, incremental=False, statements=None):
+        # getting the financial data using yfinance, the statements and the company info are requested at the
+        # same time. `statements` ({statement: frame}) are annual statements already fetched, see modules/pipeline.py
+        if statements is not None:
+            annual = statements
+        elif incremental:
+            # Exported statements are used as long as no newer period can exist, the info is fetched on first use
+            import modules.incremental as incremental_refresh
+
+            annual = incremental_refresh.load_statements(self.ticker_text, 'annual')
+        else:
+            fetched = self.ticker.fetch_many([
+                ('balance_sheet', 'annual'),
+                ('income_statement', 'annual'),
+                ('cash_flow', 'annual'),
+                ('info', 'static'),
+            ], strict=True)
+            self.info = fetched[('info', 'static')] or {}
+            annual = {statement: fetched[(statement, 'annual')] for statement in ['balance_sheet', 'income_statement', 'cash_flow']}
 
-    def load_data(self, bs_datapoints, is_datapoints, cf_datapoints):
-        # getting the financial data using yfinance
-        for year in self.years:
-            company_info = {'Year': CURRENT_YEAR - year,}
+        data = build_data(annual, {'balance_sheet': bs_datapoints, 'income_statement': is_datapoints, 'cash_flow': cf_datapoints}, len(self.years))
 
-            for datapoint in bs_datapoints:
-                try:
-                    company_info[datapoint] = (
-                        self.ticker.balance_sheet.loc[datapoint].iloc[year]
-                        if datapoint in self.ticker.balance_sheet.index else "N/A"
-                    )
-                except IndexError:
-                    company_info[datapoint] = "N/A"
-                    logging.info(f'{company_info[datapoint]} Datapoint Missing')
-            
-            try:
-                for datapoint in is_datapoints:
-                    company_info[datapoint] = (
-                        self.ticker.income_stmt.loc[datapoint].iloc[year]
-                        if datapoint in self.ticker.income_stmt.index else "N/A"
-                    )
-            except IndexError:
-                company_info[datapoint] = "N/A"
-                logging.info(f'{company_info[datapoint]} Datapoint Missing')          
-
-            try:
-                for datapoint in cf_datapoints:
-                    company_info[datapoint] = (
-                        self.ticker.cash_flow.loc[datapoint].iloc[year]
-                        if datapoint in self.ticker.cashflow.index else "N/A"
-                    )
-            except IndexError:
-                company_info[datapoint] = "N/A"
-                logging.info(f'{company_info[datapoint]} Datapoint Missing')
-            
-            self.data = self.data.dropna()._append(company_info, ignore_index=True)
+        self.periods = data.index
+        self.data = data.reset_index(drop=True)
+        profiling.count('rows_loaded', len(self.data))
 
         return self.data
   
 
+    @profiling.timed('analyze')
     def analyze(self):
         try:
-            with open("data/ratios.json", 'r') as file:
-                formulas = json.load(file)
+            engine = ratios.load_engine()
         except FileNotFoundError:
-            logging.error(f"{file} File Not Found.")
+            logging.error(f"{ratios.RATIOS_FILE} File Not Found.")
             return
         except json.JSONDecodeError:
             logging.error("error decoding JSON.")
             return
-        
-
-        for column in self.data.columns:
-            self.data[column] = pd.to_numeric(self.data[column], errors='coerce')
-        
-        
-        df_ratios = pd.DataFrame() # store the ratios in a DataFrame
-
-        for year, row in self.data.iterrows():
-            current_ratios = {'year': CURRENT_YEAR - year}
-            #print(f'Ratios for {CURRENT_YEAR - year}, for {self.ticker}')
-            for ratio_name, formula in formulas.items(): # unpack the formulas 1 by 1 and calculate the ratios
-                try:
-                    formatted_formula = formula
-                    for column in row.index:
-                        formatted_formula = formatted_formula.replace(column, f"row['{column}']")
-                    result = eval(formatted_formula)
 
+        # Every ratio is computed for all years at once, missing data and division by zero give NaN
+        df_ratios = engine.evaluate(self.data)
+        df_ratios.insert(0, 'year', self.data['Year'])
 
-                    current_ratios[ratio_name] = result
-
-
-                    #print(f"  {ratio_name.replace('_', ' ')}: {result:.2f}")
-                
-                # error handling
-                except KeyError:
-                    logging.error(f"{ratio_name.replace('_', ' ')}: Data missing for calculation.")
-                except ZeroDivisionError:
-                    logging.error(f"{ratio_name.replace('_', ' ')}: Division by zero error.")
-                except Exception as e:
-                    logging.error(f"{ratio_name.replace('_', ' ')}: Calculation error - {e}")
-
-            df_ratios = df_ratios._append(current_ratios, ignore_index=True)
-            
         # Declaring and returning the ratios table
         self.df_ratios = df_ratios
 
-        #print(f"\nRatios Table:\n{df_ratios}\n")
         return df_ratios
 
     
-    # Calculating the difference between the industry average and the calculated values
+    # Calculating the difference between the industry average and the calculated values, and where the company
+    # ranks within its sector (percentile ranks need the universe file, see modules/sectors.py)
+    @profiling.timed('difference')
     def difference(self):
-        df_averages = pd.read_csv("data/averages.csv", header=0, index_col='ratios')
-        
-        self.df_difference = pd.DataFrame()
-
-        # Looping through the ratios in the outer and the years in the inner loop, this is to have every ratio in it's own line
-        for r in range(len(RATIOS)):
-            
-            difference = {'ratio': RATIOS[r]}
-
-            # Creating 2 variables for the current data to make indexing easier
-            current_avg = df_averages[self.sector].iloc[r]
-            current_r = self.df_ratios[RATIOS[r]] # Entire column of values with the name of the ratio being the header
-            
-            for year in range(len(self.years)):
-                
-                try:
-                    current_diff = (current_r[year] - current_avg)
+        benchmarks = sectors.default_benchmarks()
+        averages = benchmarks.sector_averages(self.sector).reindex(RATIOS)
+        values = self.df_ratios[RATIOS]
+        years = self.df_ratios['year'].astype(int).tolist()
+
+        # Every ratio in it's own line, the years as columns
+        difference = (values - averages).T
+        difference.columns = years
+        self.df_difference = difference.rename_axis('ratio').reset_index()
+
+        percentiles = pd.DataFrame(
+            [benchmarks.percentile_rank(self.sector, ratio, values[ratio]) for ratio in RATIOS],
+            index=pd.Index(RATIOS, name='ratio'),
+            columns=years,
+        )
+        self.df_percentiles = percentiles.reset_index()
 
-                    difference[CURRENT_YEAR - year] = current_diff
-                except KeyError:
-                    logging.error('KeyError in "difference"')
-            
-            self.df_difference = self.df_difference._append(difference, ignore_index=True)
-
-        #print(f"Difference Table: \n{self.df_difference}")
         return self.df_difference
 
 
+    @profiling.timed('growth')
     def growth_rates(self):
-        
-        self.df_growth_rates = pd.DataFrame()
+        # Growth of every ratio against the year before it, for all years at once (rows are newest first)
+        values = self.df_ratios[RATIOS]
+        previous = values.shift(-1)
+        growth = ((values - previous) / previous * 100).iloc[:-1]
 
-        for r in range(len(RATIOS)):
-            
-            growth_rates = {'ratio': RATIOS[r]}
+        growth = growth.T
+        growth.columns = self.df_ratios['year'].iloc[:-1].astype(int).tolist()
+        self.df_growth_rates = growth.rename_axis('ratio').reset_index()
 
-            current_r = self.df_ratios[RATIOS[r]] # Declaring this for easier indexing, see also 'current_r' in 'difference'
-            
-            for year in range(len(self.years) - 1):
-                
-                try:
-                    growth_rate = (current_r.iloc[year] - current_r.iloc[year + 1]) / current_r.iloc[year + 1]
-                    growth_rate *= 100
-                    growth_rates[CURRENT_YEAR - year] = growth_rate
-                except IndexError as e:
-                    logging.error(f'{e} in "growth_rates"')
-            
-            self.df_growth_rates = self.df_growth_rates._append(growth_rates, ignore_index=True)
-        
-        #print(f"\nGrowth Rate Table:\n{self.df_growth_rates}")
         return self.df_growth_rates
-    
+
+    @profiling.timed('load.quarterly')
+    def load_quarterly_data(self, bs_datapoints, is_datapoints, cf_datapoints, statements=None):
+        """Datapoints of every reported quarter (newest first) and of the trailing twelve months ending with each
+        quarter: flow items (income statement, cash flow) summed over the four quarters, balance sheet items as
+        of the quarter end. `statements` are quarterly statements already fetched, otherwise they are fetched."""
+        quarterly = statements
+        if quarterly is None:
+            fetched = self.ticker.fetch_many([(statement, 'quarterly') for statement in STATEMENT_TITLES], strict=True)
+            quarterly = {statement: fetched[(statement, 'quarterly')] for statement in STATEMENT_TITLES}
+
+        data = build_data(quarterly, {'balance_sheet': bs_datapoints, 'income_statement': is_datapoints, 'cash_flow': cf_datapoints})
+        data = data.drop(columns='Year')
+
+        self.quarterly_data = data
+        profiling.count('rows_loaded', len(data))
+        self.ttm_data = trailing_twelve_months(data, is_datapoints + cf_datapoints)
+        return self.quarterly_data
+
+    @profiling.timed('analyze.quarterly')
+    def analyze_quarterly(self):
+        engine = ratios.load_engine()
+        self.df_quarterly_ratios = _with_periods(engine.evaluate(self.quarterly_data))
+        self.df_ttm_ratios = _with_periods(engine.evaluate(self.ttm_data))
+        return self.df_quarterly_ratios, self.df_ttm_ratios
+
+    @profiling.timed('growth.quarterly')
+    def quarterly_growth_rates(self):
+        """Quarter-over-quarter and year-over-year growth (%) of the quarterly ratios, and year-over-year growth of
+        the TTM ratios, shaped like growth_rates (a row per ratio, a column per quarter end)."""
+        self.df_qoq_growth = growth_table(self.df_quarterly_ratios, 1)
+        self.df_yoy_growth = growth_table(self.df_quarterly_ratios, 4)
+        self.df_ttm_growth = growth_table(self.df_ttm_ratios, 4)
+        return self.df_qoq_growth, self.df_yoy_growth
+
     def export_csv(self):
         self.data.to_csv(f"data_output/{self.ticker_text}_data_analysis.csv", index=False)
         self.df_ratios.to_csv(f"data_output/{self.ticker_text}_ratios_analysis.csv", index=False)
         self.df_difference.to_csv(f"data_output/{self.ticker_text}_difference_analysis.csv", index=False)
+        self.df_percentiles.to_csv(f"data_output/{self.ticker_text}_percentile_analysis.csv", index=False)
 
         if len(self.years) >= 2:
             self.df_growth_rates.to_csv(f"data_output/{self.ticker_text}_growth_analysis.csv")
 
+        if hasattr(self, 'df_quarterly_ratios'):
+            self.df_quarterly_ratios.to_csv(f"data_output/{self.ticker_text}_quarterly_ratios_analysis.csv", index=False)
+            self.df_ttm_ratios.to_csv(f"data_output/{self.ticker_text}_ttm_ratios_analysis.csv", index=False)
+        if hasattr(self, 'df_qoq_growth'):
+            self.df_qoq_growth.to_csv(f"data_output/{self.ticker_text}_qoq_growth_analysis.csv", index=False)
+            self.df_yoy_growth.to_csv(f"data_output/{self.ticker_text}_yoy_growth_analysis.csv", index=False)
+
+    def export_parquet(self):
+        # Same tables as export_csv, appended to the partitioned dataset in data_output/parquet/analysis/
+        import modules.dataset as dataset
+
+        tables = {'data': self.data, 'ratios': self.df_ratios, 'difference': self.df_difference, 'percentile': self.df_percentiles}
+        if len(self.years) >= 2:
+            tables['growth'] = self.df_growth_rates
+
+        return dataset.write_analysis(self.ticker_text, tables)
 
 
 def get_int(promt: str, case: int) -> int:
@@ -238,12 +324,14 @@ def get_float(promt) -> float:
 
 
 def main():
+    configure_logging()
 
     ticker = input("Ticker Request: ").upper().strip()
     years_request = get_int("Number of years to analyze: ", case=1)
 
     analyzer = FinancialAnalyzer(ticker, years_request)
-    CompanyData: pd.DataFrame = analyzer.load_data(balance_sheet_datapoints, income_statement_datapoints, cash_flow_datapoints)
+    datapoints = load_datapoints()
+    CompanyData: pd.DataFrame = analyzer.load_data(datapoints['balance_sheet'], datapoints['income_statement'], datapoints['cash_flow'])
     Ratios: pd.DataFrame = analyzer.analyze()
     Difference: pd.DataFrame = analyzer.difference()
 
@@ -255,7 +343,7 @@ def main():
     export: bool = get_yn("Export files? ")
 
     if export:
-        export_method: int = get_int("Export Method (1: .csv, 2: .xlsx): ", case=2)
+        export_method: int = get_int("Export Method (1: .csv, 2: .xlsx, 3: .parquet): ", case=2)
 
         match export_method:
             case 1: # Exporting to .csv
@@ -276,6 +364,8 @@ def main():
                     
                     if years_request >= 2:
                         GrowthRates.to_excel(writer, sheet_name="Growth Rates", index=False)
+            case 3: # Appending to the Parquet dataset
+                analyzer.export_parquet()
             case _:
                 raise ValueError("Invalid Export Case")
     else:       
@@ -0,0 +1,313 @@
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final
+
+import modules.profiling as profiling
+import modules.providers as providers
+import modules.scheduler as scheduler
+import modules.statements as statements
+
+
+# Financial statements change at most quarterly, so a week old copy is still current
+CACHE_DIR: Final[str] = os.environ.get('FA_CACHE_DIR', '.cache')
+CACHE_TTL: Final[float] = float(os.environ.get('FA_CACHE_TTL', 7 * 24 * 60 * 60))  # seconds
+# Empty answers (a statement the company does not file, an unknown ticker) are cached too, but only briefly
+# since a throttled server gives the same answer
+EMPTY_TTL: Final[float] = float(os.environ.get('FA_CACHE_EMPTY_TTL', 6 * 60 * 60))  # seconds
+CACHE_MAX_BYTES: Final[int] = int(float(os.environ.get('FA_CACHE_MAX_MB', 512)) * 1024 * 1024)
+MEMORY_ENTRIES: Final[int] = 64  # Entries also kept in memory, so repeated access within a run skips the disk
+MAX_IN_FLIGHT: Final[int] = 7  # Max requests per ticker running at the same time in fetch_many
+
+STATEMENT_NAMES = {
+    'balance_sheet': 'Balance Sheet',
+    'income_statement': 'Income Statement',
+    'cash_flow': 'Cash Flow Statement',
+    'info': 'Company Info',
+}
+
+
+def _is_empty(value):
+    # Missing statements and throttled fetches come back as empty frames/dicts
+    if value is None:
+        return True
+    if hasattr(value, 'empty'):
+        return value.empty
+    return len(value) == 0
+
+
+class FetchCache:
+    """On-disk cache of fetched statements and company info, keyed by (ticker, statement, frequency).
+
+    Entries are zlib compressed pickles under `directory`. An entry is fresh for `ttl` seconds after
+    it was written, an empty one for `empty_ttl` seconds. When the directory grows past `max_bytes` the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, empty_ttl=EMPTY_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._size = None  # Total size on disk, computed on the first write
+        self._lock = threading.Lock()
+
+    def path(self, ticker, statement, frequency):
+        return os.path.join(self.directory, ticker.upper(), f'{frequency}_{statement}.pkl.z')
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def tickers(self) -> list:
+        """Tickers that have anything cached."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if os.path.isdir(os.path.join(self.directory, name)))
+
+    def get(self, ticker, statement, frequency, max_age=None):
+        """Returns the cached value, or None when there is no entry younger than `max_age` seconds (the ttl by default)."""
+        key = (ticker.upper(), statement, frequency)
+        path = self.path(*key)
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        age = time.time() - stat.st_mtime
+        if age > (self.ttl if max_age is None else max_age):
+            return None
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] == stat.st_mtime:
+                self._memory.move_to_end(key)
+                return None if _is_empty(entry[1]) and age > self.empty_ttl else entry[1]
+
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.loads(zlib.decompress(file.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError) as e:
+            logging.warning(f'Unreadable cache entry {path}: {e}')
+            return None
+
+        # The access time drives eviction, the modification time stays the time of the fetch
+        try:
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+
+        self._remember(key, stat.st_mtime, value)
+        return None if _is_empty(value) and age > self.empty_ttl else value
+
+    def put(self, ticker, statement, frequency, value):
+        key = (ticker.upper(), statement, frequency)
+        path = self.path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        payload = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+        # The entry that is replaced no longer counts towards the size
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+
+        # Written to a temporary file first, so readers never see a partial entry
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(payload)
+            os.replace(temporary, path)
+        except OSError as e:
+            logging.warning(f'Failed to write cache entry {path}: {e}')
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+
+        self._remember(key, os.stat(path).st_mtime, value)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(payload) - replaced
+        self.evict()
+
+    def get_or_fetch(self, ticker, statement, frequency, fetch):
+        value = self.get(ticker, statement, frequency)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            profiling.count('cache_hits')
+            return value
+
+        with self._lock:
+            self.misses += 1
+        profiling.count('cache_misses')
+
+        value = fetch()
+        if value is not None:
+            self.put(ticker, statement, frequency, value)
+        return value
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return
+
+            entries = []
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, path))
+
+            self._size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._size = None
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                os.remove(os.path.join(root, name))
+
+    def _remember(self, key, mtime, value):
+        with self._lock:
+            self._memory[key] = (mtime, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+
+_default_cache = None
+
+
+def default_cache() -> FetchCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FetchCache()
+    return _default_cache
+
+
+def configure(directory=None, ttl=None, max_bytes=None) -> FetchCache:
+    """Replaces the cache shared by all modules, arguments left as None keep their defaults."""
+    global _default_cache
+    _default_cache = FetchCache(
+        directory=CACHE_DIR if directory is None else directory,
+        ttl=CACHE_TTL if ttl is None else ttl,
+        max_bytes=CACHE_MAX_BYTES if max_bytes is None else max_bytes,
+    )
+    return _default_cache
+
+
+class CachedTicker:
+    """Drop-in replacement for yfinance.Ticker for the data this program uses. Every access goes to the
+    configured data provider, through the cache unless the provider's data is already local. Statements come
+    back as compact StatementFrames (modules/statements.py, .to_frame() for a DataFrame), the info as a dict."""
+
+    def __init__(self, symbol, cache=None, provider=None):
+        self.symbol = symbol.upper()
+        self.cache = cache if cache is not None else default_cache()
+        self.provider = provider if provider is not None else providers.default_provider()
+
+    @profiling.timed('fetch')
+    def fetch(self, statement, frequency='annual'):
+        if not self.provider.cacheable:
+            return self._fetch_from_provider(statement, frequency)
+        value = self.cache.get_or_fetch(
+            self.symbol, statement, frequency,
+            lambda: self._fetch_from_provider(statement, frequency)
+        )
+        # Entries cached before statements were stored compactly are still DataFrames
+        return value if statement == 'info' else statements.compact(value)
+
+    def _fetch_from_provider(self, statement, frequency):
+        # Providers whose data is local are not cached, everything that is cached comes over the network and
+        # goes through the rate limits and retries of the fetch scheduler
+        if not self.provider.cacheable:
+            profiling.count('local_reads')
+            value = self.provider.fetch(self.symbol, statement, frequency)
+        else:
+            profiling.count('network_calls')
+            value = scheduler.default_scheduler().call(
+                self.provider.fetch, self.symbol, statement, frequency,
+                description=f'{STATEMENT_NAMES[statement]} ({frequency}) for {self.symbol}', retry_if=_is_empty
+            )
+        return value if statement == 'info' else statements.compact(value)
+
+    def fetch_many(self, requests, max_workers=MAX_IN_FLIGHT, strict=False) -> dict:
+        """Fetches several (statement, frequency) pairs at the same time, so the wall time is about the slowest
+        single request. Every request fails on its own: the error is logged and its result is None. With
+        `strict`, a scheduler.FetchError naming the failed requests is raised instead, once all are done."""
+        results = {}
+        if not requests:
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(requests))) as executor:
+            futures = {request: executor.submit(self.fetch, *request) for request in requests}
+
+        for (statement, frequency), future in futures.items():
+            try:
+                results[(statement, frequency)] = future.result()
+            except Exception as e:
+                logging.error(f"Failed to load {STATEMENT_NAMES[statement]} ({frequency}) for {self.symbol}: {e}")
+                results[(statement, frequency)] = None
+
+        failed = [f'{STATEMENT_NAMES[statement]} ({frequency})' for (statement, frequency), value in results.items() if value is None]
+        if strict and failed:
+            raise scheduler.FetchError(f'Failed to load {", ".join(failed)} for {self.symbol}')
+
+        return results
+
+    @property
+    def balance_sheet(self):
+        return self.fetch('balance_sheet')
+
+    @property
+    def income_stmt(self):
+        return self.fetch('income_statement')
+
+    @property
+    def cash_flow(self):
+        return self.fetch('cash_flow')
+
+    @property
+    def quarterly_balance_sheet(self):
+        return self.fetch('balance_sheet', 'quarterly')
+
+    @property
+    def quarterly_income_stmt(self):
+        return self.fetch('income_statement', 'quarterly')
+
+    @property
+    def quarterly_cash_flow(self):
+        return self.fetch('cash_flow', 'quarterly')
+
+    @property
+    def info(self):
+        return self.fetch('info', 'static')
@@ -0,0 +1,189 @@
+import importlib.util
+import io
+import logging
+import os
+import threading
+from typing import Final
+
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import modules.profiling as profiling
+import modules.sectors as sectors
+
+
+# Charts are drawn with the object oriented API straight onto Agg canvases, pyplot (and its global list of
+# open figures) is never used. 'svg' embeds the charts as vector drawings, which needs svglib to be installed.
+CHART_FORMAT: Final[str] = os.environ.get('FA_CHART_FORMAT', 'png')
+CHART_DPI: Final[int] = int(os.environ.get('FA_CHART_DPI', 300))
+
+# (column, title, bar color, average label, average color)
+RATIO_CHART_RATIOS = [
+    ('current_ratio', 'Current Ratio', 'skyblue', 'Sector Avg - Current Ratio', 'blue'),
+    ('quick_ratio', 'Quick Ratio', 'lightgreen', 'Sector Avg - Quick Ratio', 'green'),
+    ('debt_to_equity', 'Debt to Equity', 'salmon', 'Sector Avg - Debt to Equity', 'red')
+]
+BAR_WIDTH = 0.25  # Narrower bars to look more compact
+
+
+class ChartTemplate:
+    """A figure whose size, axes, margins and static labels are set up once and then reused for every chart
+    of the same kind. Only the data is replaced between charts, which saves building the figure and running
+    tight_layout for every report."""
+
+    def __init__(self, figsize, nrows=1, adjust=None, setup=None):
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.axes = list(self.figure.subplots(nrows, 1, squeeze=False)[:, 0])
+        if setup is not None:
+            setup(self.axes)
+        if adjust:
+            self.figure.subplots_adjust(**adjust)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """Removes the data of the previous chart and returns the axes."""
+        for ax in self.axes:
+            for container in list(ax.containers):
+                container.remove()
+            for artist in [*ax.lines, *ax.collections, *ax.patches, *ax.texts]:
+                artist.remove()
+            if ax.get_legend() is not None:
+                ax.get_legend().remove()
+            ax.relim()
+            ax.set_prop_cycle(None)
+        return self.axes
+
+    def render(self, target=None, file_format=None, dpi=None):
+        """Saves the figure to `target` (a path or a file object), by default a new in-memory buffer that is
+        returned rewound."""
+        buffer = io.BytesIO() if target is None else target
+        self.figure.savefig(buffer, format=file_format or CHART_FORMAT, dpi=dpi or CHART_DPI)
+        if target is None:
+            buffer.seek(0)
+        return buffer
+
+
+def _ratio_axes(axes):
+    for ax in axes:
+        ax.set_xlabel('Year')
+        ax.set_ylabel('Value')
+
+
+def _growth_axes(axes):
+    ax = axes[0]
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Growth Rate (%)')
+    ax.set_title('Growth Rates of Financial Ratios Over Time')
+    ax.grid(True)
+
+
+# Margins are what tight_layout used to work out for every chart, fixed once here
+TEMPLATES = {
+    'ratio': lambda: ChartTemplate((6, 12), nrows=3, setup=_ratio_axes, adjust={'left': 0.13, 'right': 0.97, 'bottom': 0.05, 'top': 0.97, 'hspace': 0.5}),
+    'growth': lambda: ChartTemplate((10, 6), setup=_growth_axes, adjust={'left': 0.08, 'right': 0.97, 'bottom': 0.09, 'top': 0.93}),
+}
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def template(name) -> ChartTemplate:
+    """The template for a kind of chart, built on first use and kept for the life of the process."""
+    with _templates_lock:
+        if name not in _templates:
+            _templates[name] = TEMPLATES[name]()
+        return _templates[name]
+
+
+def close_templates():
+    """Drops the templates, their figures are freed with them."""
+    with _templates_lock:
+        for chart in _templates.values():
+            chart.figure.clear()
+        _templates.clear()
+
+
+@profiling.timed('chart.ratio')
+def draw_ratio_chart(company_ratios, sector, symbol_request, target=None, file_format=None, dpi=None):
+    """Bar charts of the liquidity and leverage ratios against the sector averages. Returns an in-memory
+    buffer, or writes to `target` (a path or a file object) when one is given."""
+    benchmarks = sectors.default_benchmarks()
+    plot_df = company_ratios[['year'] + [column for column, *_ in RATIO_CHART_RATIOS]]
+    x = np.arange(len(plot_df.index))  # Positions for bars
+
+    chart = template('ratio')
+    with chart.lock:
+        axes = chart.reset()
+
+        for ax, (column, title, color, avg_label, avg_color) in zip(axes, RATIO_CHART_RATIOS):
+            ax.bar(x, plot_df[column], BAR_WIDTH, label=f'{title} {symbol_request}', color=color)
+
+            # Horizontal line for the sector average over every bar, labelled once
+            avg_value = benchmarks.average(sector, column)
+            ax.hlines(
+                y=[avg_value] * len(x),
+                xmin=x - BAR_WIDTH / 2,
+                xmax=x + BAR_WIDTH / 2,
+                color=avg_color,
+                linestyle='--',
+                label=avg_label
+            )
+
+            ax.set_title(f'{title} vs {sector} Sector Average')
+            ax.set_xticks(x, plot_df['year'].map(int))  # map(int) removes the .0
+            ax.autoscale_view()
+            ax.legend(loc='upper right')
+
+        return chart.render(target, file_format, dpi)
+
+
+@profiling.timed('chart.growth')
+def draw_growth_chart(growth_rates, target=None, file_format=None, dpi=None):
+    """Line chart of the growth rates of every ratio. Returns an in-memory buffer, or writes to `target`
+    (a path or a file object) when one is given."""
+    years = growth_rates.columns.drop('ratio')[::-1]  # Fiscal years, oldest first
+    ratios_to_plot = growth_rates['ratio'].values
+    ratios_growth = growth_rates[years].values
+    x = np.arange(len(years))
+
+    colormap = matplotlib.colormaps['tab10']
+    colors = [colormap(i / len(ratios_to_plot)) for i in range(len(ratios_to_plot))]  # Distinct colors
+
+    chart = template('growth')
+    with chart.lock:
+        ax = chart.reset()[0]
+
+        for ratio, growth, color in zip(ratios_to_plot, ratios_growth, colors):
+            ax.plot(x, growth, label=ratio, marker='o', color=color)
+
+        ax.set_xticks(x, [str(year) for year in years])
+        ax.autoscale_view()
+        ax.legend(loc='best')
+
+        return chart.render(target, file_format, dpi)
+
+
+def chart_format(requested=None):
+    """The format charts are rendered in, png when svg is asked for but svglib is not installed."""
+    file_format = requested or CHART_FORMAT
+    if file_format == 'svg' and importlib.util.find_spec('svglib') is None:
+        logging.warning('svglib is not installed, charts are embedded as png instead of svg.')
+        return 'png'
+    return file_format
+
+
+def flowable(buffer, width, height, file_format='png'):
+    """A ReportLab flowable for a rendered chart, scaled to `width` x `height` points."""
+    if file_format == 'svg':
+        from svglib.svglib import svg2rlg
+
+        drawing = svg2rlg(buffer)
+        drawing.scale(width / drawing.width, height / drawing.height)
+        drawing.width, drawing.height = width, height
+        return drawing
+
+    from reportlab.platypus import Image
+
+    return Image(buffer, width=width, height=height)
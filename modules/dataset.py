@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import modules.getstatements as gs
+import modules.statements as st
+
+
+# Partitioned Parquet datasets, one folder per ticker (ticker=MSFT/...) so a ticker can be rewritten on
+# its own while the whole universe still reads back as a single table
+STATEMENTS_DATASET = 'statements'
+ANALYSIS_DATASET = 'analysis'
+
+STATEMENTS_SCHEMA = pa.schema([
+    ('ticker', pa.string()),
+    ('statement', pa.dictionary(pa.int8(), pa.string())),
+    ('frequency', pa.dictionary(pa.int8(), pa.string())),
+    ('period_end', pa.timestamp('ns')),
+    ('line_item', pa.dictionary(pa.int16(), pa.string())),
+    ('value', pa.float64()),
+])
+
+ANALYSIS_SCHEMA = pa.schema([
+    ('ticker', pa.string()),
+    ('table', pa.dictionary(pa.int8(), pa.string())),
+    ('year', pa.int16()),
+    ('metric', pa.dictionary(pa.int16(), pa.string())),
+    ('value', pa.float64()),
+])
+
+
+def dataset_path(name):
+    return os.path.join(gs.OUTPUT_DIR, 'parquet', name)
+
+
+def statements_to_long(ticker, statements: dict) -> pd.DataFrame:
+    """Turns {(statement, frequency): yfinance-shaped frame} into rows of
+    (ticker, statement, frequency, period_end, line_item, value). Missing values are left out."""
+    parts = []
+    for (statement, frequency), frame in statements.items():
+        frame = st.compact(frame)
+        if frame.empty:
+            continue
+
+        # Row by row (line item, then period), straight from the value matrix
+        values = frame.values.astype('float64')
+        rows, columns = np.nonzero(~np.isnan(values))
+        parts.append(pd.DataFrame({
+            'statement': statement,
+            'frequency': frequency,
+            'period_end': frame.columns[columns],
+            'line_item': frame.index[rows],
+            'value': values[rows, columns],
+        }))
+
+    if not parts:
+        return pd.DataFrame(columns=STATEMENTS_SCHEMA.names)
+
+    long = pd.concat(parts, ignore_index=True)
+    long.insert(0, 'ticker', ticker.upper())
+    return long[STATEMENTS_SCHEMA.names]
+
+
+def analysis_to_long(ticker, tables: dict) -> pd.DataFrame:
+    """Turns the analyzer outputs into rows of (ticker, table, year, metric, value).
+
+    `tables` holds the frames as FinancialAnalyzer returns them: 'data' and 'ratios' have one row per
+    year (with a 'Year'/'year' column), 'difference' and 'growth' one row per ratio with the years as columns.
+    """
+    parts = []
+    for table, frame in tables.items():
+        if frame is None or frame.empty:
+            continue
+
+        if table in ('data', 'ratios'):
+            year_column = 'Year' if 'Year' in frame.columns else 'year'
+            long = frame.melt(id_vars=year_column, var_name='metric').rename(columns={year_column: 'year'})
+        else:
+            long = frame.melt(id_vars='ratio', var_name='year').rename(columns={'ratio': 'metric'})
+
+        long.insert(0, 'table', table)
+        parts.append(long)
+
+    if not parts:
+        return pd.DataFrame(columns=ANALYSIS_SCHEMA.names)
+
+    long = pd.concat(parts, ignore_index=True)
+    long['value'] = pd.to_numeric(long['value'], errors='coerce')
+    long['year'] = long['year'].astype(int)
+    long.insert(0, 'ticker', ticker.upper())
+    return long[ANALYSIS_SCHEMA.names].dropna(subset=['value'])
+
+
+def _write(frame, schema, path):
+    # Only the folders of the tickers being written are replaced, everything else in the dataset stays
+    table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+    ds.write_dataset(
+        table,
+        path,
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([('ticker', pa.string())]), flavor='hive'),
+        basename_template='part-{i}.parquet',
+        existing_data_behavior='delete_matching',
+    )
+
+
+def write_statements(ticker, statements: dict, path=None):
+    long = statements_to_long(ticker, statements)
+    if not long.empty:
+        _write(long, STATEMENTS_SCHEMA, path or dataset_path(STATEMENTS_DATASET))
+    return long
+
+
+def write_analysis(ticker, tables: dict, path=None):
+    long = analysis_to_long(ticker, tables)
+    if not long.empty:
+        _write(long, ANALYSIS_SCHEMA, path or dataset_path(ANALYSIS_DATASET))
+    return long
+
+
+def read_dataset(name=STATEMENTS_DATASET, tickers=None, filters=None, path=None) -> pa.Table:
+    """Reads a whole dataset (or some tickers of it) as one memory-mapped Arrow table.
+
+    `filters` are pyarrow filters, e.g. [('statement', '=', 'balance_sheet')]. Use .to_pandas() on the
+    result for a DataFrame.
+    """
+    filters = list(filters or [])
+    if tickers is not None:
+        filters.append(('ticker', 'in', [ticker.upper() for ticker in tickers]))
+
+    return pq.read_table(
+        path or dataset_path(name),
+        partitioning='hive',
+        filters=filters or None,
+        memory_map=True,
+    )
@@ -1,20 +1,21 @@
-import yfinance as yf
 import pandas as pd
 import logging
 import os
+import modules.cache as cache
+import modules.outputcache as outputcache
+import modules.profiling as profiling
+import modules.statements as st
+from modules.logs import configure_logging
+
+
+OUTPUT_DIR = os.environ.get('FA_OUTPUT_DIR', 'data_output') # Root folder of the exported statements
 
-logging.basicConfig(
-    filename='../.logs/main.log',
-    filemode='w',
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-)
 
 def ensure_directories_exist():
     # Define the directories that need to exist
     directories = [
-        '../data_output/excel',
-        '../data_output/csv'
+        f'{OUTPUT_DIR}/excel',
+        f'{OUTPUT_DIR}/csv'
     ]
 
     # Check and create each directory
@@ -26,111 +27,199 @@ def ensure_directories_exist():
             pass
 
 
+STATEMENTS = ['balance_sheet', 'income_statement', 'cash_flow']
+CSV_FILES = ['balance_sheet', 'income_statement', 'cash_flow', 'qbalance_sheet', 'qincome_statement', 'qcash_flow']
+STATEMENT_REQUESTS = [(statement, frequency) for frequency in ('annual', 'quarterly') for statement in STATEMENTS]
+STREAM_FETCHERS = 4  # Tickers fetched at the same time by stream_exports, the scheduler still limits the requests
+EXPORT_VERSION = 1  # Bump when the exported layout changes, so exports made with the old one are written again
 PERIODS = 4 # The max number of periods we are accessing through yFinance (anything more will give dubious data or missing altogether)
 
 class GetStatements:
     def __init__(self, ticker):
-        self.ticker = yf.Ticker(ticker)
-        self.balance_sheet = pd.DataFrame()
-        self.income_statement = pd.DataFrame()
-        self.cash_flow = pd.DataFrame()
+        self.ticker = cache.CachedTicker(ticker)
+        self.balance_sheet = st.StatementFrame.empty_frame()
+        self.income_statement = st.StatementFrame.empty_frame()
+        self.cash_flow = st.StatementFrame.empty_frame()
 
     def get_statements(self):
-        try:
-            self.balance_sheet = self.ticker.balance_sheet
-        except Exception:
-            logging.error("Failed to load Balance Sheet.")
-        
-        try:    
-            self.income_statement = self.ticker.income_stmt
-        except Exception:
-            logging.error("Failed to load Income Statement.")
-        
-        try:    
-            self.cash_flow = self.ticker.cash_flow
-        except Exception:
-            logging.error("Failed to load Cash Flow Statement.")
-
-        return {
-            "balance_sheet": self.balance_sheet.iloc[:, :PERIODS],
-            "income_statement": self.income_statement.iloc[:, :PERIODS],
-            "cash_flow": self.cash_flow.iloc[:, :PERIODS],
-        }
-
+        return self.fetch_all(annual=True, quarterly=False)["annual"]
 
     def get_quarterly_statements(self):
-        try:
-            self.balance_sheet = self.ticker.quarterly_balance_sheet
-        except Exception:
-            logging.error("Failed to load Balance Sheet.")
-        
-        try:
-            self.income_statement = self.ticker.quarterly_income_stmt
-        except Exception:
-            logging.error("Failed to load Income Statement.")
-        
-        try:    
-            self.cash_flow = self.ticker.quarterly_cash_flow
-        except Exception:
-            logging.error("Failed to load Cash Flow Statement.")
-
-        return {
-            "qbalance_sheet": self.balance_sheet.iloc[:, :PERIODS],
-            "qicome_statement": self.income_statement.iloc[:, :PERIODS],
-            "qcash_flow": self.cash_flow.iloc[:, :PERIODS]
-        }
-
-def retrieve_and_export_statements(ticker_request: str, excel, csv):
-    retriever = GetStatements(ticker_request)
+        return self.fetch_all(annual=False, quarterly=True)["quarterly"]
+
+    def fetch_all(self, annual=True, quarterly=True, info=False, periods=PERIODS, results=None):
+        """Requests the annual and quarterly statements (and the company info) all at the same time.
+        Only the newest `periods` periods are kept, None keeps everything the provider returned. `results` are
+        statements already fetched ({(statement, frequency): frame}, as fetch_many returns them)."""
+        requests = []
+        if annual:
+            requests += [(statement, 'annual') for statement in STATEMENTS]
+        if quarterly:
+            requests += [(statement, 'quarterly') for statement in STATEMENTS]
+        if info:
+            requests.append(('info', 'static'))
+
+        # A request that still fails after the scheduler's retries fails the whole ticker (scheduler.FetchError),
+        # so partial data is never exported
+        if results is None:
+            results = self.ticker.fetch_many(requests, strict=True)
+
+        fetched = {}
+        if annual:
+            self.balance_sheet = results[('balance_sheet', 'annual')]
+            self.income_statement = results[('income_statement', 'annual')]
+            self.cash_flow = results[('cash_flow', 'annual')]
+            fetched["annual"] = {
+                "balance_sheet": self.balance_sheet.latest(periods),
+                "income_statement": self.income_statement.latest(periods),
+                "cash_flow": self.cash_flow.latest(periods),
+            }
+        if quarterly:
+            fetched["quarterly"] = {
+                "qbalance_sheet": results[('balance_sheet', 'quarterly')].latest(periods),
+                "qicome_statement": results[('income_statement', 'quarterly')].latest(periods),
+                "qcash_flow": results[('cash_flow', 'quarterly')].latest(periods)
+            }
+        if info:
+            fetched["info"] = results[('info', 'static')] or {}
+
+        return fetched
+
+def retrieve_and_export_statements(ticker_request: str, excel, csv, parquet=False, incremental=False, fetched=None):
+    # `fetched` are the statements the report of the same run already has (see modules/pipeline.py)
+    if incremental:
+        # Only fetches when a newer period can exist, and merges it into what is already exported
+        import modules.incremental as incremental_refresh
+
+        return incremental_refresh.refresh_statements(ticker_request, excel=excel, csv=csv, parquet=parquet)
+
     pd.set_option("display.max_rows", None)
 
+    # Retrieve yearly and quarterly statements, all requests run at the same time
+    statements = normalize_statements(ticker_request, fetched if fetched is not None else fetch_statements(ticker_request))
+    export_statements(ticker_request, statements, excel, csv, parquet)
+
+
+# The three steps of an export, run one after the other for a ticker, or as the stages of stream_exports
+
+def fetch_statements(ticker_request: str) -> dict:
+    return cache.CachedTicker(ticker_request).fetch_many(STATEMENT_REQUESTS, strict=True)
+
 
-    # Retrieve yearly statements
-    yearlyStatements = retriever.get_statements()
-    BalanceSheet = yearlyStatements["balance_sheet"]
-    IncomeStatement = yearlyStatements["income_statement"]
-    CashFlow = yearlyStatements["cash_flow"]
+def normalize_statements(ticker_request: str, fetched: dict) -> dict:
+    """{'annual': ..., 'quarterly': ...} as fetch_all returns them, from what fetch_statements returned."""
+    statements = GetStatements(ticker_request).fetch_all(results=fetched)
 
-    # Retrieve quarterly statements
-    quarterlyStatements = retriever.get_quarterly_statements()
-    qBalanceSheet = quarterlyStatements["qbalance_sheet"]
-    qIncomeStatement = quarterlyStatements["qicome_statement"]
-    qCashFlow = quarterlyStatements["qcash_flow"]
+    # Nothing at all usually means an unknown ticker, that is a failure and not a set of empty sheets
+    if all(frame.empty for frame in statements["annual"].values()):
+        raise LookupError(f'No statements found for {ticker_request}.')
+    return statements
 
-    #print(f"{BalanceSheet}\n\n{IncomeStatement}\n\n{CashFlow}")
-    
+
+def export_statements(ticker_request: str, statements: dict, excel, csv, parquet=False):
+    yearlyStatements = statements["annual"]
+    quarterlyStatements = statements["quarterly"]
     ensure_directories_exist()
-    # Export to Excel if requested
-    
-    if excel:
-        try:
-            os.makedirs(f'data_output/excel/{ticker_request.upper()}')
-        except FileExistsError:
-            pass
 
-        with pd.ExcelWriter(f"data_output/excel/{ticker_request.upper()}/data_{ticker_request.upper()}.xlsx") as writer:
-            BalanceSheet.to_excel(writer, sheet_name="Balance Sheet")
-            IncomeStatement.to_excel(writer, sheet_name="Income Statement")
-            CashFlow.to_excel(writer, sheet_name="Cash Flow")
-                         
-        with pd.ExcelWriter(f"data_output/excel/{ticker_request.upper()}/quarterly_data_{ticker_request.upper()}.xlsx") as writer:
-            qBalanceSheet.to_excel(writer, sheet_name="Balance Sheet")
-            qIncomeStatement.to_excel(writer, sheet_name="Income Statement")
-            qCashFlow.to_excel(writer, sheet_name="Cash Flow")
-
-    if csv:
-        try:
-            os.makedirs(f'data_output/csv/{ticker_request.upper()}')
-        except FileExistsError:
-            pass
+    # A format already exported from the same statements is not written again, see modules/outputcache.py
+    inputs = outputcache.digest(EXPORT_VERSION, yearlyStatements, quarterlyStatements)
+    exports = [('excel', excel, export_excel), ('csv', csv, export_csv), ('parquet', parquet, export_parquet)]
+    for file_format, requested, export in exports:
+        if not requested:
+            continue
+        outputs = export_paths(ticker_request, file_format)
+        if outputcache.reuse(OUTPUT_DIR, file_format, ticker_request, inputs, outputs):
+            continue
+        export(ticker_request, yearlyStatements, quarterlyStatements)
+        outputcache.record(OUTPUT_DIR, file_format, ticker_request, inputs, outputs)
+
+
+def stream_exports(tickers, excel, csv, parquet=False, fetchers=STREAM_FETCHERS, buffer=None):
+    """Exports the statements of many tickers as a stream: fetching (on `fetchers` threads), normalizing and
+    writing run at the same time, with at most `buffer` tickers waiting between two of them, so memory does
+    not grow with the number of tickers. `tickers` can be any iterable. Yields (ticker, error or None,
+    seconds) for every ticker as soon as its files are written."""
+    import modules.streaming as streaming
+
+    buffer = buffer or streaming.STREAM_BUFFER
+    fetched = streaming.stage(streaming.source(tickers), lambda ticker, _: fetch_statements(ticker), workers=fetchers, buffer=buffer)
+    normalized = streaming.stage(fetched, normalize_statements, buffer=buffer)
+    written = streaming.stage(normalized, lambda ticker, statements: export_statements(ticker, statements, excel, csv, parquet), buffer=buffer)
+    for item in written:
+        yield item.ticker, item.error, item.seconds
+
+
+def export_paths(ticker_request: str, file_format) -> list:
+    """The files (the ticker's partition for parquet) an export writes."""
+    ticker = ticker_request.upper()
+    if file_format == 'excel':
+        return [f"{OUTPUT_DIR}/excel/{ticker}/data_{ticker}.xlsx", f"{OUTPUT_DIR}/excel/{ticker}/quarterly_data_{ticker}.xlsx"]
+    if file_format == 'csv':
+        return [f'{OUTPUT_DIR}/csv/{ticker}/{name}_{ticker}.csv' for name in CSV_FILES]
+    return [f'{OUTPUT_DIR}/parquet/statements/ticker={ticker}']
+
+
+def _rows(*statements):
+    return sum(len(frame) for group in statements for frame in group.values() if frame is not None)
+
+
+@profiling.timed('export.excel')
+def export_excel(ticker_request: str, yearlyStatements, quarterlyStatements):
+    profiling.count('rows_exported', _rows(yearlyStatements, quarterlyStatements))
+    try:
+        os.makedirs(f'{OUTPUT_DIR}/excel/{ticker_request.upper()}')
+    except FileExistsError:
+        pass
+
+    # Streamed with a write-only workbook (modules/workbook.py) instead of building every cell in memory
+    import modules.workbook as workbook
+
+    annual_path, quarterly_path = export_paths(ticker_request, 'excel')
+    workbook.write_workbook(annual_path, {
+        "Balance Sheet": yearlyStatements["balance_sheet"],
+        "Income Statement": yearlyStatements["income_statement"],
+        "Cash Flow": yearlyStatements["cash_flow"],
+    })
+
+    workbook.write_workbook(quarterly_path, {
+        "Balance Sheet": quarterlyStatements["qbalance_sheet"],
+        "Income Statement": quarterlyStatements["qicome_statement"],
+        "Cash Flow": quarterlyStatements["qcash_flow"],
+    })
+
+
+@profiling.timed('export.csv')
+def export_csv(ticker_request: str, yearlyStatements, quarterlyStatements):
+    profiling.count('rows_exported', _rows(yearlyStatements, quarterlyStatements))
+    folder = f'{OUTPUT_DIR}/csv/{ticker_request.upper()}'
+    try:
+        os.makedirs(folder)
+    except FileExistsError:
+        pass
+
+    frames = [
+        yearlyStatements["balance_sheet"], yearlyStatements["income_statement"], yearlyStatements["cash_flow"],
+        quarterlyStatements["qbalance_sheet"], quarterlyStatements["qicome_statement"], quarterlyStatements["qcash_flow"],
+    ]
+    for frame, path in zip(frames, export_paths(ticker_request, 'csv')):
+        st.as_frame(frame).to_csv(path)
+
+
+@profiling.timed('export.parquet')
+def export_parquet(ticker_request: str, yearlyStatements, quarterlyStatements):
+    profiling.count('rows_exported', _rows(yearlyStatements, quarterlyStatements))
+    # Appends the ticker to the partitioned dataset in data_output/parquet/statements/ (long, typed layout)
+    import modules.dataset as dataset
 
-        BalanceSheet.to_csv(f'data_output/csv/{ticker_request.upper()}/balance_sheet_{ticker_request.upper()}.csv')
-        IncomeStatement.to_csv(f'data_output/csv/{ticker_request.upper()}/income_statement_{ticker_request.upper()}.csv')
-        CashFlow.to_csv(f'data_output/csv/{ticker_request.upper()}/cash_flow_{ticker_request.upper()}.csv')
+    dataset.write_statements(ticker_request, {
+        ('balance_sheet', 'annual'): yearlyStatements["balance_sheet"],
+        ('income_statement', 'annual'): yearlyStatements["income_statement"],
+        ('cash_flow', 'annual'): yearlyStatements["cash_flow"],
+        ('balance_sheet', 'quarterly'): quarterlyStatements["qbalance_sheet"],
+        ('income_statement', 'quarterly'): quarterlyStatements["qicome_statement"],
+        ('cash_flow', 'quarterly'): quarterlyStatements["qcash_flow"],
+    })
 
-        qBalanceSheet.to_csv(f'data_output/csv/{ticker_request.upper()}/qbalance_sheet_{ticker_request.upper()}.csv')
-        qIncomeStatement.to_csv(f'data_output/csv/{ticker_request.upper()}/qincome_statement_{ticker_request.upper()}.csv')
-        qCashFlow.to_csv(f'data_output/csv/{ticker_request.upper()}/qcash_flow_{ticker_request.upper()}.csv')
 
 def get_yn(prompt: str) -> bool:
     while True:
@@ -144,6 +233,7 @@ def get_yn(prompt: str) -> bool:
 
 # Run this only if the script is executed directly
 def main():
+    configure_logging()
     ticker_request = input("Ticker Request: ").upper().strip()
     excel = get_yn("Export files? (xls)")
     csv = get_yn("Export files? (csv)")
@@ -0,0 +1,162 @@
+import logging
+import os
+from typing import Final
+
+import pandas as pd
+
+import modules.cache as cache
+import modules.getstatements as gs
+import modules.statements as st
+
+
+# A period's statements cannot show up before the period has ended, and usually not for a few weeks after
+FILING_LAG_DAYS: Final[int] = 30
+PERIOD_MONTHS = {'annual': 12, 'quarterly': 3}
+FORMATS = ['csv', 'excel', 'parquet']
+
+# (statement, frequency) -> key in the dicts the exporters take / name of the exported csv file
+EXPORT_KEYS = {
+    ('balance_sheet', 'annual'): 'balance_sheet',
+    ('income_statement', 'annual'): 'income_statement',
+    ('cash_flow', 'annual'): 'cash_flow',
+    ('balance_sheet', 'quarterly'): 'qbalance_sheet',
+    ('income_statement', 'quarterly'): 'qicome_statement',
+    ('cash_flow', 'quarterly'): 'qcash_flow',
+}
+CSV_NAMES = {**EXPORT_KEYS, ('income_statement', 'quarterly'): 'qincome_statement'}
+SHEET_NAMES = {'balance_sheet': 'Balance Sheet', 'income_statement': 'Income Statement', 'cash_flow': 'Cash Flow'}
+WORKBOOKS = {'annual': 'data_{ticker}.xlsx', 'quarterly': 'quarterly_data_{ticker}.xlsx'}
+
+
+def read_stored(ticker, file_format) -> dict:
+    """Reads back what was exported for the ticker in one format as {(statement, frequency): frame}."""
+    ticker = ticker.upper()
+    stored = {}
+
+    if file_format == 'csv':
+        for key, name in CSV_NAMES.items():
+            path = f'{gs.OUTPUT_DIR}/csv/{ticker}/{name}_{ticker}.csv'
+            if os.path.exists(path):
+                stored[key] = st.compact(pd.read_csv(path, index_col=0))
+
+    elif file_format == 'excel':
+        for frequency, workbook in WORKBOOKS.items():
+            path = f'{gs.OUTPUT_DIR}/excel/{ticker}/{workbook.format(ticker=ticker)}'
+            if not os.path.exists(path):
+                continue
+            sheets = pd.read_excel(path, sheet_name=None, index_col=0)
+            for statement, sheet in SHEET_NAMES.items():
+                if sheet in sheets:
+                    stored[(statement, frequency)] = st.compact(sheets[sheet])
+
+    elif file_format == 'parquet':
+        import modules.dataset as dataset
+
+        if os.path.exists(os.path.join(dataset.dataset_path(dataset.STATEMENTS_DATASET), f'ticker={ticker}')):
+            long = dataset.read_dataset(tickers=[ticker]).to_pandas()
+            for (statement, frequency), group in long.groupby(['statement', 'frequency'], observed=True):
+                frame = group.pivot(index='line_item', columns='period_end', values='value')
+                frame.index = frame.index.astype(str)
+                stored[(statement, frequency)] = st.compact(frame)
+
+    else:
+        raise ValueError(f'Unknown format {file_format!r}')
+
+    return stored
+
+
+def newest_periods(stored) -> dict:
+    """Newest stored period end per frequency, of the statement that is furthest behind."""
+    newest = {}
+    for (_, frequency), frame in stored.items():
+        if frame.empty:
+            continue
+        latest = frame.columns.max()
+        if frequency not in newest or latest < newest[frequency]:
+            newest[frequency] = latest
+    return newest
+
+
+def refresh_due(stored, frequencies=('annual', 'quarterly'), today=None) -> set:
+    """Frequencies for which a period newer than the stored ones could have been filed by `today`."""
+    today = pd.Timestamp.today().normalize() if today is None else pd.Timestamp(today)
+    newest = newest_periods(stored)
+
+    due = set()
+    for frequency in frequencies:
+        latest = newest.get(frequency)
+        next_filing = None if latest is None else latest + pd.DateOffset(months=PERIOD_MONTHS[frequency]) + pd.Timedelta(days=FILING_LAG_DAYS)
+        if next_filing is None or today >= next_filing:
+            due.add(frequency)
+    return due
+
+
+def merge_statement(old, new):
+    """Adds the periods of `new` to `old`. Values in `new` win, periods only in `old` are kept, newest first."""
+    return st.compact(new).merge(st.compact(old))
+
+
+def _has_new_periods(old, merged):
+    if merged.empty:
+        return False
+    return old is None or not set(merged.columns) <= set(old.columns)
+
+
+def _export_dicts(frames):
+    yearly = {EXPORT_KEYS[key]: frame for key, frame in frames.items() if key[1] == 'annual'}
+    quarterly = {EXPORT_KEYS[key]: frame for key, frame in frames.items() if key[1] == 'quarterly'}
+    return yearly, quarterly
+
+
+def refresh_statements(ticker_request: str, excel, csv, parquet=False) -> bool:
+    """Incremental version of retrieve_and_export_statements.
+
+    Fetches only when a period newer than the exported ones can exist, then merges the new periods into
+    the existing exports (older periods are kept, so the history grows past PERIODS). Formats that gain
+    nothing are not rewritten. Returns whether anything was written.
+    """
+    formats = [name for name, wanted in (('excel', excel), ('csv', csv), ('parquet', parquet)) if wanted]
+    stored = {file_format: read_stored(ticker_request, file_format) for file_format in formats}
+
+    due = set().union(*(refresh_due(frames) for frames in stored.values()))
+    if not due:
+        logging.info(f'{ticker_request}: exports are up to date, nothing fetched.')
+        return False
+
+    fetched = gs.GetStatements(ticker_request).fetch_all(annual='annual' in due, quarterly='quarterly' in due, periods=None)
+    new = {}
+    for key, export_key in EXPORT_KEYS.items():
+        if key[1] in due:
+            new[key] = fetched[key[1]][export_key]
+
+    gs.ensure_directories_exist()
+    exporters = {'excel': gs.export_excel, 'csv': gs.export_csv, 'parquet': gs.export_parquet}
+
+    written = False
+    for file_format in formats:
+        merged = {key: merge_statement(stored[file_format].get(key), new.get(key)) for key in EXPORT_KEYS}
+        if not any(_has_new_periods(stored[file_format].get(key), frame) for key, frame in merged.items()):
+            logging.info(f'{ticker_request}: no new periods for {file_format}.')
+            continue
+
+        exporters[file_format](ticker_request, *_export_dicts(merged))
+        written = True
+
+    return written
+
+
+def load_statements(ticker, frequency='annual') -> dict:
+    """Statements for the analyzer as {statement: frame}, from the exports when they are current, otherwise
+    fetched and merged with the exported history."""
+    stored = {}
+    for file_format in FORMATS:
+        stored = {key: frame for key, frame in read_stored(ticker, file_format).items() if key[1] == frequency}
+        if stored:
+            break
+
+    keys = [(statement, frequency) for statement in gs.STATEMENTS]
+    if stored and not refresh_due(stored, [frequency]):
+        return {statement: stored.get((statement, frequency), st.StatementFrame.empty_frame()) for statement, _ in keys}
+
+    fetched = cache.CachedTicker(ticker).fetch_many(keys, strict=True)
+    return {key[0]: merge_statement(stored.get(key), fetched[key]) for key in keys}
@@ -0,0 +1,17 @@
+import logging
+import os
+
+
+# Always the .logs/ folder of the repository, wherever the program is started from
+LOG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.logs', 'main.log')
+
+
+def configure_logging(level=logging.INFO):
+    """Sets up the log file, called by the entry points (never at import time). Runs append to the same file."""
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    logging.basicConfig(
+        filename=LOG_FILE,
+        filemode='a',
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+    )
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from functools import lru_cache
+from typing import Final
+
+import modules.profiling as profiling
+import modules.statements as st
+
+
+# Every generated output (a report, a ticker's CSV/Excel/Parquet export) records a hash of what it was made from
+# in <output root>/.inputs/<kind>_<TICKER>.json. When a later run would make it from the same inputs, the
+# output is not generated again: the files are kept, or linked (copied across file systems) to the new path.
+OUTPUT_CACHE: Final[bool] = os.environ.get('FA_OUTPUT_CACHE', '1') != '0'
+MANIFEST_DIR: Final[str] = '.inputs'
+
+_enabled = OUTPUT_CACHE
+
+
+def configure(enabled=True):
+    """Turns reusing outputs on or off (--refresh turns it off), outputs are recorded either way."""
+    global _enabled
+    _enabled = enabled
+
+
+def _update(digest, part):
+    if isinstance(part, dict):
+        digest.update(b'd%d' % len(part))
+        for key in sorted(part, key=repr):
+            _update(digest, key)
+            _update(digest, part[key])
+    elif isinstance(part, (list, tuple)):
+        digest.update(b'l%d' % len(part))
+        for item in part:
+            _update(digest, item)
+    elif isinstance(part, st.StatementFrame) or hasattr(part, 'to_numpy'):
+        # The line item codes differ between processes, the names do not
+        frame = st.compact(part)
+        digest.update(f's{frame.values.dtype}{frame.shape}'.encode())
+        digest.update(frame.values.tobytes())
+        digest.update('\x00'.join(frame.index).encode())
+        digest.update(frame.periods.tobytes())
+    else:
+        text = repr(part).encode()
+        digest.update(b'v%d:' % len(text) + text)
+
+
+def digest(*parts) -> str:
+    """A hash of statements (StatementFrames or DataFrames), dicts, lists and plain values, the same for equal
+    inputs in any process."""
+    sha = hashlib.sha256()
+    for part in parts:
+        _update(sha, part)
+    return sha.hexdigest()
+
+
+def file_digest(path) -> str:
+    """Hash of a file's contents ('missing' when there is no such file), recomputed only when it changes."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 'missing'
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path, mtime, size):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def manifest_path(root, kind, ticker):
+    return os.path.join(root, MANIFEST_DIR, f'{kind}_{ticker.upper()}.json')
+
+
+def _read(root, kind, ticker):
+    try:
+        with open(manifest_path(root, kind, ticker), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _link(source, target):
+    temporary = f'{target}.{os.getpid()}.tmp'
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    try:
+        try:
+            os.link(source, temporary)
+        except OSError:
+            shutil.copy2(source, temporary)
+        os.replace(temporary, target)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _modified(paths):
+    try:
+        return [os.stat(path).st_mtime_ns for path in paths]
+    except FileNotFoundError:
+        return None
+
+
+def reuse(root, kind, ticker, inputs, outputs) -> bool:
+    """True when the outputs recorded for (kind, ticker) were made from `inputs` (a digest) and still exist,
+    after linking them to `outputs` (paths, in the recorded order) where those differ. False means they have to
+    be generated (and then recorded)."""
+    if not _enabled:
+        return False
+    entry = _read(root, kind, ticker)
+    if entry is None or entry.get('inputs') != inputs or len(entry.get('outputs', [])) != len(outputs):
+        return False
+    # Outputs changed since they were recorded (by --incremental, or by hand) are not what the inputs give
+    if entry.get('modified') != _modified(entry['outputs']):
+        return False
+
+    try:
+        for source, target in zip(entry['outputs'], outputs):
+            if os.path.abspath(source) != os.path.abspath(target):
+                _link(source, target)
+    except OSError as e:
+        logging.warning(f'Unable to reuse the {kind} of {ticker}, generating it again: {e}')
+        return False
+
+    if entry['outputs'] != list(outputs):
+        record(root, kind, ticker, inputs, outputs)
+    profiling.count('outputs_reused')
+    return True
+
+
+def record(root, kind, ticker, inputs, outputs):
+    path = manifest_path(root, kind, ticker)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump({'inputs': inputs, 'outputs': list(outputs), 'modified': _modified(outputs)}, file)
+    os.replace(temporary, path)
@@ -0,0 +1,404 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Final
+
+import numpy as np
+import pandas as pd
+
+import modules.cache as cache
+import modules.providers as providers
+import modules.statements as st
+
+
+# Statement values of the whole universe in one memory-mapped array per frequency, laid out as
+#
+#   <directory>/<frequency>/index.json           tickers, line items and the name of the current generation
+#   <directory>/<frequency>/values-<n>.npy       float64 (ticker, period slot, line item)
+#   <directory>/<frequency>/periods-<n>.npy      datetime64[D] (ticker, period slot), NaT for unused slots
+#   <directory>/info.json                        company name, sector, industry and website per ticker
+#
+# Slot 0 is the newest period of each ticker. An append writes a new generation and then replaces index.json,
+# so readers always see a complete store, and processes that map the same generation share one copy of it.
+PANEL_DIR: Final[str] = os.environ.get('FA_PANEL_DIR', os.path.join(os.environ.get('FA_OUTPUT_DIR', 'data_output'), 'panel'))
+DATAPOINTS_FILE: Final[str] = 'data/all_datapoints.csv'
+STATEMENTS = ['balance_sheet', 'income_statement', 'cash_flow']
+FREQUENCIES = ['annual', 'quarterly']
+INFO_FIELDS = ['longName', 'sector', 'industry', 'website']
+LOCK_TIMEOUT: Final[float] = 60.0  # Seconds a lock can go without being refreshed before it is considered stale
+LOCK_REFRESH: Final[float] = 5.0  # Seconds between refreshes of a held lock
+
+
+def store_line_items(path=DATAPOINTS_FILE) -> dict:
+    """The line items kept in the store, per statement, from data/all_datapoints.csv (the ratios column is not)."""
+    datapoints = pd.read_csv(path)
+    return {statement: datapoints[statement].dropna().str.strip().tolist() for statement in STATEMENTS}
+
+
+class _WriteLock:
+    # A lock file created exclusively works the same on every platform, one writer per store at a time. The
+    # file names its owner and is touched while it is held, so only the lock of a writer that died is broken:
+    # at once when it ran on this machine, otherwise once it was not refreshed for LOCK_TIMEOUT.
+    def __init__(self, path):
+        self.path = path
+        self.owner = f'{os.getpid()} {socket.gethostname()}'
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        start = time.monotonic()
+        while True:
+            try:
+                descriptor = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if self._stale():
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() - start > LOCK_TIMEOUT:
+                    raise TimeoutError(f'{self.path} is held by another writer ({self._read_owner() or "unknown"})')
+                time.sleep(0.05)
+            else:
+                with os.fdopen(descriptor, 'w') as file:
+                    file.write(self.owner)
+                self._heartbeat = threading.Thread(target=self._refresh, daemon=True, name='panel-lock')
+                self._heartbeat.start()
+                return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._heartbeat.join()
+        try:
+            if self._read_owner() == self.owner:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def _refresh(self):
+        while not self._stop.wait(LOCK_REFRESH):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def _read_owner(self):
+        with open(self.path, 'r') as file:
+            return file.read().strip()
+
+    def _stale(self) -> bool:
+        if time.time() - os.path.getmtime(self.path) > LOCK_TIMEOUT:
+            return True
+        pid, _, host = self._read_owner().partition(' ')
+        if host != socket.gethostname() or not pid.isdigit() or os.name != 'posix':
+            # Written by another machine, or not yet (the owner is written right after the file is created)
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+
+class PanelStore:
+    """One frequency of the store. `values` and `periods` are read-only memory maps, ticker() and statement()
+    return views into them without copying."""
+
+    def __init__(self, directory=PANEL_DIR, frequency='annual'):
+        if frequency not in FREQUENCIES:
+            raise ValueError(f'Unknown frequency {frequency!r}, expected one of {", ".join(FREQUENCIES)}')
+        self.directory = os.path.join(directory, frequency)
+        self.frequency = frequency
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _load(self, attempts=3):
+        try:
+            stamp = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, 'r') as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            stamp, index = None, {'generation': 0, 'tickers': [], 'statements': {statement: [] for statement in STATEMENTS}}
+
+        if index['generation']:
+            try:
+                values = np.load(self._file('values', index['generation']), mmap_mode='r')
+                periods = np.load(self._file('periods', index['generation']), mmap_mode='r')
+            except FileNotFoundError:
+                # A writer replaced the generation between reading the index and mapping it
+                if attempts <= 1:
+                    raise
+                return self._load(attempts - 1)
+        else:
+            values = np.empty((0, 0, sum(len(names) for names in index['statements'].values())))
+            periods = np.empty((0, 0), dtype='datetime64[D]')
+
+        self.generation = index['generation']
+        self.tickers = index['tickers']
+        self.line_items = index['statements']  # {statement: [line items]}, in the order of the line item axis
+        self.names = [name for statement in STATEMENTS for name in self.line_items[statement]]
+        self._rows = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+        # Every statement is a contiguous range of the line item axis
+        self._ranges, start = {}, 0
+        for statement in STATEMENTS:
+            self._ranges[statement] = (start, start + len(self.line_items[statement]))
+            start += len(self.line_items[statement])
+
+        self.values = values
+        self.periods = periods
+        self._stamp = stamp
+
+    def _file(self, name, generation):
+        return os.path.join(self.directory, f'{name}-{generation}.npy')
+
+    def refresh(self):
+        """Maps the newest generation when another process has appended since this store was opened."""
+        try:
+            stamp = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self._stamp:
+            with self._lock:
+                self._load()
+
+    def __contains__(self, ticker):
+        return ticker.upper() in self._rows
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def ticker(self, ticker):
+        """(values, periods) of a ticker: a (period, line item) view over its filled period slots, newest first,
+        and their period ends."""
+        row = self._rows.get(ticker.upper())
+        if row is None:
+            raise KeyError(ticker)
+        periods = self.periods[row]
+        count = int(np.count_nonzero(~np.isnat(periods)))
+        return self.values[row, :count], periods[:count]
+
+    def statement(self, ticker, statement) -> st.StatementFrame:
+        """One statement of a ticker as a StatementFrame over the memory map (empty when the ticker is not stored)."""
+        if ticker.upper() not in self._rows:
+            return st.StatementFrame.empty_frame()
+        values, periods = self.ticker(ticker)
+        start, end = self._ranges[statement]
+        if not len(periods) or start == end:
+            return st.StatementFrame.empty_frame()
+        block = values[:, start:end].T
+
+        # The periods of a ticker are shared by its statements, the ones this statement has no values for are
+        # left out (still a view when those are at either end, as they usually are)
+        filled = np.flatnonzero(~np.isnan(block).all(axis=0))
+        if not len(filled):
+            return st.StatementFrame.empty_frame()
+        if filled[-1] - filled[0] + 1 == len(filled):
+            columns = slice(filled[0], filled[-1] + 1)
+        else:
+            columns = filled
+        return st.StatementFrame.from_arrays(block[:, columns], self.line_items[statement], np.array(periods[columns]))
+
+    def line_item(self, name) -> np.ndarray:
+        """(ticker, period slot) view of one line item across the universe."""
+        return self.values[:, :, self.names.index(name)]
+
+    def append(self, companies: dict, line_items: dict = None, infos: dict = None):
+        """Adds or updates tickers from {ticker: {statement: StatementFrame or DataFrame}}. New periods are merged
+        into the stored ones (new values win), the store only keeps `line_items` ({statement: [names]}, from
+        data/all_datapoints.csv by default). Everything is written as a new generation at once, together with
+        the company info of `infos` ({ticker: info}) when given."""
+        line_items = line_items or store_line_items()
+        os.makedirs(self.directory, exist_ok=True)
+
+        with _WriteLock(os.path.join(self.directory, '.lock')):
+            self.refresh()
+
+            names = [name for statement in STATEMENTS for name in line_items[statement]]
+            tickers = self.tickers + [ticker.upper() for ticker in companies if ticker.upper() not in self._rows]
+
+            # Every updated ticker as a (period, line item) matrix, merged with what is stored
+            updates = {}
+            for ticker, frames in companies.items():
+                merged = {statement: st.compact(frames.get(statement)).merge(self.statement(ticker, statement)) for statement in STATEMENTS}
+                periods = np.unique(np.concatenate([frame.periods for frame in merged.values()]))[::-1]
+                matrix = np.full((len(periods), len(names)), np.nan)
+                column = 0
+                for statement in STATEMENTS:
+                    frame = merged[statement]
+                    selected = frame.select(line_items[statement])
+                    positions = np.searchsorted(-periods.astype(np.int64), -frame.periods.astype(np.int64))
+                    matrix[positions, column:column + len(line_items[statement])] = selected.T
+                    column += len(line_items[statement])
+                updates[ticker.upper()] = (matrix, periods)
+
+            slots = max([self.values.shape[1]] + [len(periods) for _, periods in updates.values()])
+            generation = self.generation + 1
+            values_path, periods_path = self._file('values', generation), self._file('periods', generation)
+
+            values = np.lib.format.open_memmap(f'{values_path}.tmp', mode='w+', dtype=np.float64, shape=(len(tickers), slots, len(names)))
+            periods = np.lib.format.open_memmap(f'{periods_path}.tmp', mode='w+', dtype='datetime64[D]', shape=(len(tickers), slots))
+            values[:] = np.nan
+            periods[:] = np.datetime64('NaT')
+
+            # Stored tickers are copied over by line item name, so a changed datapoints file keeps what it can
+            if len(self.tickers):
+                old_names = {name: i for i, name in enumerate(self.names)}
+                kept = [(i, old_names[name]) for i, name in enumerate(names) if name in old_names]
+                if kept:
+                    new_positions, old_positions = map(list, zip(*kept))
+                    old_slots = self.values.shape[1]
+                    values[:len(self.tickers), :old_slots, new_positions] = self.values[:, :, old_positions]
+                periods[:len(self.tickers), :self.periods.shape[1]] = self.periods
+
+            rows = {ticker: i for i, ticker in enumerate(tickers)}
+            for ticker, (matrix, ticker_periods) in updates.items():
+                values[rows[ticker]] = np.nan
+                periods[rows[ticker]] = np.datetime64('NaT')
+                values[rows[ticker], :len(ticker_periods)] = matrix
+                periods[rows[ticker], :len(ticker_periods)] = ticker_periods
+
+            values.flush()
+            periods.flush()
+            del values, periods
+            os.replace(f'{values_path}.tmp', values_path)
+            os.replace(f'{periods_path}.tmp', periods_path)
+
+            # Under the same lock as the arrays, so concurrent writers never mix up info.json, and written before
+            # the new generation is visible so its tickers always have their info
+            if infos:
+                write_info(infos, os.path.dirname(self.directory))
+
+            # Replacing the index is what makes the new generation visible
+            index = {'generation': generation, 'tickers': tickers, 'statements': line_items}
+            with open(f'{self.index_path}.tmp', 'w') as file:
+                json.dump(index, file)
+            os.replace(f'{self.index_path}.tmp', self.index_path)
+
+            previous = self.generation
+            self.refresh()
+            for name in ('values', 'periods'):
+                try:
+                    os.remove(self._file(name, previous))
+                except OSError:
+                    pass  # Never written, or still mapped on a platform that does not allow removing it
+
+
+def read_info(directory=PANEL_DIR) -> dict:
+    try:
+        with open(os.path.join(directory, 'info.json'), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_info(infos: dict, directory=PANEL_DIR):
+    # Called by PanelStore.append with the annual store's lock held
+    info = read_info(directory)
+    info.update({ticker.upper(): {field: value.get(field) for field in INFO_FIELDS if value.get(field) is not None} for ticker, value in infos.items()})
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'info.json.tmp'), 'w') as file:
+        json.dump(info, file)
+    os.replace(os.path.join(directory, 'info.json.tmp'), os.path.join(directory, 'info.json'))
+
+
+class PanelProvider(providers.DataProvider):
+    """Serves statements straight out of the panel store, as views into the memory maps. Only the line items
+    of data/all_datapoints.csv are stored."""
+
+    name = 'panel'
+    cacheable = False
+
+    def __init__(self, directory=PANEL_DIR):
+        self.directory = directory
+        self._stores = {}
+        self._info = None
+        self._lock = threading.Lock()
+
+    def store(self, frequency) -> PanelStore:
+        with self._lock:
+            if frequency not in self._stores:
+                self._stores[frequency] = PanelStore(self.directory, frequency)
+            store = self._stores[frequency]
+        store.refresh()
+        return store
+
+    def fetch(self, ticker, statement, frequency='annual'):
+        if statement == 'info':
+            if self._info is None:
+                self._info = read_info(self.directory)
+            return dict(self._info.get(ticker.upper(), {}))
+        return self.store(frequency).statement(ticker, statement)
+
+    def tickers(self) -> list:
+        return sorted(self.store('annual').tickers)
+
+
+def build(tickers=None, directory=PANEL_DIR, batch=500) -> int:
+    """Appends the statements and info of `tickers` (every cached ticker, or every ticker of a local provider,
+    by default) to the store, `batch` tickers per generation. Returns the number of tickers stored."""
+    provider = providers.default_provider()
+    if tickers is None:
+        tickers = cache.default_cache().tickers() if provider.cacheable else provider.tickers()
+
+    line_items = store_line_items()
+    stores = {frequency: PanelStore(directory, frequency) for frequency in FREQUENCIES}
+    stored = 0
+    for start in range(0, len(tickers), batch):
+        companies = {frequency: {} for frequency in FREQUENCIES}
+        infos = {}
+        for ticker in tickers[start:start + batch]:
+            requests = [(statement, frequency) for frequency in FREQUENCIES for statement in STATEMENTS] + [('info', 'static')]
+            try:
+                fetched = cache.CachedTicker(ticker).fetch_many(requests, strict=True)
+            except Exception as e:
+                logging.error(f'{ticker} not added to the panel store: {e}')
+                continue
+            if all(fetched[(statement, 'annual')].empty for statement in STATEMENTS):
+                continue
+            for frequency in FREQUENCIES:
+                companies[frequency][ticker] = {statement: fetched[(statement, frequency)] for statement in STATEMENTS}
+            infos[ticker] = fetched[('info', 'static')] or {}
+
+        for frequency in FREQUENCIES:
+            if companies[frequency]:
+                stores[frequency].append(companies[frequency], line_items, infos if frequency == 'annual' else None)
+        stored += len(infos)
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add tickers to the memory-mapped panel store of statement values.')
+    parser.add_argument('tickers', nargs='*', help='Tickers to add (default: every cached ticker, or every ticker of --data-dir).')
+    parser.add_argument('--data-dir', help='Read statements from a directory of local fixture files instead of the cache.')
+    parser.add_argument('--directory', default=PANEL_DIR, help=f'Location of the store (default: {PANEL_DIR}).')
+    args = parser.parse_args()
+
+    if args.data_dir:
+        providers.configure(providers.LocalProvider(args.data_dir))
+
+    start = time.perf_counter()
+    tickers = [ticker.upper() for ticker in args.tickers] or None
+    stored = build(tickers, args.directory)
+
+    for frequency in FREQUENCIES:
+        store = PanelStore(args.directory, frequency)
+        print(f'{frequency}: {len(store)} tickers x {store.values.shape[1]} periods x {len(store.names)} line items')
+    print(f'{stored} tickers added to {args.directory} in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Final
+
+import modules.cache as cache
+import modules.profiling as profiling
+
+
+PIPELINE_WORKERS: Final[int] = int(os.environ.get('FA_PIPELINE_WORKERS', 4))  # Stages running at the same time
+STATEMENT_REQUESTS = [
+    (statement, frequency)
+    for frequency in ('annual', 'quarterly')
+    for statement in ('balance_sheet', 'income_statement', 'cash_flow')
+]
+
+
+class Pipeline:
+    """Named stages and the stages they depend on. A stage runs once its dependencies are done, with their
+    results as arguments, and at most once per pipeline: asking for it again (or for a stage that depends on it)
+    returns the same result. Stages that do not depend on each other run at the same time on a thread pool,
+    which is shut down whenever no stage is running (a pipeline kept for later holds no threads).
+
+        pipeline = Pipeline()
+        pipeline.add('statements', fetch_statements)
+        pipeline.add('ratios', compute_ratios, ['statements'])
+        ratios = pipeline.get('ratios')
+    """
+
+    def __init__(self, workers=PIPELINE_WORKERS):
+        self.workers = workers
+        self._stages = {}  # name -> (function, dependencies)
+        self._futures = {}  # name -> Future, created the first time a stage is asked for
+        self._lock = threading.Lock()
+        self._executor = None
+        self._running = 0  # Stages handed to the executor and not finished yet
+        self._closed = False
+
+    def add(self, name, function, dependencies=()):
+        self._stages[name] = (function, list(dependencies))
+
+    def __contains__(self, name):
+        return name in self._stages
+
+    def start(self, *names):
+        """Schedules the stages (and everything they depend on) without waiting for them."""
+        return [self._future(name) for name in names]
+
+    def get(self, name):
+        """The result of a stage, raises the stage's exception (or the one of a stage it depends on)."""
+        return self._future(name).result()
+
+    def done(self, name) -> bool:
+        with self._lock:
+            future = self._futures.get(name)
+        return future is not None and future.done()
+
+    def close(self, wait=True):
+        """Stops the threads of the pipeline, without `wait` stages still running finish in the background.
+        Stages that have not started are cancelled (asking for them raises CancelledError)."""
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+            pending = [future for future in self._futures.values() if not future.done()]
+        for future in pending:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _future(self, name) -> Future:
+        with self._lock:
+            future = self._futures.get(name)
+            if future is not None:
+                return future
+            if name not in self._stages:
+                raise KeyError(f'Unknown stage {name!r}')
+            future = self._futures[name] = Future()
+
+        function, dependencies = self._stages[name]
+        inputs = [self._future(dependency) for dependency in dependencies]
+
+        # A stage is only handed to the pool once its inputs are done, so no worker ever waits on another stage
+        remaining = [len(inputs)]
+        counter = threading.Lock()
+
+        def input_done(_):
+            with counter:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._submit(name, function, inputs, future)
+
+        if not inputs:
+            self._submit(name, function, inputs, future)
+        for dependency in inputs:
+            dependency.add_done_callback(input_done)
+        return future
+
+    def _submit(self, name, function, inputs, future):
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stage')
+                self._running += 1
+            executor = self._executor
+        if closed:
+            # A dependency finished after close(), a new executor would never be shut down
+            future.cancel()
+            return
+        executor.submit(self._run, name, function, inputs, future)
+
+    def _run(self, name, function, inputs, future):
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                arguments = [dependency.result() for dependency in inputs]
+                with profiling.span(f'stage.{name}'):
+                    future.set_result(function(*arguments))
+            except BaseException as e:
+                future.set_exception(e)
+        finally:
+            self._finished()
+
+    def _finished(self):
+        # Stages that depend on this one were submitted when its result was set, so no stage running means
+        # nothing is left to do until the next get()
+        with self._lock:
+            self._running -= 1
+            executor = None
+            if self._running == 0:
+                executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def ticker_pipeline(ticker, incremental=False, workers=PIPELINE_WORKERS) -> Pipeline:
+    """The stages of the report and the statement exports of one ticker:
+
+        info, statements                      fetched at the same time, shared by the report and the exports
+        company_data -> ratios -> difference, growth, quarterly
+        ratio_chart, growth_chart             drawn at the same time as the rest of the report is put together
+
+    With `incremental`, the annual statements come from the exports when they are current (see
+    modules/incremental.py)."""
+    import modules.analyzer as an
+
+    ticker = ticker.upper()
+    pipeline = Pipeline(workers)
+
+    def statements():
+        if not incremental:
+            return cache.CachedTicker(ticker).fetch_many(STATEMENT_REQUESTS, strict=True)
+
+        import modules.incremental as incremental_refresh
+
+        fetched = cache.CachedTicker(ticker).fetch_many([request for request in STATEMENT_REQUESTS if request[1] == 'quarterly'], strict=True)
+        annual = incremental_refresh.load_statements(ticker, 'annual')
+        return {**fetched, **{(statement, 'annual'): frame for statement, frame in annual.items()}}
+
+    def company_data(fetched, info):
+        analyzer = an.FinancialAnalyzer(ticker)
+        analyzer.info = info or {}
+        datapoints = an.load_datapoints()
+        analyzer.load_data(
+            datapoints['balance_sheet'], datapoints['income_statement'], datapoints['cash_flow'],
+            statements={statement: fetched[(statement, 'annual')] for statement in an.STATEMENT_TITLES}
+        )
+        return analyzer
+
+    def quarterly(analyzer, fetched, _):
+        datapoints = an.load_datapoints()
+        analyzer.load_quarterly_data(
+            datapoints['balance_sheet'], datapoints['income_statement'], datapoints['cash_flow'],
+            statements={statement: fetched[(statement, 'quarterly')] for statement in an.STATEMENT_TITLES}
+        )
+        _, ttm_ratios = analyzer.analyze_quarterly()
+        if not ttm_ratios.empty:
+            analyzer.quarterly_growth_rates()
+        return analyzer
+
+    def ratio_chart(ratios, info):
+        import modules.charts as charts
+
+        return charts.draw_ratio_chart(ratios, (info or {}).get('sector', 'Unknown Sector').lower(), ticker, file_format=charts.chart_format())
+
+    def growth_chart(growth):
+        import modules.charts as charts
+
+        return charts.draw_growth_chart(growth, file_format=charts.chart_format())
+
+    pipeline.add('info', lambda: cache.CachedTicker(ticker).info)
+    pipeline.add('statements', statements)
+    pipeline.add('company_data', company_data, ['statements', 'info'])
+    pipeline.add('ratios', lambda analyzer: analyzer.analyze(), ['company_data'])
+    pipeline.add('difference', lambda analyzer, _: analyzer.difference(), ['company_data', 'ratios'])
+    pipeline.add('growth', lambda analyzer, _: analyzer.growth_rates(), ['company_data', 'ratios'])
+    pipeline.add('quarterly', quarterly, ['company_data', 'statements', 'ratios'])
+    pipeline.add('ratio_chart', ratio_chart, ['ratios', 'info'])
+    pipeline.add('growth_chart', growth_chart, ['growth'])
+    return pipeline
@@ -0,0 +1,104 @@
+import logging
+import os
+from typing import Final
+
+import numpy as np
+import pandas as pd
+
+import modules.cache as cache
+import modules.profiling as profiling
+import modules.providers as providers
+import modules.scheduler as scheduler
+
+
+# Daily closes go through the fetch cache like the statements, one entry per ticker, but are only fresh for
+# a day. Missing tickers are downloaded together, PRICE_BATCH at a time.
+PRICE_YEARS: Final[int] = int(os.environ.get('FA_PRICE_YEARS', 6))  # History requested, covers the four fiscal years and their filing lag
+PRICE_BATCH: Final[int] = int(os.environ.get('FA_PRICE_BATCH', 200))  # Tickers per download
+PRICE_TTL: Final[float] = float(os.environ.get('FA_PRICE_TTL', 24 * 60 * 60))  # seconds
+PRICE_TOLERANCE: Final[str] = '10D'  # A period end takes the last close at most this long before it (weekends, holidays)
+
+
+def _start(years=PRICE_YEARS):
+    # The same start for every request of a day, so cached histories always cover what is asked for
+    return (pd.Timestamp.today().normalize() - pd.DateOffset(years=years)).strftime('%Y-%m-%d')
+
+
+def _download(provider, tickers, start):
+    closes = scheduler.default_scheduler().call(provider.fetch_prices, tickers, start, description=f'prices of {len(tickers)} tickers')
+    profiling.count('network_calls' if provider.cacheable else 'local_reads')
+    return closes
+
+
+def fetch_prices(tickers, years=PRICE_YEARS) -> pd.DataFrame:
+    """Daily closes of `tickers` as a long frame (ticker, date, close), sorted by date. Cached histories are
+    used as they are, the rest is downloaded in batches. A batch that fails is logged and its tickers left out."""
+    provider = providers.default_provider()
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    start = _start(years)
+
+    series = {}
+    missing = tickers
+    if provider.cacheable:
+        store = cache.default_cache()
+        missing = []
+        for ticker in tickers:
+            closes = store.get(ticker, 'prices', 'daily', max_age=PRICE_TTL)
+            if closes is None:
+                missing.append(ticker)
+            else:
+                series[ticker] = closes
+        profiling.count('cache_hits', len(series))
+        profiling.count('cache_misses', len(missing))
+
+    for first in range(0, len(missing), PRICE_BATCH):
+        batch = missing[first:first + PRICE_BATCH]
+        try:
+            closes = _download(provider, batch, start)
+        except scheduler.FetchError as e:
+            logging.error(f'No prices for {len(batch)} tickers: {e}')
+            continue
+
+        closes.columns = [str(column).upper() for column in closes.columns]
+        for ticker in batch:
+            if ticker not in closes.columns:
+                continue
+            history = closes[ticker].dropna()
+            if history.empty:
+                continue
+            series[ticker] = history
+            if provider.cacheable:
+                store.put(ticker, 'prices', 'daily', history)
+
+    if not series:
+        return pd.DataFrame({'ticker': pd.Series(dtype=object), 'date': pd.Series(dtype='datetime64[ns]'), 'close': pd.Series(dtype='float64')})
+
+    long = pd.concat(
+        [pd.DataFrame({'ticker': ticker, 'date': pd.DatetimeIndex(history.index).tz_localize(None), 'close': history.to_numpy(dtype=np.float64)})
+         for ticker, history in series.items()],
+        ignore_index=True,
+    )
+    return long.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+def prices_at(periods: pd.DataFrame, prices: pd.DataFrame, tolerance=PRICE_TOLERANCE) -> np.ndarray:
+    """The close of every (ticker, period_end) row of `periods` on its period end, or the last one before it
+    within `tolerance` (NaN when there is none), in the order of the rows. One as-of join for all tickers."""
+    left = periods[['ticker', 'period_end']].assign(row=np.arange(len(periods)))
+    left['period_end'] = pd.to_datetime(left['period_end'])
+    left = left.sort_values('period_end', kind='stable')
+
+    joined = pd.merge_asof(
+        left, prices, left_on='period_end', right_on='date', by='ticker',
+        direction='backward', tolerance=pd.Timedelta(tolerance),
+    )
+    closes = np.full(len(periods), np.nan)
+    closes[joined['row'].to_numpy()] = joined['close'].to_numpy(dtype=np.float64)
+    return closes
+
+
+def add_prices(panel: pd.DataFrame, years=PRICE_YEARS) -> pd.DataFrame:
+    """`panel` (rows of ticker, period_end and line items) with a Price column, for the valuation ratios of
+    data/ratios.json. The prices of every ticker are fetched together."""
+    prices = fetch_prices(panel['ticker'].unique(), years)
+    return panel.assign(Price=prices_at(panel, prices))
@@ -0,0 +1,123 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+# Spans and counters are only recorded while profiling is enabled. When it is not, span() hands back one
+# shared do-nothing context manager and count() returns right away, so they can stay in the code for good.
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_NULL_SPAN = contextlib.nullcontext()
+
+_origin = time.perf_counter()
+_spans = []
+_counters = defaultdict(int)
+
+
+class _Span:
+    __slots__ = ('name', 'start', 'parent')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        _local.stack.pop()
+        with _lock:
+            _spans.append({
+                'name': self.name,
+                'parent': self.parent,
+                'start_s': self.start - _origin,
+                'duration_s': duration,
+                'thread': threading.current_thread().name,
+            })
+        return False
+
+
+def span(name):
+    """Times the block under `name`: `with profiling.span('analyze'): ...`."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """Decorator version of span(), for functions that are a stage as a whole."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, amount=1):
+    """Adds `amount` to the counter `name` (network calls, rows processed, ...)."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += amount
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable():
+    global _enabled
+    reset()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    global _origin
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _origin = time.perf_counter()
+
+
+def trace(**metadata) -> dict:
+    """Everything recorded since the last reset: the spans in the order they finished, the total time and
+    number of calls per span name, and the counters."""
+    with _lock:
+        spans = list(_spans)
+        counters = dict(_counters)
+
+    totals = {}
+    for recorded in spans:
+        total = totals.setdefault(recorded['name'], {'calls': 0, 'total_s': 0.0})
+        total['calls'] += 1
+        total['total_s'] += recorded['duration_s']
+
+    return {**metadata, 'totals': totals, 'counters': counters, 'spans': spans}
+
+
+def write_trace(path, **metadata) -> dict:
+    recorded = trace(**metadata)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(recorded, file, indent=2)
+    return recorded
@@ -0,0 +1,341 @@
+import argparse
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# (statement, frequency) pairs every provider has to serve
+STATEMENTS = [
+    ('balance_sheet', 'annual'),
+    ('income_statement', 'annual'),
+    ('cash_flow', 'annual'),
+    ('balance_sheet', 'quarterly'),
+    ('income_statement', 'quarterly'),
+    ('cash_flow', 'quarterly'),
+    ('info', 'static'),
+]
+
+
+class DataProvider:
+    """Source of financial statements and company info.
+
+    `fetch` returns statements shaped like yfinance frames (line items as the index, period end dates
+    as the columns, newest first) and the info as a dict. A missing statement is an empty frame, a
+    missing info an empty dict. Providers whose data is already local set `cacheable = False` so the
+    fetch cache is skipped for them.
+    """
+
+    name = 'base'
+    cacheable = True
+
+    def fetch(self, ticker, statement, frequency='annual'):
+        raise NotImplementedError
+
+    def tickers(self) -> list:
+        """Tickers the provider knows about, empty when it cannot list them."""
+        return []
+
+    def fetch_prices(self, tickers, start, end=None) -> pd.DataFrame:
+        """Daily closes of many tickers in one request, a column per ticker indexed by date. Tickers without
+        prices are left out."""
+        return pd.DataFrame()
+
+
+class YFinanceProvider(DataProvider):
+    name = 'yfinance'
+
+    # (statement, frequency) -> yfinance.Ticker attribute
+    ATTRIBUTES = {
+        ('balance_sheet', 'annual'): 'balance_sheet',
+        ('income_statement', 'annual'): 'income_stmt',
+        ('cash_flow', 'annual'): 'cash_flow',
+        ('balance_sheet', 'quarterly'): 'quarterly_balance_sheet',
+        ('income_statement', 'quarterly'): 'quarterly_income_stmt',
+        ('cash_flow', 'quarterly'): 'quarterly_cash_flow',
+        ('info', 'static'): 'info',
+    }
+
+    POOL_SIZE = 16  # Connections kept open to Yahoo, at least the scheduler's concurrency
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # One pooled session for every ticker, so connections (and Yahoo's cookie) are reused between requests
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE)
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+            return self._session
+
+    def fetch(self, ticker, statement, frequency='annual'):
+        import yfinance as yf  # Imported on the first fetch, cached runs never need it
+
+        return getattr(yf.Ticker(ticker, session=self.session), self.ATTRIBUTES[(statement, frequency)])
+
+    def fetch_prices(self, tickers, start, end=None) -> pd.DataFrame:
+        import yfinance as yf
+
+        # One download for all the tickers. Closes are not adjusted, so they match the per-share items as reported
+        data = yf.download(
+            list(tickers), start=start, end=end, interval='1d', auto_adjust=False, actions=False,
+            group_by='column', progress=False, threads=True, session=self.session,
+        )
+        if data is None or data.empty:
+            return pd.DataFrame()
+        closes = data['Close']
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(list(tickers)[0])
+        return closes.dropna(axis=1, how='all')
+
+
+class LocalProvider(DataProvider):
+    """Reads statements from a directory of fixtures, laid out as
+
+        <directory>/<TICKER>/<frequency>_<statement>.csv (or .parquet)
+        <directory>/<TICKER>/info.json
+        <directory>/<TICKER>/prices.csv  (date, close)
+    """
+
+    name = 'local'
+    cacheable = False
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, ticker, statement, frequency='annual'):
+        folder = os.path.join(self.directory, ticker.upper())
+
+        if statement == 'info':
+            try:
+                with open(os.path.join(folder, 'info.json'), 'r') as file:
+                    return json.load(file)
+            except FileNotFoundError:
+                return {}
+
+        path = os.path.join(folder, f'{frequency}_{statement}')
+        if os.path.exists(f'{path}.parquet'):
+            frame = pd.read_parquet(f'{path}.parquet')
+        elif os.path.exists(f'{path}.csv'):
+            frame = pd.read_csv(f'{path}.csv', index_col=0)
+        else:
+            return pd.DataFrame()
+
+        frame.columns = pd.to_datetime(frame.columns)
+        return frame
+
+    def tickers(self) -> list:
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if os.path.isdir(os.path.join(self.directory, name))
+        )
+
+    def fetch_prices(self, tickers, start, end=None) -> pd.DataFrame:
+        closes = {}
+        for ticker in tickers:
+            path = os.path.join(self.directory, ticker.upper(), 'prices.csv')
+            if os.path.exists(path):
+                closes[ticker.upper()] = pd.read_csv(path, index_col=0, parse_dates=True)['close']
+        if not closes:
+            return pd.DataFrame()
+        return pd.DataFrame(closes).loc[start:end]
+
+
+_default_provider = None
+
+
+def default_provider() -> DataProvider:
+    # FA_DATA_DIR points every module at a fixture directory instead of yFinance
+    global _default_provider
+    if _default_provider is None:
+        data_dir = os.environ.get('FA_DATA_DIR')
+        _default_provider = LocalProvider(data_dir) if data_dir else YFinanceProvider()
+    return _default_provider
+
+
+def configure(provider: DataProvider) -> DataProvider:
+    """Replaces the provider used by all modules."""
+    global _default_provider
+    _default_provider = provider
+    return _default_provider
+
+
+# Synthetic data
+
+SECTORS = [
+    'Basic Materials', 'Communication Services', 'Consumer Cyclical', 'Consumer Defensive', 'Energy',
+    'Financial Services', 'Healthcare', 'Industrials', 'Real Estate', 'Technology', 'Utilities',
+]
+
+
+def _period_ends(as_of, fiscal_month, count, months_apart, reporting_lag):
+    # Newest period end that has been reported by `as_of`, then going back `months_apart` months at a time
+    latest = (as_of - pd.Timedelta(days=reporting_lag)).to_period('M')
+    while (latest.month - fiscal_month) % months_apart != 0:
+        latest -= 1
+    return pd.DatetimeIndex([(latest - i * months_apart).to_timestamp(how='end').normalize() for i in range(count)])
+
+
+def synthetic_company(rng, as_of, years=4, quarters=5) -> dict:
+    """Generates one company's statements and info, with line items that are consistent with each other."""
+    sector = SECTORS[rng.integers(len(SECTORS))]
+    fiscal_month = int(rng.choice([3, 6, 9, 12]))
+
+    revenue = np.exp(rng.normal(21, 1.5))
+    growth = rng.normal(0.06, 0.08)
+    profile = {
+        'gross_margin': rng.uniform(0.2, 0.7),
+        'ebitda_share': rng.uniform(0.3, 0.6),
+        'asset_turns': rng.uniform(0.4, 1.25),
+        'current_share': rng.uniform(0.25, 0.5),
+        'cash_share': rng.uniform(0.2, 0.5),
+        'receivable_share': rng.uniform(0.2, 0.4),
+        'inventory_share': rng.uniform(0, 0.3),
+        'equity_share': rng.uniform(0.25, 0.6),
+        'current_ratio': rng.uniform(0.9, 2.5),
+        'debt_share': rng.uniform(0.2, 0.6),
+        'interest_rate': rng.uniform(0.03, 0.06),
+        'capex_share': rng.uniform(0.02, 0.1),
+        'shares': np.exp(rng.normal(19.5, 1)),
+    }
+
+    def statements(periods, flow_scale, growth_per_period):
+        count = len(periods)
+        noise = lambda: 1 + rng.normal(0, 0.03, count)
+        level = (1 + growth_per_period) ** -np.arange(count)  # Newest period first
+
+        rev = revenue * level * noise()
+        assets = revenue * level / profile['asset_turns'] * noise()
+        rev = rev * flow_scale
+
+        gross = rev * profile['gross_margin'] * noise()
+        ebitda = gross * profile['ebitda_share'] * noise()
+        ebit = ebitda - rev * 0.04
+        current_assets = assets * profile['current_share']
+        equity = assets * profile['equity_share'] * noise()
+        liabilities = assets - equity
+        current_liabilities = current_assets / profile['current_ratio'] * noise()
+        debt = liabilities * profile['debt_share']
+        interest = debt * profile['interest_rate'] * flow_scale
+        net_income = (ebit - interest) * 0.79
+        capex = -rev * profile['capex_share'] * noise()
+        shares = profile['shares'] * np.ones(count)
+
+        balance_sheet = {
+            'Total Assets': assets,
+            'Total Non Current Assets': assets - current_assets,
+            'Current Assets': current_assets,
+            'Cash And Cash Equivalents': current_assets * profile['cash_share'],
+            'Accounts Receivable': current_assets * profile['receivable_share'],
+            'Inventory': current_assets * profile['inventory_share'],
+            'Total Liabilities Net Minority Interest': liabilities,
+            'Total Non Current Liabilities Net Minority Interest': liabilities - current_liabilities,
+            'Current Liabilities': current_liabilities,
+            'Accounts Payable': current_liabilities * 0.35,
+            'Total Debt': debt,
+            'Stockholders Equity': equity,
+            'Share Issued': shares,
+        }
+        income_statement = {
+            'Total Revenue': rev,
+            'Cost Of Revenue': rev - gross,
+            'Gross Profit': gross,
+            'EBITDA': ebitda,
+            'EBIT': ebit,
+            'Interest Expense': interest,
+            'Net Income': net_income,
+            'Basic EPS': net_income / shares,
+        }
+        cash_flow = {
+            'Free Cash Flow': ebitda * 0.7 + capex,
+            'Capital Expenditure': capex,
+        }
+
+        return {
+            name: pd.DataFrame(values, index=periods).T.round(2)
+            for name, values in [('balance_sheet', balance_sheet), ('income_statement', income_statement), ('cash_flow', cash_flow)]
+        }
+
+    annual = statements(_period_ends(as_of, fiscal_month, years, 12, 60), 1, growth)
+    quarterly = statements(_period_ends(as_of, fiscal_month, quarters, 3, 40), 0.25, (1 + growth) ** 0.25 - 1)
+
+    company = {(statement, 'annual'): frame for statement, frame in annual.items()}
+    company.update({(statement, 'quarterly'): frame for statement, frame in quarterly.items()})
+
+    # Daily closes (business days) over the annual periods, a random walk around a P/E drawn per company.
+    # Drawn last, so the statements of a seed are the same as before prices were generated.
+    eps = annual['income_statement'].loc['Basic EPS']
+    days = pd.bdate_range(eps.index.min() - pd.Timedelta(days=400), as_of)
+    level = abs(float(eps.iloc[0])) * rng.uniform(8, 30)
+    walk = np.exp(np.cumsum(rng.normal(0, 0.015, len(days))))
+    company[('prices', 'daily')] = pd.Series(level * walk / walk[-1], index=days, name='close').round(2)
+    company[('info', 'static')] = {
+        'sector': sector,
+        'industry': f'{sector} - Synthetic',
+    }
+    return company
+
+
+def generate_synthetic(directory, n_tickers, seed=0, as_of=None, years=4, quarters=5, file_format='csv') -> list:
+    """Writes fixtures for `n_tickers` synthetic companies (SYN00000, SYN00001, ...) that LocalProvider can read.
+
+    The same seed and as_of always give the same data. Returns the generated tickers.
+    """
+    as_of = pd.Timestamp.today().normalize() if as_of is None else pd.Timestamp(as_of)
+    tickers = []
+
+    for i in range(n_tickers):
+        ticker = f'SYN{i:05d}'
+        company = synthetic_company(np.random.default_rng([seed, i]), as_of, years, quarters)
+        company[('info', 'static')].update({
+            'longName': f'Synthetic Company {i}',
+            'website': f'https://example.com/{ticker.lower()}',
+        })
+
+        folder = os.path.join(directory, ticker)
+        os.makedirs(folder, exist_ok=True)
+
+        for (statement, frequency), value in company.items():
+            if statement == 'info':
+                with open(os.path.join(folder, 'info.json'), 'w') as file:
+                    json.dump(value, file)
+            elif statement == 'prices':
+                value.rename_axis('date').to_csv(os.path.join(folder, 'prices.csv'))
+            elif file_format == 'parquet':
+                value.columns = value.columns.strftime('%Y-%m-%d')
+                value.to_parquet(os.path.join(folder, f'{frequency}_{statement}.parquet'))
+            else:
+                value.to_csv(os.path.join(folder, f'{frequency}_{statement}.csv'))
+
+        tickers.append(ticker)
+
+    logging.info(f'Generated {n_tickers} synthetic tickers in {directory}')
+    return tickers
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic statement fixtures for the local data provider.')
+    parser.add_argument('directory', help='Directory the fixtures are written to.')
+    parser.add_argument('-n', '--tickers', type=int, default=100, help='Number of synthetic tickers (default: 100).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Date the data is generated as of, YYYY-MM-DD (default: today).')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    args = parser.parse_args()
+
+    tickers = generate_synthetic(args.directory, args.tickers, seed=args.seed, as_of=args.as_of, file_format=args.format)
+    print(f'Generated {len(tickers)} tickers in {args.directory}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import json
+import logging
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+RATIOS_FILE = 'data/ratios.json'
+# Columns that are not line items but joined from market data (see modules/prices.py). Ratios that need one
+# are left out of the results of frames without it, instead of being all NaN.
+MARKET_COLUMNS = {'Price'}
+
+# Expression tree nodes for a parsed formula
+Number = namedtuple('Number', ['value'])
+Column = namedtuple('Column', ['name'])
+Negate = namedtuple('Negate', ['operand'])
+BinaryOp = namedtuple('BinaryOp', ['op', 'left', 'right'])
+
+# Line item names are runs of words ("Total Revenue", "Cost Of Revenue"), so a name token is
+# everything up to the next operator or parenthesis. This way "Total Revenue" can never match
+# inside a longer name the way the old str.replace substitution did.
+_TOKEN_RE = re.compile(r'\s*(?:(?P<number>\d+\.?\d*|\.\d+)|(?P<name>[A-Za-z_][A-Za-z0-9_ ]*)|(?P<op>[-+*/()]))')
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def _tokenize(formula):
+    tokens = []
+    position = 0
+    formula = formula.rstrip()
+
+    while position < len(formula):
+        match = _TOKEN_RE.match(formula, position)
+        if match is None:
+            raise FormulaError(f'Unexpected character {formula[position]!r} in formula {formula!r}')
+
+        if match.group('number') is not None:
+            tokens.append(('number', float(match.group('number'))))
+        elif match.group('name') is not None:
+            tokens.append(('name', match.group('name').strip()))
+        else:
+            tokens.append(('op', match.group('op')))
+        position = match.end()
+
+    return tokens
+
+
+class _Parser:
+    # expression := term (('+' | '-') term)*
+    # term       := factor (('*' | '/') factor)*
+    # factor     := '-' factor | number | name | '(' expression ')'
+
+    def __init__(self, formula):
+        self.formula = formula
+        self.tokens = _tokenize(formula)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise FormulaError('Empty formula')
+
+        node = self.expression()
+        if self.position != len(self.tokens):
+            raise FormulaError(f'Unexpected {self.peek()[1]!r} in formula {self.formula!r}')
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            node = BinaryOp(self.take()[1], node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            node = BinaryOp(self.take()[1], node, self.factor())
+        return node
+
+    def factor(self):
+        kind, value = self.take()
+
+        if kind is None:
+            raise FormulaError(f'Unexpected end of formula {self.formula!r}')
+        if (kind, value) == ('op', '-'):
+            return Negate(self.factor())
+        if kind == 'number':
+            return Number(value)
+        if kind == 'name':
+            return Column(value)
+        if (kind, value) == ('op', '('):
+            node = self.expression()
+            if self.take() != ('op', ')'):
+                raise FormulaError(f'Missing closing parenthesis in formula {self.formula!r}')
+            return node
+
+        raise FormulaError(f'Unexpected {value!r} in formula {self.formula!r}')
+
+
+def parse_formula(formula: str):
+    """Parses a formula such as "(Current Assets - Inventory) / Current Liabilities" into an expression tree."""
+    return _Parser(formula).parse()
+
+
+def formula_columns(node) -> set:
+    """Returns the line items an expression tree refers to."""
+    if isinstance(node, Column):
+        return {node.name}
+    if isinstance(node, Negate):
+        return formula_columns(node.operand)
+    if isinstance(node, BinaryOp):
+        return formula_columns(node.left) | formula_columns(node.right)
+    return set()
+
+
+def _divide(left, right):
+    # Division by zero gives NaN for that element instead of inf or an exception
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(left, right, out=np.full(np.broadcast(left, right).shape, np.nan), where=right != 0)
+
+
+_OPERATORS = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': _divide,
+}
+
+
+def _compile(node):
+    # Turns the expression tree into nested closures, each one a single array operation
+    if isinstance(node, Number):
+        value = node.value
+        return lambda columns: value
+    if isinstance(node, Column):
+        name = node.name
+        return lambda columns: columns[name]
+    if isinstance(node, Negate):
+        operand = _compile(node.operand)
+        return lambda columns: np.negative(operand(columns))
+
+    operator = _OPERATORS[node.op]
+    left = _compile(node.left)
+    right = _compile(node.right)
+    return lambda columns: operator(left(columns), right(columns))
+
+
+class RatioEngine:
+    """Evaluates a set of ratio formulas as whole-column operations over a frame of line items.
+
+    The rows of the frame can be anything (years of one company, or (ticker, year) pairs for a
+    whole universe), every ratio is computed for all rows at once. Missing line items and division
+    by zero give NaN.
+    """
+
+    def __init__(self, formulas: dict):
+        self.formulas = dict(formulas)
+        self.trees = {name: parse_formula(formula) for name, formula in self.formulas.items()}
+        self.columns = {name: formula_columns(tree) for name, tree in self.trees.items()}
+        self._compiled = {name: _compile(tree) for name, tree in self.trees.items()}
+
+    @property
+    def ratio_names(self) -> list:
+        return list(self.formulas)
+
+    def validate(self, available) -> dict:
+        """Returns {ratio: missing line items} for the ratios that cannot be computed from `available`."""
+        available = set(available)
+        return {name: sorted(columns - available) for name, columns in self.columns.items() if columns - available}
+
+    def evaluate(self, frame: pd.DataFrame) -> pd.DataFrame:
+        absent = MARKET_COLUMNS - set(frame.columns)
+        compiled = {name: function for name, function in self._compiled.items() if not self.columns[name] & absent}
+
+        needed = set().union(*(self.columns[name] for name in compiled)) if compiled else set()
+        columns = {}
+
+        for name in needed:
+            if name in frame.columns:
+                columns[name] = pd.to_numeric(frame[name], errors='coerce').to_numpy(dtype=np.float64)
+            else:
+                columns[name] = np.full(len(frame), np.nan)
+
+        for ratio_name, missing in self.validate(frame.columns).items():
+            if ratio_name in compiled:
+                logging.error(f"{ratio_name.replace('_', ' ')}: Data missing for calculation ({', '.join(missing)}).")
+
+        results = {}
+        for ratio_name, function in compiled.items():
+            result = function(columns)
+            results[ratio_name] = np.broadcast_to(np.asarray(result, dtype=np.float64), (len(frame),))
+
+        return pd.DataFrame(results, index=frame.index)
+
+
+@lru_cache(maxsize=None)
+def load_engine(path: str = RATIOS_FILE) -> RatioEngine:
+    # Formulas are read and parsed once per process
+    with open(path, 'r') as file:
+        return RatioEngine(json.load(file))
+
+
+def compute_ratios(frame: pd.DataFrame, path: str = RATIOS_FILE) -> pd.DataFrame:
+    """Computes every ratio in `path` for every row of `frame` (one row per company and period)."""
+    return load_engine(path).evaluate(frame)
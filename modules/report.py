@@ -0,0 +1,358 @@
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib import colors
+import modules.analyzer as an
+import modules.cache as cache
+import modules.charts as charts
+import modules.outputcache as outputcache
+import modules.pipeline as pipeline
+import modules.profiling as profiling
+import modules.ratios as ratios
+import modules.sectors as sectors
+from datetime import datetime
+from functools import lru_cache
+import os
+import time
+
+REPORT_DIR = 'report'
+REPORT_VERSION = 1  # Bump when the layout changes, so reports made with the old layout are not reused
+
+# Built once per process and shared by every table of every report
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),  # Header background
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),  # Header text color
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),  # Center alignment
+    ('ALIGN', (0, 1), (0, -1), 'LEFT'), # Index Column alligned to the left
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),  # Header font
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),  # Header padding
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),  # Body background
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)  # Grid lines
+])
+
+
+@lru_cache(maxsize=None)
+def shared_styles():
+    return getSampleStyleSheet()
+
+
+def report_date():
+    # Taken for every report, a server runs for longer than a day
+    return datetime.today().strftime('%y-%m-%d')
+
+
+def static_content(date):
+    """The paragraphs that are the same in every report but its date. They are made again for every report:
+    flowables keep layout state while a document is built, so reports built at the same time cannot share them,
+    only the styles are shared."""
+    styles = shared_styles()
+    return {
+        'disclaimer': [
+            Paragraph("Financial Performance Report", styles['Title']),
+            Spacer(1, 12),
+            Paragraph("This report is meant to be used for educational purposes only and is not meant as financial advice. For more information, see documentation.", styles['Normal']),
+            Spacer(1, 24),
+        ],
+        'prepared': [
+            Paragraph("Prepared using data from the last four years, using the 'yFinance' python library.", styles['Italic']),
+            Paragraph(f"Report was made (yy/mm/dd): {date}"),
+            Spacer(1, 48),
+            PageBreak(),
+        ],
+        'appendix': [
+            Paragraph("Appendix", styles['Heading1']),
+            Spacer(1, 12),
+            Paragraph("Additional Disclaimers and Notes:", styles['Heading2']),
+            Paragraph("This report is based on data obtained from reliable sources but is for educational purposes only.", styles['Normal']),
+            Spacer(1, 12),
+            Paragraph("For full financial statements and further analysis, please refer to the official filings of the company. Full financial statements can be exported into .xlsx. See Documentation.", styles['Normal']),
+            Spacer(1, 12),
+            Paragraph("Data Source: https://finance.yahoo.com/", styles['Normal']),
+        ],
+    }
+
+
+def warm_up():
+    """Builds everything reports share (styles, datapoints, chart templates) up front,
+    used as the initializer of report worker processes."""
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    shared_styles()
+    an.load_datapoints()
+    charts.template('ratio')
+    charts.template('growth')
+
+# Function to create a table from a dataframe
+def create_table_from_dataframe(df):
+    """Converts a pandas dataframe into a table for ReportLab with headers and index included."""
+    # Combine the index as the first column
+    df_with_index = df.copy()
+    df_with_index.insert(0, 'Index', df_with_index.index)
+
+    # Convert DataFrame to list of lists
+    data = [df_with_index.columns.tolist()] + df_with_index.values.tolist()
+
+    # Create the table
+    table = Table(data)
+
+    table.setStyle(TABLE_STYLE)
+
+    return table
+
+
+def get_info(ticker_symbol, stages=None):
+    try:
+        info = stages.get('info') if stages is not None else cache.CachedTicker(ticker_symbol).info
+        company_name = info.get("longName", "Unknown Company Name")
+        sector = info.get("sector", "Unknown Sector")
+        industry = info.get("industry", "Unknown Industry")
+        website = info.get("website", "N/A")
+
+        return {
+            "company_name": company_name,
+            "sector": sector,
+            "industry": industry,
+            "website": website
+        }
+        
+    except:
+        print("Unable to fetch company data.")
+        return {
+            "company_name": "Unknown Company Name",
+            "sector": "Unknown Sector",
+            "industry": "Unknown Industry",
+            "website": "N/A"
+            }
+    
+def report_inputs(info, statements):
+    """Hash of everything a report is made from, including how its charts are rendered (FA_CHART_FORMAT, FA_CHART_DPI)."""
+    files = [an.DATAPOINTS_FILE, ratios.RATIOS_FILE, sectors.AVERAGES_FILE, sectors.UNIVERSE_FILE]
+    return outputcache.digest(
+        REPORT_VERSION, {'format': charts.chart_format(), 'dpi': charts.CHART_DPI}, info, statements,
+        {path: outputcache.file_digest(path) for path in files},
+    )
+
+
+# Function to generate the PDF
+def generate_pdf_report(file_name, symbol_request='MSFT', incremental=False, stages=None):
+    # `stages` is the ticker's pipeline when the statements are exported in the same run, so they are only
+    # fetched once (see modules/pipeline.py)
+    if stages is None:
+        with pipeline.ticker_pipeline(symbol_request, incremental=incremental) as stages:
+            return generate_pdf_report(file_name, symbol_request, incremental, stages)
+
+    info = get_info(symbol_request, stages)
+    if info.get('company_name') == "Unknown Company Name":
+        print('Unable to find company.')
+        return False
+
+    # A report made from the same statements, company info, data files and layout (on an earlier day) is linked
+    # to the new name instead of being drawn again, see modules/outputcache.py
+    report_root = os.path.dirname(file_name) or '.'
+    inputs = report_inputs(info, stages.get('statements'))
+    if outputcache.reuse(report_root, 'report', symbol_request, inputs, [file_name]):
+        return True
+
+    # Everything below the tables is started right away, the charts are drawn while the tables are put together
+    stages.start('difference', 'growth', 'quarterly', 'ratio_chart', 'growth_chart')
+
+    doc = SimpleDocTemplate(f'{file_name}.{os.getpid()}.tmp', pagesize=letter)
+    styles = shared_styles()
+    static = static_content(report_date())
+    elements = []
+
+    # Title Page
+    elements.extend(static['disclaimer'])
+    elements.append(Paragraph(info.get("company_name"), styles['Heading2']))
+    elements.append(Paragraph(info.get("sector"), styles['Normal']))
+    elements.append(Paragraph(info.get("industry"), styles['Normal']))
+    elements.append(Paragraph(info.get("website"), styles['Normal']))
+    elements.append(Spacer(1, 48))
+
+    elements.extend(static['prepared'])
+    
+    # Notable Datapoints Page
+    
+    elements.append(Paragraph("Notable Datapoints over the Last 4 Years", styles['Heading1']))
+    elements.append(Spacer(1, 24))
+    # Placeholder for Table
+
+    analysis = stages.get('company_data')
+    company_data = analysis.data.copy()
+
+    company_data['Year'] = company_data['Year'].astype(int)
+    transposed_data = company_data.set_index('Year').T
+    eps = transposed_data.loc['Basic EPS']
+    transposed_data = transposed_data / 1_000_000
+    transposed_data.loc['Basic EPS'] = eps
+    # Replace this with actual DataFrame content
+    elements.append(create_table_from_dataframe(transposed_data))
+    elements.append(Paragraph("Numbers are displayed in millions (USD), where applicable, except for EPS."))
+    elements.append(Spacer(1, 24))
+    
+    elements.append(PageBreak())
+    
+    # Ratios Page
+    elements.append(Paragraph(f"Ratios for {symbol_request}", styles['Heading1']))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph(f"Here are the calculated ratios for {symbol_request} over the last 4 years.", styles['Normal']))
+    elements.append(Spacer(1, 24))
+
+    # Placeholder for Ratios Table
+    company_ratios = stages.get('ratios').copy()  # the charts are drawn from the same table at the same time
+    company_ratios['year'] = company_ratios['year'].astype(int)
+    transposed_ratios = company_ratios.set_index('year').T
+    transposed_ratios = transposed_ratios.round(3)
+
+    index_name_mapping = {
+        'current_ratio': 'Current Ratio',
+        'quick_ratio': 'Quick Ratio',
+        'gross_profit': 'Gross Profit',
+        'net_profit': 'Net Profit',
+        'roa': 'Return on Assets',
+        'roe': 'Return on Equity',
+        'asset_turnover': 'Asset Turnover',
+        'debt_to_equity': 'Debt to Equity',
+        'interest_cover': 'Interest Cover',
+    }
+    transposed_ratios.rename(index=index_name_mapping, inplace=True)
+
+
+    elements.append(create_table_from_dataframe(transposed_ratios))
+    elements.append(Spacer(1, 24))
+    
+    # Comparison to Sector Averages Page
+    elements.append(Paragraph(f"{symbol_request} Compared to Sector Averages", styles['Heading1']))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph("Microsoft's financial ratios compared to its sector averages are presented below. Positive value means that the given datapoint was above the sector average.", styles['Normal']))
+    elements.append(Paragraph("Sector averages are gathered by averaging out around 50 companies in the given sector, may not be accurate.", styles['Italic']))
+    elements.append(Spacer(1, 24))
+    # Placeholder for Sector Comparison Table
+
+    difference = stages.get('difference')
+    difference = difference.set_index('ratio')
+    difference = difference.round(3)
+    difference.rename(index=index_name_mapping, inplace=True)
+
+    elements.append(create_table_from_dataframe(difference))
+    elements.append(Spacer(1, 24))
+
+    # Only when the universe of companies has been built (python -m modules.sectors)
+    percentiles = analysis.df_percentiles.set_index('ratio')
+    if percentiles.notna().any().any():
+        percentiles = percentiles.round(0)
+        percentiles.rename(index=index_name_mapping, inplace=True)
+        elements.append(Paragraph("Percentile rank within the sector (share of the sector's companies with the same or a lower value).", styles['Normal']))
+        elements.append(Spacer(1, 12))
+        elements.append(create_table_from_dataframe(percentiles))
+        elements.append(Spacer(1, 24))
+    
+    elements.append(PageBreak())
+
+    # Growth Rates Page
+    elements.append(Paragraph(f"Growth Rates for {symbol_request}", styles['Heading1']))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph("The growth rates for key financial metrics are summarized below. Number are displayed in percentages.", styles['Normal']))
+    elements.append(Spacer(1, 24))
+    # Placeholder for Growth Rates Table
+
+    growth_rates = stages.get('growth')
+    growth_rates = growth_rates.set_index('ratio')
+    growth_rates = growth_rates.round(2)
+    growth_rates.rename(index=index_name_mapping, inplace=True)
+    elements.append(create_table_from_dataframe(growth_rates))
+    elements.append(Spacer(1, 24))
+
+    elements.append(PageBreak())
+
+    # Trailing Twelve Months Page, only when there are enough quarters for at least one TTM period
+    ttm_ratios = stages.get('quarterly').df_ttm_ratios
+    if not ttm_ratios.empty:
+        elements.append(Paragraph(f"Trailing Twelve Months for {symbol_request}", styles['Heading1']))
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph("Ratios over the last four reported quarters up to each quarter end (income and cash flow items summed, balance sheet items as of the quarter end).", styles['Normal']))
+        elements.append(Spacer(1, 24))
+
+        transposed_ttm = ttm_ratios.set_index('period').T.round(3)
+        transposed_ttm.columns = transposed_ttm.columns.strftime('%Y-%m-%d')
+        transposed_ttm.rename(index=index_name_mapping, inplace=True)
+        elements.append(create_table_from_dataframe(transposed_ttm))
+        elements.append(Spacer(1, 24))
+
+        yoy_growth = analysis.df_yoy_growth.set_index('ratio').round(2)
+        if not yoy_growth.columns.empty:
+            yoy_growth.rename(index=index_name_mapping, inplace=True)
+            elements.append(Paragraph("Year-over-year growth of the quarterly ratios, in percentages.", styles['Normal']))
+            elements.append(Spacer(1, 12))
+            elements.append(create_table_from_dataframe(yoy_growth))
+            elements.append(Spacer(1, 24))
+
+        elements.append(PageBreak())
+
+    # Plots Page
+    elements.append(Paragraph("Visual Analysis of Key Metrics", styles['Heading1']))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph("The following graphs represent the trends and patterns of important financial metrics.", styles['Normal']))
+
+    # The charts are rendered into memory buffers that only live until the document is built
+    chart_format = charts.chart_format()
+    ratio_chart = stages.get('ratio_chart')
+    elements.append(charts.flowable(ratio_chart, 3*72, 6*72, chart_format))
+
+    growth_chart = stages.get('growth_chart')
+    elements.append(charts.flowable(growth_chart, 8*72, 4*72, chart_format))
+    
+    elements.append(PageBreak())
+
+    # Appendix Page
+    elements.extend(static['appendix'])
+    
+    # Build the document with all the elements, into a temporary file that is renamed when complete so a
+    # PDF in report/ is never half written
+    try:
+        with profiling.span('pdf.build'):
+            doc.build(elements)
+        os.replace(doc.filename, file_name)
+    finally:
+        if os.path.exists(doc.filename):
+            os.remove(doc.filename)
+    outputcache.record(report_root, 'report', symbol_request, inputs, [file_name])
+    ratio_chart.close()
+    growth_chart.close()
+
+    return True
+
+
+def report_path(ticker, directory=REPORT_DIR):
+    return os.path.join(directory, f"financial_report_{ticker}_{report_date()}.pdf")
+
+
+def _timed_report(ticker, directory, incremental):
+    start = time.perf_counter()
+    try:
+        if generate_pdf_report(report_path(ticker, directory), ticker, incremental=incremental) is False:
+            raise LookupError('Unable to find company.')
+    except Exception as e:
+        return ticker, f'{type(e).__name__}: {e}', time.perf_counter() - start
+    return ticker, None, time.perf_counter() - start
+
+
+def generate_reports(tickers, workers=None, directory=REPORT_DIR, incremental=False):
+    """Builds the reports of many tickers on a process pool. Every worker builds the shared styles, static
+    content and chart templates once, and (ticker, error or None, seconds) is yielded for every report as
+    soon as its PDF is in `directory`, in the order they finish."""
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(tickers) <= 1:
+        warm_up()
+        for ticker in tickers:
+            yield _timed_report(ticker, directory, incremental)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tickers)), initializer=warm_up) as executor:
+        futures = [executor.submit(_timed_report, ticker, directory, incremental) for ticker in tickers]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,127 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Final
+
+import modules.profiling as profiling
+
+
+# Every request that goes over the network passes through one scheduler per process. The rate is shared by
+# all tickers and threads, main.py divides it between worker processes.
+FETCH_RATE: Final[float] = float(os.environ.get('FA_FETCH_RATE', 2))  # Requests per second, 0 for no limit
+FETCH_BURST: Final[int] = int(os.environ.get('FA_FETCH_BURST', 5))  # Requests that can go out at once after a quiet period
+FETCH_CONCURRENCY: Final[int] = int(os.environ.get('FA_FETCH_CONCURRENCY', 4))  # Requests running at the same time
+FETCH_RETRIES: Final[int] = int(os.environ.get('FA_FETCH_RETRIES', 3))
+EMPTY_RETRIES: Final[int] = 1  # Extra requests for an empty answer, which is usually the real one
+BACKOFF_BASE: Final[float] = float(os.environ.get('FA_FETCH_BACKOFF', 1.0))  # Seconds, doubled on every retry
+BACKOFF_MAX: Final[float] = 30.0
+MIN_RATE_SHARE: Final[float] = 0.1  # The rate is never lowered below this share of the configured rate
+
+
+class FetchError(Exception):
+    """A request that still failed after every retry."""
+
+
+class FetchScheduler:
+    """Runs requests at most `rate` per second (a token bucket of `burst` requests) with at most `concurrency`
+    of them at the same time, retrying failures with jittered exponential backoff.
+
+    A failure halves the rate and every success raises it again a little, up to `rate`, so bulk runs settle
+    near the fastest rate that is not throttled.
+    """
+
+    def __init__(self, rate=FETCH_RATE, burst=FETCH_BURST, concurrency=FETCH_CONCURRENCY, retries=FETCH_RETRIES,
+                 backoff=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'retries': self.retried, 'failures': self.failures, 'rate': self.rate}
+
+    def call(self, function, *args, description='request', retry_if=None):
+        """Returns function(*args), raises FetchError when every attempt failed. A result `retry_if` is true
+        for (an empty answer, which is also how a throttled server answers) is asked for again EMPTY_RETRIES
+        times and then returned as it is. It is not a failure, so it does not lower the rate."""
+        failures = empties = 0
+        while True:
+            self._acquire()
+            try:
+                with self._slots:
+                    result = function(*args)
+            except Exception as e:
+                self._slow_down()
+                if failures == self.retries:
+                    with self._lock:
+                        self.failures += 1
+                    raise FetchError(f'{description} failed after {failures + empties + 1} attempts: {type(e).__name__}: {e}') from e
+
+                # Full jitter, so requests that failed together do not retry together
+                delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** failures))
+                failures += 1
+                logging.warning(f'{description} failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s')
+            else:
+                if retry_if is None or empties == EMPTY_RETRIES or not retry_if(result):
+                    self._speed_up()
+                    return result
+
+                delay = random.uniform(0, min(self.backoff_max, self.backoff))
+                empties += 1
+                logging.info(f'{description} came back empty, retrying in {delay:.1f}s')
+
+            with self._lock:
+                self.retried += 1
+            profiling.count('fetch_retries')
+            time.sleep(delay)
+
+    def _acquire(self):
+        if self.max_rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _slow_down(self):
+        with self._lock:
+            self.rate = max(self.max_rate * MIN_RATE_SHARE, self.rate / 2)
+
+    def _speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+_default_scheduler = None
+
+
+def default_scheduler() -> FetchScheduler:
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = FetchScheduler()
+    return _default_scheduler
+
+
+def configure(**settings) -> FetchScheduler:
+    """Replaces the scheduler shared by all modules, settings not given keep their defaults."""
+    global _default_scheduler
+    _default_scheduler = FetchScheduler(**settings)
+    return _default_scheduler
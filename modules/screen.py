@@ -0,0 +1,385 @@
+import argparse
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import modules.cache as cache
+import modules.providers as providers
+import modules.ratios as ratios
+import modules.sectors as sectors
+
+
+PANEL_YEARS = 4
+PANEL_FILE = 'screen_panel.npz'  # Kept in the cache directory, rebuilt when older than the cache ttl
+
+# Screen expression tree nodes, on top of the arithmetic nodes of modules.ratios
+Lagged = namedtuple('Lagged', ['name', 'lag'])
+Compare = namedtuple('Compare', ['op', 'left', 'right'])
+Logical = namedtuple('Logical', ['op', 'left', 'right'])
+Not = namedtuple('Not', ['operand'])
+Rank = namedtuple('Rank', ['direction', 'count', 'expression'])
+
+_TOKEN_RE = re.compile(r'\s*(?:(?P<number>\d+\.?\d*|\.\d+)|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<op>>=|<=|==|!=|[-+*/()<>,\[\]]))')
+KEYWORDS = {'and', 'or', 'not', 'top', 'bottom', 'by'}
+
+_COMPARISONS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+
+class ScreenError(ValueError):
+    pass
+
+
+def _tokenize(query):
+    tokens = []
+    position = 0
+    query = query.rstrip()
+
+    while position < len(query):
+        match = _TOKEN_RE.match(query, position)
+        if match is None:
+            raise ScreenError(f'Unexpected character {query[position]!r} in {query!r}')
+
+        if match.group('number') is not None:
+            tokens.append(('number', float(match.group('number'))))
+        elif match.group('name') is not None:
+            name = match.group('name')
+            tokens.append(('keyword', name.lower()) if name.lower() in KEYWORDS else ('name', name))
+        else:
+            tokens.append(('op', match.group('op')))
+        position = match.end()
+
+    return tokens
+
+
+class _Parser:
+    # query       := [condition] [','] [('top' | 'bottom') number 'by' expression]
+    # condition   := conjunction ('or' conjunction)*
+    # conjunction := negation ('and' negation)*
+    # negation    := 'not' negation | comparison
+    # comparison  := expression [('>' | '>=' | '<' | '<=' | '==' | '!=') expression]
+    # expression, term and factor as in modules.ratios, with 'name[n]' for the value n periods earlier
+    # and '(' condition ')' so conditions can be grouped
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, token):
+        if self.take() != token:
+            raise ScreenError(f'Expected {token[1]!r} in {self.query!r}')
+
+    def parse(self):
+        condition = None
+        rank = None
+
+        if self.peek()[0] not in (None, 'keyword') or self.peek() == ('keyword', 'not'):
+            condition = self.condition()
+            if not _is_condition(condition):
+                raise ScreenError(f'{self.query!r} does not compare anything')
+        if self.peek() == ('op', ','):
+            self.take()
+        if self.peek() in (('keyword', 'top'), ('keyword', 'bottom')):
+            direction = self.take()[1]
+            kind, count = self.take()
+            if kind != 'number':
+                raise ScreenError(f'Expected the number of results after {direction!r} in {self.query!r}')
+            self.expect(('keyword', 'by'))
+            rank = Rank(direction, int(count), self.expression())
+
+        if self.position != len(self.tokens):
+            raise ScreenError(f'Unexpected {self.peek()[1]!r} in {self.query!r}')
+        if condition is None and rank is None:
+            raise ScreenError('Empty screen')
+        return condition, rank
+
+    def condition(self):
+        node = self.conjunction()
+        while self.peek() == ('keyword', 'or'):
+            self.take()
+            node = Logical('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.peek() == ('keyword', 'and'):
+            self.take()
+            node = Logical('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.peek() == ('keyword', 'not'):
+            self.take()
+            return Not(self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        node = self.expression()
+        if self.peek()[0] == 'op' and self.peek()[1] in _COMPARISONS:
+            node = Compare(self.take()[1], node, self.expression())
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            node = ratios.BinaryOp(self.take()[1], node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            node = ratios.BinaryOp(self.take()[1], node, self.factor())
+        return node
+
+    def factor(self):
+        kind, value = self.take()
+
+        if kind is None:
+            raise ScreenError(f'Unexpected end of {self.query!r}')
+        if (kind, value) == ('op', '-'):
+            return ratios.Negate(self.factor())
+        if kind == 'number':
+            return ratios.Number(value)
+        if kind == 'name':
+            if self.peek() == ('op', '['):
+                self.take()
+                kind, lag = self.take()
+                if kind != 'number':
+                    raise ScreenError(f'Expected a number of periods after {value}[ in {self.query!r}')
+                self.expect(('op', ']'))
+                return Lagged(value, int(lag))
+            return Lagged(value, 0)
+        if (kind, value) == ('op', '('):
+            node = self.condition()
+            self.expect(('op', ')'))
+            return node
+
+        raise ScreenError(f'Unexpected {value!r} in {self.query!r}')
+
+
+def _is_condition(node):
+    return isinstance(node, (Compare, Logical, Not))
+
+
+def parse_screen(query: str):
+    """Parses a screen such as "roe > 0.15 and debt_to_equity < 1, top 50 by interest_cover" into
+    (condition, rank), either of them can be None."""
+    return _Parser(query).parse()
+
+
+class RatioPanel:
+    """Ratios of a universe as one dense array of shape (ticker, period, ratio). Period 0 is the newest fiscal
+    year of each ticker, 1 the one before and so on. Missing values are NaN."""
+
+    def __init__(self, values, tickers, ratio_names, years, sector_names):
+        self.values = values
+        self.tickers = np.asarray(tickers)
+        self.ratio_names = list(ratio_names)
+        self.years = years  # (ticker, period), 0 where the ticker has no such period
+        self.sectors = np.asarray(sector_names)
+        self._index = {name: i for i, name in enumerate(self.ratio_names)}
+
+    @classmethod
+    def from_universe(cls, universe: pd.DataFrame):
+        """Builds the panel from the rows of sectors.load_universe (per ticker, newest year first)."""
+        ratio_names = [column for column in universe.columns if column not in sectors.UNIVERSE_COLUMNS]
+        codes, tickers = pd.factorize(universe['ticker'])
+        periods = universe.groupby(codes).cumcount().to_numpy()
+        shape = (len(tickers), int(periods.max()) + 1 if len(periods) else 0)
+
+        values = np.full(shape + (len(ratio_names),), np.nan)
+        values[codes, periods] = universe[ratio_names].to_numpy(dtype=np.float64)
+        years = np.zeros(shape, dtype=np.int16)
+        years[codes, periods] = universe['year'].to_numpy()
+        sector_names = universe.groupby(codes, sort=True)['sector'].first().to_numpy()
+
+        return cls(values, tickers, ratio_names, years, sector_names)
+
+    def save(self, path):
+        np.savez(path, values=self.values, tickers=self.tickers.astype(str), ratio_names=np.array(self.ratio_names),
+                 years=self.years, sectors=self.sectors.astype(str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays['values'], arrays['tickers'], arrays['ratio_names'].tolist(), arrays['years'], arrays['sectors'])
+
+    def ratio(self, name, lag=0):
+        """(ticker, period) array of one ratio, `lag` periods earlier than each period."""
+        if name not in self._index:
+            raise ScreenError(f"Unknown ratio {name!r}, choose from {', '.join(self.ratio_names)}")
+        if lag < 0:
+            raise ScreenError(f'{name}[{lag}] refers to a later period, lags count periods back')
+        values = self.values[:, :, self._index[name]]
+        if lag == 0:
+            return values
+        lagged = np.full(values.shape, np.nan)
+        if lag < values.shape[1]:
+            # No period of the panel goes back that far otherwise, every value is missing
+            lagged[:, :values.shape[1] - lag] = values[:, lag:]
+        return lagged
+
+    def evaluate(self, node):
+        if node is None:
+            return np.ones(self.values.shape[:2], dtype=bool)
+        if isinstance(node, ratios.Number):
+            return node.value
+        if isinstance(node, Lagged):
+            return self.ratio(node.name, node.lag)
+        if isinstance(node, ratios.Negate):
+            return np.negative(self.evaluate(node.operand))
+        if isinstance(node, ratios.BinaryOp):
+            return ratios._OPERATORS[node.op](self.evaluate(node.left), self.evaluate(node.right))
+        if isinstance(node, Compare):
+            # Comparisons with NaN are False, so companies missing a ratio never pass a filter on it
+            with np.errstate(invalid='ignore'):
+                return _COMPARISONS[node.op](self.evaluate(node.left), self.evaluate(node.right))
+        if isinstance(node, Logical):
+            operator = np.logical_and if node.op == 'and' else np.logical_or
+            return operator(self.evaluate(node.left), self.evaluate(node.right))
+        if isinstance(node, Not):
+            return np.logical_not(self.evaluate(node.operand))
+        raise ScreenError(f'Cannot evaluate {node!r}')
+
+    def screen(self, query, all_periods=False) -> pd.DataFrame:
+        """Rows of the tickers (and periods) that pass the screen, ranked when it has a top/bottom clause.
+        Only the newest period of every ticker is screened unless `all_periods`."""
+        condition, rank = parse_screen(query) if isinstance(query, str) else query
+
+        mask = np.broadcast_to(self.evaluate(condition), self.values.shape[:2]).copy()
+        mask &= self.years > 0
+        if not all_periods:
+            mask[:, 1:] = False
+
+        tickers, periods = np.nonzero(mask)
+        score = None
+        if rank is not None:
+            score = np.broadcast_to(np.asarray(self.evaluate(rank.expression), dtype=np.float64), mask.shape)[tickers, periods]
+            finite = np.isfinite(score)
+            tickers, periods, score = tickers[finite], periods[finite], score[finite]
+
+            count = min(rank.count, len(score))
+            keys = -score if rank.direction == 'top' else score
+            best = np.argpartition(keys, count - 1)[:count] if count else np.array([], dtype=int)
+            best = best[np.argsort(keys[best], kind='stable')]
+            tickers, periods, score = tickers[best], periods[best], score[best]
+
+        result = pd.DataFrame({
+            'ticker': self.tickers[tickers],
+            'sector': self.sectors[tickers],
+            'year': self.years[tickers, periods],
+        })
+        if score is not None:
+            result['score'] = score
+        result[self.ratio_names] = self.values[tickers, periods]
+        return result
+
+
+def build_panel(tickers=None, years=PANEL_YEARS) -> RatioPanel:
+    return RatioPanel.from_universe(sectors.load_universe(tickers, years=years, with_prices=True))
+
+
+def load_panel(rebuild=False, years=PANEL_YEARS) -> RatioPanel:
+    """The panel of every cached ticker, read from the cache directory when it is younger than the cache ttl
+    (and than a day, for the prices in the valuation ratios). With a local provider it is always built from the
+    fixtures, nothing is written."""
+    import modules.prices as prices
+
+    if not providers.default_provider().cacheable:
+        return build_panel(years=years)
+
+    store = cache.default_cache()
+    path = os.path.join(store.directory, PANEL_FILE)
+    max_age = min(store.ttl, prices.PRICE_TTL)
+    if not rebuild and os.path.exists(path) and time.time() - os.path.getmtime(path) <= max_age:
+        return RatioPanel.load(path)
+
+    panel = build_panel(years=years)
+    os.makedirs(store.directory, exist_ok=True)
+    panel.save(path)
+    return panel
+
+
+def export_results(results: pd.DataFrame, path):
+    """Writes screen results as .csv, .xlsx or .parquet, depending on the extension of `path`."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.xlsx':
+        results.to_excel(path, index=False, sheet_name='Screen')
+    elif extension == '.parquet':
+        results.to_parquet(path, index=False)
+    else:
+        results.to_csv(path, index=False)
+
+
+def run_screen(query, tickers=None, output=None, all_periods=False, rebuild=False) -> pd.DataFrame:
+    """Screens the cached universe (or only `tickers`), prints the results and writes them to `output`."""
+    try:
+        parsed = parse_screen(query)
+    except ScreenError as e:
+        print(f'Invalid screen: {e}')
+        return None
+
+    start = time.perf_counter()
+    panel = build_panel(tickers) if tickers else load_panel(rebuild)
+    loaded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        results = panel.screen(parsed, all_periods=all_periods)
+    except ScreenError as e:
+        print(f'Invalid screen: {e}')
+        return None
+    screened = time.perf_counter() - start
+
+    with pd.option_context('display.max_rows', 100, 'display.max_columns', None, 'display.width', 200):
+        print(results.round(3).to_string(index=False) if not results.empty else 'No matches.')
+    print(f"\n{len(results)} of {len(panel.tickers)} tickers, screened in {screened * 1000:.1f} ms (panel loaded in {loaded * 1000:.0f} ms)")
+    logging.info(f'Screen {query!r}: {len(results)} results in {screened * 1000:.1f} ms')
+
+    if output:
+        export_results(results, output)
+        print(f'Results written to {output}')
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Screen every cached ticker by its ratios.',
+        epilog='Example: python -m modules.screen "roe > 0.15 and debt_to_equity < 1, top 50 by interest_cover"'
+    )
+    parser.add_argument('query', help="Conditions on the ratios (and, or, not, + - * /, name[1] for the year before) and/or 'top N by' / 'bottom N by' an expression.")
+    parser.add_argument('-o', '--output', help='Write the results to a .csv, .xlsx or .parquet file.')
+    parser.add_argument('--all-periods', action='store_true', help='Screen every fiscal year in the panel, not only the newest.')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the panel from the cache instead of reusing it.')
+    parser.add_argument('--data-dir', help='Screen a directory of local fixture files instead of the cache.')
+    args = parser.parse_args()
+
+    if args.data_dir:
+        providers.configure(providers.LocalProvider(args.data_dir))
+
+    run_screen(args.query, output=args.output, all_periods=args.all_periods, rebuild=args.rebuild)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import logging
+import os
+from functools import lru_cache
+from typing import Final
+
+import numpy as np
+import pandas as pd
+
+import modules.cache as cache
+import modules.providers as providers
+import modules.ratios as ratios
+
+
+AVERAGES_FILE: Final[str] = 'data/averages.csv'
+# Ratios of every company in the cached universe, written by `python -m modules.sectors`
+UNIVERSE_FILE: Final[str] = os.environ.get('FA_UNIVERSE_FILE', 'data/universe_ratios.csv')
+UNIVERSE_COLUMNS = ['ticker', 'sector', 'year']
+
+
+def read_averages(path=AVERAGES_FILE) -> pd.DataFrame:
+    """The hand-maintained averages as a ratio x sector frame. Names are stripped and lowercased, so rows and
+    columns are found by name and the order in the file does not matter."""
+    averages = pd.read_csv(path, skipinitialspace=True)
+    averages.columns = averages.columns.str.strip().str.lower()
+    averages['ratios'] = averages['ratios'].str.strip()
+    return averages.set_index('ratios').astype('float64')
+
+
+class SectorBenchmarks:
+    """Sector averages of every ratio, looked up by (sector, ratio) name, and optionally the sorted ratios of
+    all companies in each sector for percentile ranks."""
+
+    def __init__(self, averages: pd.DataFrame, panel: pd.DataFrame = None):
+        self.averages = averages  # ratio x sector
+        self.panel = panel  # ticker, sector, year and one column per ratio, or None
+        self.distributions = {}  # (sector, ratio) -> sorted values of the sector
+
+        if panel is not None and not panel.empty:
+            ratio_names = [column for column in panel.columns if column not in UNIVERSE_COLUMNS]
+            long = panel.melt(id_vars='sector', value_vars=ratio_names, var_name='ratio')
+            long = long[np.isfinite(long['value'])].sort_values(['sector', 'ratio', 'value'])
+            for (sector, ratio), values in long.groupby(['sector', 'ratio'], sort=False)['value']:
+                self.distributions[(sector, ratio)] = values.to_numpy()
+
+    @classmethod
+    def from_universe(cls, panel: pd.DataFrame, statistic='mean', averages: pd.DataFrame = None):
+        """Benchmarks recomputed from a universe of companies with one group-by. `statistic` is anything
+        DataFrameGroupBy.agg takes ('mean', 'median', ...). Pass `averages` to keep other averages and only
+        take the percentile ranks from the universe."""
+        if averages is None:
+            ratio_names = [column for column in panel.columns if column not in UNIVERSE_COLUMNS]
+            averages = panel.groupby('sector')[ratio_names].agg(statistic).T
+        return cls(averages, panel)
+
+    def average(self, sector, ratio) -> float:
+        try:
+            return float(self.averages.at[ratio, sector.lower()])
+        except KeyError:
+            return float('nan')
+
+    def sector_averages(self, sector) -> pd.Series:
+        """Averages of every ratio for one sector (NaN for a sector that is not known)."""
+        sector = sector.lower()
+        if sector not in self.averages.columns:
+            logging.warning(f'No sector averages for "{sector}"')
+            return pd.Series(np.nan, index=self.averages.index)
+        return self.averages[sector]
+
+    def percentile_rank(self, sector, ratio, values) -> np.ndarray:
+        """Share of the sector's companies (in %) with a ratio at or below each of `values`, NaN when the
+        sector has no universe data."""
+        values = np.asarray(values, dtype='float64')
+        distribution = self.distributions.get((sector.lower(), ratio))
+        if distribution is None or len(distribution) == 0:
+            return np.full(values.shape, np.nan)
+
+        ranks = np.searchsorted(distribution, values, side='right') / len(distribution) * 100
+        return np.where(np.isnan(values), np.nan, ranks)
+
+    def statistics(self, percentiles=(0.1, 0.25, 0.5, 0.75, 0.9)) -> pd.DataFrame:
+        """Count, mean, std, min, percentiles and max of every ratio per sector from the universe."""
+        if self.panel is None:
+            return pd.DataFrame()
+        ratio_names = [column for column in self.panel.columns if column not in UNIVERSE_COLUMNS]
+        return self.panel.groupby('sector')[ratio_names].describe(percentiles=list(percentiles))
+
+
+@lru_cache(maxsize=None)
+def default_benchmarks() -> SectorBenchmarks:
+    """The hand-maintained averages, with percentile ranks from the universe file when it has been built.
+    Loaded once per process."""
+    averages = read_averages()
+    if os.path.exists(UNIVERSE_FILE):
+        return SectorBenchmarks.from_universe(pd.read_csv(UNIVERSE_FILE), averages=averages)
+    return SectorBenchmarks(averages)
+
+
+def _stored_statements(ticker, requests):
+    # Only what is already there is read, building the universe never goes to the network
+    provider = providers.default_provider()
+    if not provider.cacheable:
+        return {request: provider.fetch(ticker, *request) for request in requests}
+
+    store = cache.default_cache()
+    return {request: store.get(ticker, *request, max_age=float('inf')) for request in requests}
+
+
+def load_universe(tickers=None, years=1, with_prices=False) -> pd.DataFrame:
+    """Ratios of the newest `years` fiscal years of every ticker (all cached tickers by default, or every
+    ticker of a local provider), as one frame with ticker, sector and year columns. The ratios of all
+    companies are computed with a single evaluation of the formulas. `with_prices` adds the valuation
+    ratios, with the closes of all tickers fetched in batches (see modules/prices.py)."""
+    import modules.analyzer as an
+
+    if tickers is None:
+        provider = providers.default_provider()
+        tickers = cache.default_cache().tickers() if provider.cacheable else provider.tickers()
+
+    datapoints = an.load_datapoints()
+    requests = [(statement, 'annual') for statement in an.STATEMENT_TITLES] + [('info', 'static')]
+
+    frames = []
+    for ticker in tickers:
+        stored = _stored_statements(ticker, requests)
+        sector = (stored.pop(('info', 'static')) or {}).get('sector')
+        if not sector:
+            continue
+
+        data = an.build_data({statement: frame for (statement, _), frame in stored.items()}, datapoints, years)
+        if data.empty:
+            continue
+        data.insert(0, 'period_end', data.index)
+        data.insert(0, 'sector', sector.lower())
+        data.insert(0, 'ticker', ticker.upper())
+        frames.append(data.reset_index(drop=True))
+
+    if not frames:
+        return pd.DataFrame(columns=UNIVERSE_COLUMNS)
+
+    panel = pd.concat(frames, ignore_index=True)
+    if with_prices:
+        import modules.prices as prices
+
+        panel = prices.add_prices(panel)
+    universe = pd.concat([panel[['ticker', 'sector', 'Year']], ratios.load_engine().evaluate(panel)], axis=1)
+    return universe.rename(columns={'Year': 'year'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute sector benchmarks from every cached ticker.')
+    parser.add_argument('--data-dir', help='Use a directory of local fixture files instead of the cache.')
+    parser.add_argument('--years', type=int, default=1, help='Fiscal years per company (default: 1, the newest).')
+    parser.add_argument('--statistic', default='mean', choices=['mean', 'median'], help='Statistic for --averages (default: mean).')
+    parser.add_argument('--output', default=UNIVERSE_FILE, help=f'Universe file used for percentile ranks (default: {UNIVERSE_FILE}).')
+    parser.add_argument('--averages', help='Also write recomputed averages, in the layout of data/averages.csv, to this file.')
+    args = parser.parse_args()
+
+    if args.data_dir:
+        providers.configure(providers.LocalProvider(args.data_dir))
+
+    universe = load_universe(years=args.years)
+    if universe.empty:
+        print('No cached tickers with statements and a sector found.')
+        return
+
+    universe.to_csv(args.output, index=False)
+    print(f"{universe['ticker'].nunique()} tickers in {universe['sector'].nunique()} sectors written to {args.output}")
+
+    benchmarks = SectorBenchmarks.from_universe(universe, statistic=args.statistic)
+    if args.averages:
+        benchmarks.averages.rename_axis('ratios').to_csv(args.averages)
+        print(f'Sector {args.statistic}s written to {args.averages}')
+
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(benchmarks.averages.round(3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Final
+from urllib.parse import parse_qs, urlsplit
+
+import modules.analyzer as an
+import modules.cache as cache
+import modules.pipeline as pipeline
+import modules.providers as providers
+import modules.ratios as ratios
+import modules.sectors as sectors
+import modules.statements as st
+from modules.logs import configure_logging
+
+
+HOST: Final[str] = os.environ.get('FA_SERVER_HOST', '127.0.0.1')
+PORT: Final[int] = int(os.environ.get('FA_SERVER_PORT', 8000))
+# Analyses and reports are kept in memory this long (seconds), the statements behind them stay in the fetch cache
+RESULT_TTL: Final[float] = float(os.environ.get('FA_SERVER_TTL', 60 * 60))
+MAX_RESULTS: Final[int] = 256
+
+TABLES = {
+    'data': 'data',
+    'ratios': 'df_ratios',
+    'difference': 'df_difference',
+    'percentiles': 'df_percentiles',
+    'growth': 'df_growth_rates',
+}
+FREQUENCIES = ['annual', 'quarterly']
+REPORT_STAGES = ['info', 'statements', 'company_data', 'ratios', 'difference', 'growth', 'quarterly', 'ratio_chart', 'growth_chart']
+
+
+class ResultStore:
+    """Results kept in memory by key, computed at most once at a time: a request for a key that is already
+    being computed waits for that computation instead of starting its own. Failures are handed to everyone
+    waiting but never stored, so the next request tries again. `evicted` is called with every value that is
+    dropped or replaced."""
+
+    def __init__(self, ttl=RESULT_TTL, max_entries=MAX_RESULTS, evicted=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evicted = evicted
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._results = OrderedDict()  # key -> (time computed, value)
+        self._in_flight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    def get(self, key, compute, refresh=False):
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and not refresh and time.monotonic() - entry[0] <= self.ttl:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        # Only the request that created the future computes, the others wait for its result
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            with self._lock:
+                del self._in_flight[key]
+            raise
+
+        dropped = []
+        with self._lock:
+            if key in self._results:
+                dropped.append(self._results[key][1])
+            self._results[key] = (time.monotonic(), value)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                dropped.append(self._results.popitem(last=False)[1][1])
+            del self._in_flight[key]
+        future.set_result(value)
+        self._evict(dropped)
+        return value
+
+    def discard(self, key, value):
+        """Drops `value` if it is still the result of `key`, so the next request computes it again."""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None or entry[1] is not value:
+                return
+            del self._results[key]
+        self._evict([value])
+
+    def _evict(self, values):
+        if self.evicted is not None:
+            for value in values:
+                self.evicted(value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._results),
+                'in_flight': len(self._in_flight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+            }
+
+
+class AnalysisService:
+    """Everything the HTTP API serves, computed once per ticker and kept warm between requests.
+
+    Every ticker has one pipeline (modules/pipeline.py) in the result store, and every endpoint takes what it
+    needs from it: concurrent requests for the statements, ratios and report of the same ticker share one
+    fetch and one analysis, and the report is built from the analyzer the other endpoints use."""
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else ResultStore(evicted=lambda stages: stages.close(wait=False))
+        self.started = time.time()
+
+    def warm_up(self, report=True):
+        # The datapoints, formulas and sector benchmarks are loaded before the first request, not during it
+        an.load_datapoints()
+        ratios.load_engine()
+        sectors.default_benchmarks()
+        if report:
+            from modules.report import warm_up
+
+            warm_up()
+
+    def stages(self, ticker, refresh=False) -> pipeline.Pipeline:
+        """The pipeline of `ticker`, shared by every request for it."""
+        def create():
+            stages = pipeline.ticker_pipeline(ticker)
+            # Runs once every stage the report takes is done, so it never waits on the pipeline's own threads
+            stages.add('report', lambda *_: self._build_report(ticker, stages), REPORT_STAGES)
+            return stages
+
+        return self.store.get(ticker, create, refresh)
+
+    def _get(self, ticker, stages, name):
+        try:
+            return stages.get(name)
+        except Exception:
+            # A failed stage stays failed in its pipeline, the next request starts a new one
+            self.store.discard(ticker, stages)
+            raise
+
+    def statements(self, ticker, statement, frequency='annual', refresh=False):
+        if statement not in an.STATEMENT_TITLES:
+            raise ValueError(f'Unknown statement "{statement}", expected one of {", ".join(an.STATEMENT_TITLES)}.')
+        if frequency not in FREQUENCIES:
+            raise ValueError(f'Unknown frequency "{frequency}", expected one of {", ".join(FREQUENCIES)}.')
+
+        stages = self.stages(ticker, refresh)
+        frame = self._get(ticker, stages, 'statements').get((statement, frequency))
+        if frame is None or frame.empty:
+            self.store.discard(ticker, stages)
+            raise LookupError(f'No {frequency} {an.STATEMENT_TITLES[statement]} found for {ticker}.')
+        return frame
+
+    def analysis(self, ticker, refresh=False) -> an.FinancialAnalyzer:
+        """The loaded analyzer of `ticker` with the ratios, differences and growth rates computed."""
+        stages = self.stages(ticker, refresh)
+        analyzer = self._get(ticker, stages, 'company_data')
+        if analyzer.data.empty:
+            self.store.discard(ticker, stages)
+            raise LookupError(f'No statements found for {ticker}.')
+        self._get(ticker, stages, 'difference')
+        self._get(ticker, stages, 'growth')
+        return analyzer
+
+    def table(self, ticker, name, refresh=False):
+        return getattr(self.analysis(ticker, refresh), TABLES[name])
+
+    def report(self, ticker, refresh=False) -> bytes:
+        """The PDF report of `ticker`, built on the first request."""
+        stages = self.stages(ticker, refresh)
+        return self._get(ticker, stages, 'report')
+
+    @staticmethod
+    def _build_report(ticker, stages):
+        from modules.report import generate_pdf_report
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'{ticker}.pdf')
+            if generate_pdf_report(path, ticker, stages=stages) is False:
+                raise LookupError(f'Unable to find company {ticker}.')
+            with open(path, 'rb') as file:
+                return file.read()
+
+    def health(self) -> dict:
+        return {
+            'status': 'ok',
+            'uptime_s': round(time.time() - self.started, 1),
+            'provider': providers.default_provider().name,
+            'results': self.store.stats(),
+            'fetch_cache': cache.default_cache().stats(),
+        }
+
+
+def _frame_json(frame, orient='records') -> bytes:
+    return frame.to_json(orient=orient, date_format='iso').encode()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Routes:
+
+        GET /health
+        GET /statements/<TICKER>/<statement>?frequency=annual|quarterly
+        GET /data|ratios|difference|percentiles|growth/<TICKER>
+        GET /report/<TICKER>
+
+    Add ?refresh=1 to compute a result again instead of using the one in memory.
+    """
+
+    service: AnalysisService = None  # Set by serve()
+    server_version = 'FinancialAnalysis/1.0'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        refresh = query.get('refresh', '0') not in ('0', 'false', '')
+
+        try:
+            if parts == ['health']:
+                return self._send(200, json.dumps(self.service.health()).encode())
+
+            if len(parts) < 2:
+                return self._error(404, f'Unknown path {url.path}')
+            route, ticker = parts[0], parts[1].upper()
+
+            if route == 'statements' and len(parts) == 3:
+                frame = self.service.statements(ticker, parts[2], query.get('frequency', 'annual'), refresh)
+                return self._send(200, _frame_json(st.as_frame(frame), 'split'))
+            if route in TABLES and len(parts) == 2:
+                return self._send(200, _frame_json(self.service.table(ticker, route, refresh)))
+            if route == 'report' and len(parts) == 2:
+                return self._send(200, self.service.report(ticker, refresh), 'application/pdf')
+
+            return self._error(404, f'Unknown path {url.path}')
+        except LookupError as e:
+            return self._error(404, str(e))
+        except ValueError as e:
+            return self._error(400, str(e))
+        except Exception as e:
+            logging.exception(f'Failed to serve {self.path}')
+            return self._error(500, f'{type(e).__name__}: {e}')
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode())
+
+    def log_message(self, format, *args):
+        # Access log to the log file instead of stderr
+        logging.info(f'{self.address_string()} - {format % args}')
+
+
+def serve(host=HOST, port=PORT, service=None, warm=True):
+    """Serves the API until interrupted."""
+    service = service if service is not None else AnalysisService()
+    if warm:
+        service.warm_up()
+
+    handler = type('Handler', (RequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f'Serving on http://{host}:{server.server_address[1]} (Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve statements, ratios, differences, growth rates and reports over a local HTTP API.')
+    parser.add_argument('--host', default=HOST, help=f'Address to listen on (default: {HOST}).')
+    parser.add_argument('--port', type=int, default=PORT, help=f'Port to listen on (default: {PORT}).')
+    parser.add_argument('--data-dir', help='Serve a directory of local fixture files instead of yFinance.')
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.data_dir:
+        providers.configure(providers.LocalProvider(args.data_dir))
+
+    serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import threading
+from typing import Final
+
+import numpy as np
+import pandas as pd
+
+
+# float32 halves the memory again but keeps only about 7 significant digits, fine for screening a universe,
+# not for exporting statements
+STATEMENT_DTYPE: Final[str] = os.environ.get('FA_STATEMENT_DTYPE', 'float64')
+
+# Every line item name is stored once per process, statements only keep int16 codes into this list. Codes
+# are only ever appended, so a code stays valid for the life of the process.
+_line_items = []
+_codes = {}
+_lock = threading.Lock()
+
+
+def _intern(names) -> np.ndarray:
+    codes = np.empty(len(names), dtype=np.int16)
+    with _lock:
+        for position, name in enumerate(names):
+            code = _codes.get(name)
+            if code is None:
+                code = _codes[name] = len(_line_items)
+                _line_items.append(name)
+            codes[position] = code
+    return codes
+
+
+class StatementFrame:
+    """One financial statement as a line item x period matrix of floats (NaN where a value is missing), with
+    the line items as interned codes and the periods (newest first) as datetime64 days.
+
+    It has the parts of the DataFrame interface the program uses on statements (empty, index, columns, shape,
+    len) and converts to the yfinance layout with to_frame(). Pickles carry the names instead of the codes.
+    """
+
+    __slots__ = ('values', 'codes', 'periods')
+
+    def __init__(self, values: np.ndarray, codes: np.ndarray, periods: np.ndarray):
+        self.values = values
+        self.codes = codes
+        self.periods = periods
+
+    @classmethod
+    def from_frame(cls, frame, dtype=None) -> 'StatementFrame':
+        """Converts a yfinance-shaped frame (line items x periods). Values that are not numbers ('N/A', None)
+        become NaN, periods are sorted newest first and duplicate line items keep their first row."""
+        if isinstance(frame, StatementFrame):
+            return frame if dtype is None or frame.values.dtype == dtype else frame.astype(dtype)
+        if frame is None or frame.empty:
+            return cls.empty_frame(dtype)
+
+        frame = frame[~frame.index.duplicated()]
+        periods = pd.to_datetime(frame.columns)
+        order = np.argsort(periods.values)[::-1]
+
+        values = frame.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=dtype or STATEMENT_DTYPE)[:, order]
+        return cls(
+            np.ascontiguousarray(values),
+            _intern([str(name) for name in frame.index]),
+            periods.values[order].astype('datetime64[D]'),
+        )
+
+    @classmethod
+    def from_arrays(cls, values: np.ndarray, line_items, periods) -> 'StatementFrame':
+        """Wraps a line item x period matrix (newest period first) without copying it."""
+        return cls(values, _intern(list(line_items)), np.asarray(periods, dtype='datetime64[D]'))
+
+    @classmethod
+    def empty_frame(cls, dtype=None) -> 'StatementFrame':
+        return cls(np.empty((0, 0), dtype=dtype or STATEMENT_DTYPE), np.empty(0, dtype=np.int16), np.empty(0, dtype='datetime64[D]'))
+
+    @property
+    def empty(self) -> bool:
+        return self.values.size == 0
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.codes.nbytes + self.periods.nbytes
+
+    @property
+    def index(self) -> pd.Index:
+        """The line item names."""
+        with _lock:
+            return pd.Index([_line_items[code] for code in self.codes], dtype=object)
+
+    @property
+    def columns(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.periods.astype('datetime64[ns]'))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def astype(self, dtype) -> 'StatementFrame':
+        return StatementFrame(self.values.astype(dtype), self.codes, self.periods)
+
+    def latest(self, periods=None) -> 'StatementFrame':
+        """The newest `periods` periods, None keeps all of them."""
+        if periods is None or periods >= len(self.periods):
+            return self
+        return StatementFrame(self.values[:, :periods], self.codes, self.periods[:periods])
+
+    def select(self, line_items) -> np.ndarray:
+        """Values of `line_items` (names, in that order) as a line item x period matrix, NaN rows for line items
+        the statement does not have."""
+        positions = {code: position for position, code in enumerate(self.codes)}
+        with _lock:
+            wanted = [_codes.get(name) for name in line_items]
+        rows = np.array([positions.get(code, -1) for code in wanted], dtype=np.intp)
+
+        selected = np.full((len(rows), len(self.periods)), np.nan, dtype=self.values.dtype)
+        found = rows >= 0
+        selected[found] = self.values[rows[found]]
+        return selected
+
+    def merge(self, older: 'StatementFrame') -> 'StatementFrame':
+        """This statement with the periods and line items only `older` has added (values here win), newest first."""
+        if older is None or older.empty:
+            return self
+        if self.empty:
+            return older
+
+        periods = np.unique(np.concatenate([self.periods, older.periods]))[::-1]
+        codes = np.concatenate([self.codes, older.codes[~np.isin(older.codes, self.codes)]])
+        values = np.full((len(codes), len(periods)), np.nan, dtype=np.result_type(self.values, older.values))
+
+        values[np.ix_(_positions(codes, older.codes), _positions(periods, older.periods))] = older.values
+        cells = np.ix_(np.arange(len(self.codes)), _positions(periods, self.periods))
+        values[cells] = np.where(np.isnan(self.values), values[cells], self.values)
+
+        return StatementFrame(values, codes, periods)
+
+    def to_frame(self) -> pd.DataFrame:
+        """The statement in the yfinance layout: line items as the index, period ends as the columns."""
+        return pd.DataFrame(self.values, index=self.index, columns=self.columns)
+
+    def __getstate__(self):
+        return {'values': self.values, 'line_items': list(self.index), 'periods': self.periods}
+
+    def __setstate__(self, state):
+        self.values = state['values']
+        self.codes = _intern(state['line_items'])
+        self.periods = state['periods']
+
+    def __repr__(self):
+        return f'<StatementFrame {self.shape[0]} line items x {len(self.periods)} periods, {self.values.dtype}>'
+
+
+def _positions(target, keys) -> np.ndarray:
+    lookup = {key: position for position, key in enumerate(target.tolist())}
+    return np.array([lookup[key] for key in keys.tolist()], dtype=np.intp)
+
+
+def compact(frame, dtype=None) -> StatementFrame:
+    """Any statement (DataFrame, StatementFrame or None) as a StatementFrame."""
+    return StatementFrame.from_frame(frame, dtype)
+
+
+def as_frame(statement) -> pd.DataFrame:
+    """Any statement as a DataFrame in the yfinance layout, for writers that need one."""
+    if isinstance(statement, StatementFrame):
+        return statement.to_frame()
+    return statement if statement is not None else pd.DataFrame()
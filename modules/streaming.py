@@ -0,0 +1,102 @@
+import os
+import queue
+import threading
+import time
+from typing import Final
+
+
+# Items waiting between two stages. A stage blocks when the next one is this far behind, so the number of
+# tickers in memory stays the same however many are streamed.
+STREAM_BUFFER: Final[int] = int(os.environ.get('FA_STREAM_BUFFER', 8))
+_DONE = object()
+
+
+class _Failed:
+    # An exception of the items feeding a stage, raised again where the stage is consumed
+    def __init__(self, error):
+        self.error = error
+
+
+class Item:
+    """A ticker on its way through the stages: the value of the last stage, or the error that stopped it (later
+    stages pass it on untouched)."""
+
+    __slots__ = ('ticker', 'value', 'error', 'started')
+
+    def __init__(self, ticker, value=None, error=None, started=None):
+        self.ticker = ticker
+        self.value = value
+        self.error = error
+        self.started = time.perf_counter() if started is None else started
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+
+def source(tickers):
+    """The items to stream, `tickers` can be any iterable (read as the first stage needs them)."""
+    return (Item(ticker) for ticker in tickers)
+
+
+def stage(items, function, workers=1, buffer=STREAM_BUFFER):
+    """Applies function(ticker, value) to every item on `workers` threads and yields the items in the order
+    they finish, at most `buffer` of them waiting to be taken. An exception of `function` fails that item only,
+    one of `items` itself (a failing source or stage before) is raised to the consumer and ends the stream.
+
+        for item in stage(stage(source(tickers), fetch, workers=4), write):
+            print(item.ticker, item.error)
+    """
+    results = queue.Queue(maxsize=max(1, buffer))
+    stop = threading.Event()
+    pull = threading.Lock()
+    iterator = iter(items)
+
+    def put(value):
+        # Gives up when the consumer went away, instead of waiting forever on a full queue
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work():
+        try:
+            while not stop.is_set():
+                with pull:
+                    try:
+                        item = next(iterator, _DONE)
+                    except Exception as e:
+                        put(_Failed(e))
+                        break
+                if item is _DONE:
+                    break
+                if item.error is None:
+                    try:
+                        item.value = function(item.ticker, item.value)
+                    except Exception as e:
+                        item.value = None
+                        item.error = f'{type(e).__name__}: {e}'
+                if not put(item):
+                    break
+        finally:
+            put(_DONE)
+
+    threads = [threading.Thread(target=work, daemon=True, name='stream') for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        running = len(threads)
+        while running:
+            item = results.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, _Failed):
+                raise item.error
+            else:
+                yield item
+    finally:
+        stop.set()
@@ -0,0 +1,168 @@
+import logging
+import math
+import os
+from typing import Final
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+import modules.getstatements as gs
+import modules.statements as st
+
+
+# Workbooks are written with openpyxl's write-only mode: rows go straight to temporary files as they are
+# appended instead of building every cell in memory, and number formats are set when a cell is written
+AMOUNT_FORMAT: Final[str] = '#,##0'
+DECIMAL_FORMAT: Final[str] = '#,##0.00'
+DATE_FORMAT: Final[str] = 'yyyy-mm-dd'
+MAX_SHEET_NAME: Final[int] = 31  # Excel's limit
+LAYOUTS = ['sheets', 'long']
+
+SHEET_NAMES = {'balance_sheet': 'Balance Sheet', 'income_statement': 'Income Statement', 'cash_flow': 'Cash Flow'}
+# Keys of the dicts GetStatements.fetch_all returns, per frequency
+STATEMENT_KEYS = {
+    'annual': {'balance_sheet': 'balance_sheet', 'income_statement': 'income_statement', 'cash_flow': 'cash_flow'},
+    'quarterly': {'balance_sheet': 'qbalance_sheet', 'income_statement': 'qicome_statement', 'cash_flow': 'qcash_flow'},
+}
+LONG_COLUMNS = ['ticker', 'statement', 'frequency', 'period_end', 'line_item', 'value']
+
+
+def _value(value):
+    # openpyxl would write NaN as a number Excel cannot open
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def _cell(sheet, value, number_format=None, bold=False):
+    cell = WriteOnlyCell(sheet, value=value)
+    if number_format:
+        cell.number_format = number_format
+    if bold:
+        cell.font = Font(bold=True)
+    return cell
+
+
+def _number_format(values):
+    # Whole amounts get thousands separators, per-share items and other fractions two decimals
+    whole = all(not math.isfinite(value) or value == int(value) for value in values)
+    return AMOUNT_FORMAT if whole else DECIMAL_FORMAT
+
+
+def write_frame(sheet, frame):
+    """Appends a statement (a StatementFrame, or a DataFrame with line items as the index and period ends as the
+    columns) to a write-only sheet, laid out like DataFrame.to_excel so pd.read_excel(index_col=0) reads it back
+    the same."""
+    frame = st.compact(frame)
+    sheet.append([None] + [_cell(sheet, column.to_pydatetime(), DATE_FORMAT, bold=True) for column in frame.columns])
+
+    values = frame.values.astype('float64')
+    for label, row in zip(frame.index, values):
+        number_format = _number_format(row)
+        sheet.append([_cell(sheet, label, bold=True)] + [_cell(sheet, _value(float(value)), number_format) for value in row])
+
+
+def _save(workbook, path):
+    # Saved next to the target and renamed, so a workbook is never half written
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        workbook.save(temporary)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_workbook(path, sheets: dict):
+    """Writes {sheet name: statement frame} to one workbook."""
+    workbook = Workbook(write_only=True)
+    for name, frame in sheets.items():
+        write_frame(workbook.create_sheet(name[:MAX_SHEET_NAME]), frame)
+    _save(workbook, path)
+
+
+class ConsolidatedWorkbook:
+    """One workbook for many tickers, written one ticker at a time so only the current ticker's statements
+    are in memory. The 'sheets' layout has a sheet per ticker and statement (quarterly ones end in (Q)), the
+    'long' layout a single Statements sheet with a row per ticker, statement, period and line item.
+
+        with ConsolidatedWorkbook('watchlist.xlsx') as workbook:
+            workbook.add('MSFT', annual, quarterly)
+    """
+
+    def __init__(self, path, layout='sheets'):
+        if layout not in LAYOUTS:
+            raise ValueError(f'Unknown layout {layout!r}, expected one of {", ".join(LAYOUTS)}')
+        self.path = path
+        self.layout = layout
+        self.tickers = []
+        self.workbook = Workbook(write_only=True)
+        self.long_sheet = None
+        if layout == 'long':
+            self.long_sheet = self.workbook.create_sheet('Statements')
+            self.long_sheet.append([_cell(self.long_sheet, column, bold=True) for column in LONG_COLUMNS])
+
+    def add(self, ticker, annual: dict, quarterly: dict):
+        """Adds a ticker's statements, as returned by GetStatements.fetch_all."""
+        ticker = ticker.upper()
+        statements = {
+            (statement, frequency): group.get(key)
+            for frequency, group in (('annual', annual), ('quarterly', quarterly))
+            for statement, key in STATEMENT_KEYS[frequency].items()
+        }
+
+        if self.layout == 'sheets':
+            for (statement, frequency), frame in statements.items():
+                name = f'{ticker} {SHEET_NAMES[statement]}' + (' (Q)' if frequency == 'quarterly' else '')
+                write_frame(self.workbook.create_sheet(name[:MAX_SHEET_NAME]), frame)
+        else:
+            import modules.dataset as dataset
+
+            long = dataset.statements_to_long(ticker, statements)
+            sheet = self.long_sheet
+            for row in long.itertuples(index=False):
+                sheet.append([
+                    row.ticker, row.statement, row.frequency,
+                    _cell(sheet, row.period_end.to_pydatetime(), DATE_FORMAT),
+                    row.line_item,
+                    _cell(sheet, float(row.value), _number_format([row.value])),
+                ])
+
+        self.tickers.append(ticker)
+
+    def close(self):
+        if self.workbook is None:
+            return
+        if not self.workbook.worksheets:
+            self.workbook.create_sheet('Statements')
+        _save(self.workbook, self.path)
+        self.workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def export_watchlist(tickers, path, layout='sheets') -> dict:
+    """Fetches every ticker's statements and writes them to one workbook as they arrive. A ticker that fails
+    is left out. Returns {ticker: error or None}."""
+    results = {}
+    with ConsolidatedWorkbook(path, layout) as workbook:
+        for ticker in tickers:
+            try:
+                statements = gs.GetStatements(ticker).fetch_all()
+                if all(frame.empty for frame in statements['annual'].values()):
+                    raise LookupError(f'No statements found for {ticker}.')
+                workbook.add(ticker, statements['annual'], statements['quarterly'])
+            except Exception as e:
+                logging.error(f'{ticker} left out of {path}: {e}')
+                results[ticker] = f'{type(e).__name__}: {e}'
+                continue
+            results[ticker] = None
+    return results